@@ -41,3 +41,5 @@ elif re.match(r"^vocms127\.cern\.ch$", myhost):
 data.extconfigurl = 'http://git.cern.ch/pubweb/?p=CAFServicesConfig.git;a=blob_plain;f=cmsweb-rest-config.json'
 #data.loggingLevel = 10
 #data.loggingFile = '/tmp/CRAB.log'
+#Directory where to save the state of the job logs parsing for crab status (kept only in memory if not set)
+#data.statuscachedir = '%s/state/crabserver/statuscache/' % __file__.rsplit('/', 4)[0]
@@ -1,2 +1,5 @@
 --https://github.com/dmwm/CRABServer/issues/4154
 ALTER TABLE TASKS ADD (tm_maxjobruntime BIGINT, tm_numcores BIGINT, tm_maxmemory BIGINT, tm_priority BIGINT);
+
+--Index used by the filemetadata GET of the files of a given job
+CREATE INDEX fmd_taskjobtype_idx ON filemetadata (tm_taskname, panda_job_id, fmd_type);
@@ -65,3 +65,6 @@ alter table tasks add (tm_secondary_input_dataset VARCHAR(500));
 
 --Changes that will be needed for version 3.3.1511
 alter table tasks add (tm_primary_dataset VARCHAR(255));
+
+--Index used by the filemetadata GET of the files of a given job
+CREATE INDEX fmd_taskjobtype_idx ON filemetadata (tm_taskname, panda_job_id, fmd_type);
@@ -3,6 +3,7 @@ import os
 import re
 import sys
 import time
+import errno
 import glob
 import shutil
 import urllib
@@ -28,10 +29,85 @@ if not os.environ.get('TEST_DONT_REDIRECT_STDOUT', False):
 os.close(logfd)
 
 
+## Size of the chunks in which the DAG files are read.
+READ_BUFFER_SIZE = 1024*1024
+
+
 def printLog(msg):
     print("%s: %s" % (datetime.utcnow(), msg))
 
 
+def iterLinesWithOffsets(fd, bufsize=READ_BUFFER_SIZE):
+    """
+    Yield (offset, line) for each line of the file opened in fd, reading the
+    file in chunks of bufsize bytes. The offset is the position of the first
+    byte of the line in the file, the line includes the trailing newline.
+    """
+    offset = 0
+    rest = ''
+    while True:
+        chunk = fd.read(bufsize)
+        if not chunk:
+            break
+        lines = (rest + chunk).split('\n')
+        rest = lines.pop()
+        for line in lines:
+            yield offset, line + '\n'
+            offset += len(line) + 1
+    if rest:
+        yield offset, rest
+
+
+def checkFreeSpace(filename, nbytes):
+    """
+    Raise an IOError if the file system of filename doesn't have nbytes bytes
+    available for us. This is only a first check, writing can still fail if
+    the user is over quota.
+    """
+    st = os.statvfs(os.path.dirname(os.path.abspath(filename)))
+    available = st.f_bavail * st.f_frsize
+    if available < nbytes:
+        msg = "Not enough space to rewrite %s (%d bytes needed, %d available)." % (filename, nbytes, available)
+        raise IOError(errno.ENOSPC, msg)
+
+
+def applyEdits(filename, edits):
+    """
+    Apply the edits, a list of (offset, old, new) tuples sorted by offset, to
+    the file. If all the edits keep the length of the text they replace, the
+    file is patched in place; otherwise a new file is written next to it and
+    renamed over it, after checking that there is enough space for it.
+    """
+    if not edits:
+        return
+    if all(len(old) == len(new) for _, old, new in edits):
+        with open(filename, 'r+b') as fd:
+            for offset, _, new in edits:
+                fd.seek(offset)
+                fd.write(new)
+        return
+    size = os.path.getsize(filename)
+    checkFreeSpace(filename, size + sum(len(new) - len(old) for _, old, new in edits))
+    tmpname = filename + ".tmp"
+    with open(filename, 'rb') as infd:
+        with open(tmpname, 'wb') as outfd:
+            position = 0
+            for offset, old, new in edits:
+                ## Copy (in chunks) up to the edit, then write the replacement.
+                while position < offset:
+                    chunk = infd.read(min(READ_BUFFER_SIZE, offset - position))
+                    outfd.write(chunk)
+                    position += len(chunk)
+                infd.seek(len(old), os.SEEK_CUR)
+                position += len(old)
+                outfd.write(new)
+            shutil.copyfileobj(infd, outfd, READ_BUFFER_SIZE)
+            outfd.flush()
+            os.fsync(outfd.fileno())
+    shutil.copymode(filename, tmpname)
+    os.rename(tmpname, filename)
+
+
 def adjustPostScriptExitStatus(resubmitJobIds):
     """
     Edit the DAG .nodes.log file changing the POST script exit code from 0|2 to 1
@@ -47,6 +123,11 @@ def adjustPostScriptExitStatus(resubmitJobIds):
     for the job ids in resubmitJobIds and replace the return value to 1.
     If resubmitJobIds = True, only replace return values 2 (not 0) to 1.
 
+    The file is read in chunks and the return values are overwritten in place
+    (they have always one digit). We can not write a new file and rename it,
+    because the running shadows keep their event log file descriptors open;
+    patching in place also means that we never need more disk space (or quota).
+
     Note:
           When DAGMan runs in recovery mode, the DAG .nodes.log file is used to
     identify the nodes that have completed and should not be resubmitted.
@@ -61,74 +142,43 @@ def adjustPostScriptExitStatus(resubmitJobIds):
     terminator_re = re.compile(r"^\.\.\.$")
     event_re = re.compile(r"016 \(-?\d+\.\d+\.\d+\) \d+/\d+ \d+:\d+:\d+ POST Script terminated.")
     if resubmitAllFailed:
-        retvalue_re = re.compile(r"Normal termination \(return value 2\)")
+        retvalue_re = re.compile(r"Normal termination \(return value (2)\)")
     else:
-        retvalue_re = re.compile(r"Normal termination \(return value [0|2]\)")
+        retvalue_re = re.compile(r"Normal termination \(return value ([02])\)")
     node_re = re.compile(r"DAG Node: Job(\d+)")
-    ra_buffer = []
-    alt = None
-    output = ''
+    if not resubmitAllFailed:
+        resubmitJobIds = set(resubmitJobIds)
     adjustedJobIds = []
-    for line in open("RunJobs.dag.nodes.log").readlines():
-        if len(ra_buffer) == 0:
-            m = terminator_re.search(line)
-            if m:
-                ra_buffer.append(line)
-            else:
-                output += line
-        elif len(ra_buffer) == 1:
-            m = event_re.search(line)
-            if m:
-                ra_buffer.append(line)
-            else:
-                for l in ra_buffer:
-                    output += l
-                output += line
-                ra_buffer = []
-        elif len(ra_buffer) == 2:
-            m = retvalue_re.search(line)
-            if m:
-                ra_buffer.append("        (1) Normal termination (return value 1)\n")
-                alt = line
-            else:
-                for l in ra_buffer:
-                    output += l
-                output += line
-                ra_buffer = []
-        elif len(ra_buffer) == 3:
-            m = node_re.search(line)
-            printLog("%s %s %s %s" % (line, m, m.groups(), resubmitJobIds))
-            if m and (resubmitAllFailed or (m.groups()[0] in resubmitJobIds)):
-                printLog("%s %s" % (m.groups()[0], resubmitJobIds))
-                adjustedJobIds.append(m.groups()[0])
-                for l in ra_buffer:
-                    output += l
-            else:
-                for l in ra_buffer[:-1]:
-                    output += l
-                output += alt
-            output += line
-            ra_buffer = []
-        else:
-            output += line
-    if ra_buffer:
-        for l in ra_buffer:
-            output += l
-    # This is a curious dance!  If the user is out of quota, we don't want
-    # to fail halfway into writing the file.  OTOH, we can't write into a temp
-    # file and an atomic rename because the running shadows keep their event log
-    # file descriptors open.  Accordingly, we write the file once (to see if we)
-    # have enough quota space, then rewrite "the real file" after deleting the
-    # temporary one.  There's a huge race condition here, but it seems to be the
-    # best we can do given the constraints.  Note that we don't race with the
-    # shadow as we have a write lock on the file itself.
-    output_fd = open("RunJobs.dag.nodes.log.tmp", "w")
-    output_fd.write(output)
-    output_fd.close()
-    os.unlink("RunJobs.dag.nodes.log.tmp")
-    output_fd = open("RunJobs.dag.nodes.log", "w")
-    output_fd.write(output)
-    output_fd.close()
+    ## Number of lines of the sequence above matched so far, and the position
+    ## in the file of the return value to change.
+    state = 0
+    retvalueOffset = None
+    with open("RunJobs.dag.nodes.log", 'rb') as fd:
+        with open("RunJobs.dag.nodes.log", 'r+b') as patchfd:
+            for offset, line in iterLinesWithOffsets(fd):
+                if state == 1:
+                    state = 2 if event_re.search(line) else 0
+                elif state == 2:
+                    m = retvalue_re.search(line)
+                    if m:
+                        retvalueOffset = offset + m.start(1)
+                        state = 3
+                    else:
+                        state = 0
+                elif state == 3:
+                    m = node_re.search(line)
+                    if m and (resubmitAllFailed or (m.groups()[0] in resubmitJobIds)):
+                        printLog("Changing the POST script exit status of job %s to 1." % (m.groups()[0]))
+                        adjustedJobIds.append(m.groups()[0])
+                        ## The patched bytes were already read, so this doesn't
+                        ## interfere with the reading.
+                        patchfd.seek(retvalueOffset)
+                        patchfd.write('1')
+                    state = 0
+                if state == 0 and terminator_re.search(line):
+                    state = 1
+            patchfd.flush()
+            os.fsync(patchfd.fileno())
     return adjustedJobIds
 
 
@@ -159,11 +209,13 @@ def adjustMaxRetries(adjustJobIds, ad):
     ## resubmitJobIds argument and change the maximum retries to the current retry
     ## count + CRAB_NumAutomJobRetries.
     retry_re = re.compile(r'RETRY Job([0-9]+) ([0-9]+) ')
-    output = ""
+    edits = []
     adjustAll = (adjustJobIds == True)
+    if not adjustAll:
+        adjustJobIds = set(adjustJobIds)
     numAutomJobRetries = int(ad.get('CRAB_NumAutomJobRetries', 2))
-    with open("RunJobs.dag", 'r') as fd:
-        for line in fd.readlines():
+    with open("RunJobs.dag", 'rb') as fd:
+        for offset, line in iterLinesWithOffsets(fd):
             match_retry_re = retry_re.search(line)
             if match_retry_re:
                 jobId = match_retry_re.groups()[0]
@@ -178,10 +230,10 @@ def adjustMaxRetries(adjustJobIds, ad):
                             maxRetries = int(match_retry_re.groups()[1]) + (1 + numAutomJobRetries)
                         except ValueError:
                             maxRetries = numAutomJobRetries
-                    line = retry_re.sub(r'RETRY Job%s %d ' % (jobId, maxRetries), line)
-            output += line
-    with open("RunJobs.dag", 'w') as fd:
-        fd.write(output)
+                    edits.append((offset + match_retry_re.start(), match_retry_re.group(0), \
+                                  'RETRY Job%s %d ' % (jobId, maxRetries)))
+    ## Patched in place if the numbers of retries keep their number of digits.
+    applyEdits("RunJobs.dag", edits)
 
 
 def makeWebDir(ad):
@@ -9,6 +9,7 @@ import re
 import sys
 import stat
 import time
+import gzip
 import json
 import shutil
 import socket
@@ -20,10 +21,11 @@ import commands
 import traceback
 import subprocess
 from ast import literal_eval
+from collections import deque
 from optparse import OptionParser, BadOptionError, AmbiguousOptionError
 
 import DashboardAPI
-from ServerUtilities import setDashboardLogs
+from ServerUtilities import setDashboardLogs, calculateChecksumsForFiles
 import WMCore.Storage.SiteLocalConfig as SiteLocalConfig
 
 logCMSSWSaved = False
@@ -297,7 +299,12 @@ def logCMSSW():
     is available, it will check if file is not too big and also will
     limit each line to maxLineLen. These logs will be returned back to
     schedd and we don`t want to take a lot of space on it. Full log files
-    will be returned back to user SE, if he set saveLogs flag in crab config."""
+    will be returned back to user SE, if he set saveLogs flag in crab config.
+    The file is read only once: the first keepAtStart lines are kept in a list,
+    the last keepAtEnd ones in a deque and the ones in between are only counted.
+    Those lines are also written, compressed, to the snippet file that the
+    post-job copies to the task web directory, so only a shorter excerpt of
+    them is printed to the job stdout."""
     global logCMSSWSaved
     if logCMSSWSaved:
         return
@@ -309,34 +316,58 @@ def logCMSSW():
         return
 
     outfile = "cmsRun-stdout.log"
+    snippetfile = "cmsRun-stdout-snippet.log.gz"
 
-    # check size of outfile
+    # lines kept in the snippet and printed to the stdout
     keepAtStart = 1000
     keepAtEnd   = 3000
+    printAtStart = 100
+    printAtEnd   = 1000
     maxLineLen = 3000
-    maxLines    = keepAtStart + keepAtEnd
-    numLines = sum(1 for line in open(outfile))
+    head = []
+    tail = deque(maxlen = keepAtEnd)
+    numLines = 0
+    with open(outfile) as fp:
+        for line in fp:
+            line = line[:maxLineLen].rstrip('\n')
+            if numLines < keepAtStart:
+                head.append(line)
+            else:
+                tail.append(line)
+            numLines += 1
+    kept = head + list(tail)
+    snipped = numLines - len(kept)
+
+    try:
+        fsnippet = gzip.open(snippetfile, 'wb')
+        try:
+            for nl, line in enumerate(kept):
+                if snipped and nl == len(head):
+                    fsnippet.write("[...BIG SNIP: %d lines...]\n" % snipped)
+                fsnippet.write(line + "\n")
+        finally:
+            fsnippet.close()
+    except (IOError, OSError) as ex:
+        print("WARNING: Unable to write CMSSW output snippet %s: %s" % (snippetfile, ex))
 
     print("======== CMSSW OUTPUT STARTING ========")
     print("NOTICE: lines longer than %s characters will be truncated" % maxLineLen)
 
-    tooBig = numLines > maxLines
+    tooBig = numLines > printAtStart + printAtEnd
     if tooBig :
-        print("WARNING: CMSSW output more then %d lines; truncating to first %d and last %d" % (maxLines, keepAtStart, keepAtEnd))
+        print("WARNING: CMSSW output more then %d lines; truncating to first %d and last %d" % (printAtStart + printAtEnd, printAtStart, printAtEnd))
+        print("The first %d and last %d lines are in the job's CMSSW output snippet in the task web directory." % (keepAtStart, keepAtEnd))
         print("Use 'crab getlog' to retrieve full output of this job from storage.")
         print("=======================================")
-        with open(outfile) as fp:
-            for nl, line in enumerate(fp):
-                if nl < keepAtStart:
-                    printCMSSWLine("== CMSSW: %s " % line, maxLineLen)
-                if nl == keepAtStart+1:
-                    print("== CMSSW: ")
-                    print("== CMSSW: [...BIG SNIP...]")
-                    print("== CMSSW: ")
-                if numLines-nl <= keepAtEnd:
-                    printCMSSWLine("== CMSSW: %s " % line, maxLineLen)
+        for line in kept[:printAtStart]:
+            printCMSSWLine("== CMSSW: %s " % line, maxLineLen)
+        print("== CMSSW: ")
+        print("== CMSSW: [...BIG SNIP: %d lines...]" % (numLines - printAtStart - printAtEnd))
+        print("== CMSSW: ")
+        for line in kept[-printAtEnd:]:
+            printCMSSWLine("== CMSSW: %s " % line, maxLineLen)
     else:
-        for line in open(outfile):
+        for line in kept:
             printCMSSWLine("== CMSSW: %s " % line, maxLineLen)
 
     print("======== CMSSW OUTPUT FINSHING ========")
@@ -698,6 +729,7 @@ def AddChecksums(report):
     if 'output' not in report['steps']['cmsRun']:
         return
 
+    filesToChecksum = []
     for outputMod in report['steps']['cmsRun']['output'].values():
         for fileInfo in outputMod:
             if 'checksums' in fileInfo:
@@ -707,12 +739,20 @@ def AddChecksums(report):
                     fileInfo['pfn'] = fileInfo['fileName']
                 else:
                     continue
-            print("==== Checksum STARTING at %s ====" % time.asctime(time.gmtime()))
-            print("== Filename: %s" % fileInfo['pfn'])
-            (adler32, cksum) = calculateChecksums(fileInfo['pfn'])
-            print("==== Checksum FINISHING at %s ====" % time.asctime(time.gmtime()))
-            fileInfo['checksums'] = {'adler32': adler32, 'cksum': cksum}
-            fileInfo['size'] = os.stat(fileInfo['pfn']).st_size
+            filesToChecksum.append(fileInfo)
+    if not filesToChecksum:
+        return
+
+    ## Checksum all the output files in parallel, reading each file only once.
+    print("==== Checksum STARTING at %s ====" % time.asctime(time.gmtime()))
+    for fileInfo in filesToChecksum:
+        print("== Filename: %s" % fileInfo['pfn'])
+    checksums = calculateChecksumsForFiles(set(fileInfo['pfn'] for fileInfo in filesToChecksum))
+    print("==== Checksum FINISHING at %s ====" % time.asctime(time.gmtime()))
+    for fileInfo in filesToChecksum:
+        (adler32, cksum) = checksums[fileInfo['pfn']]
+        fileInfo['checksums'] = {'adler32': adler32, 'cksum': cksum}
+        fileInfo['size'] = os.stat(fileInfo['pfn']).st_size
 
 
 def AddPsetHash(report, scram):
@@ -831,7 +871,6 @@ if __name__ == "__main__":
         from WMCore.FwkJobReport.Report import Report
         from WMCore.FwkJobReport.Report import FwkJobReportException
         from WMCore.WMSpec.Steps.WMExecutionFailure import WMExecutionFailure
-        from WMCore.Algorithms.BasicAlgos import calculateChecksums
         from WMCore.WMSpec.Steps.Executors.CMSSW import CMSSW
         from WMCore.Configuration import Configuration
         from WMCore.WMSpec.WMStep import WMStep
@@ -11,14 +11,17 @@ import re
 import json
 import time
 import pprint
+import select
 import signal
 import logging
+import tempfile
 import tarfile
 import hashlib
 import datetime
 import traceback
+import multiprocessing
 
-from ServerUtilities import cmd_exist, parseJobAd
+from ServerUtilities import cmd_exist, parseJobAd, ChecksummingWriter
 
 if os.path.exists("WMCore.zip") and "WMCore.zip" not in sys.path:
     sys.path.append("WMCore.zip")
@@ -98,9 +101,16 @@ with open('wmcore_initialized', 'w') as fd_wmcore:
 ##------------------------------------------------------------------------------
 
 ## This variable defines a timeout for local and direct transfers. We use it
-## with the python signal module to define an alarm to signal a timeout.
+## with the python signal module to define an alarm to signal a timeout (or, in
+## concurrent stageout mode, to kill the process doing the transfer).
 G_TRANSFERS_TIMEOUT = 60*60 # = 60 minutes
 
+## Maximum number of transfers done at the same time. With more than one, each
+## transfer is done in a separate process by perform_concurrent_stageouts().
+## Can be set with the CRAB_StageoutWorkers job ad attribute (e.g. via
+## extraJDL); by default the files are staged out one after the other.
+G_STAGEOUT_WORKERS = 1
+
 ## Stageout settings used by the local stageout manager.
 G_NUMBER_OF_RETRIES = 2
 G_RETRY_PAUSE_TIME = 60
@@ -125,7 +135,7 @@ G_JOB_WRAPPER_EXIT_CODE = None
 G_JOB_EXIT_CODE = None
 
 ## List to collect the files that have been staged out directly. The list is
-## filed by the perform_direct_stageout() function. For each file, append a
+## filed by the register_direct_stageout() function. For each file, append a
 ## dictionary with relevant information used then in the clean_stageout_area()
 ## function. If a file is removed from the remote storage, we still keep the
 ## file in this list, but set the 'removed' flag to True.
@@ -133,13 +143,21 @@ G_DIRECT_STAGEOUTS = []
 
 ## List to collect the transfer requests to ASO for files that were
 ## successfully transferred to the local storage. This list is filled in by the
-## perform_local_stageout() function. For each file, append a dictionary with
+## finish_local_stageout() function. For each file, append a dictionary with
 ## the information needed by the inject_to_aso() function.
 G_ASO_TRANSFER_REQUESTS = []
 
+## Number of times inject_to_aso() tries to commit a document that had a
+## conflict in the ASO database.
+G_ASO_INJECTION_MAX_ATTEMPTS = 3
+
 ## Dictionary with the job's HTCondor ClassAd.
 G_JOB_AD = {}
 
+## Checksums of the logs archive file, computed by make_logs_archive() while
+## writing the file.
+G_LOGS_ARCHIVE_CHECKSUMS = None
+
 ## Dictionary with the mapping of node storage element name to site name.
 ## Will be filled in by the make_node_map() function using PhEDEx.
 G_NODE_MAP = {}
@@ -151,10 +169,13 @@ G_NODE_MAP = {}
 def make_logs_archive(arch_file_name):
     """
     Make a zipped tar archive file of the user log files plus the framework job
-    report xml file.
+    report xml file. The checksums of the archive file are computed while
+    writing it and saved in G_LOGS_ARCHIVE_CHECKSUMS.
     """
+    global G_LOGS_ARCHIVE_CHECKSUMS
     retval, retmsg = 0, None
-    arch_file = tarfile.open(arch_file_name, 'w:gz')
+    arch_file_writer = ChecksummingWriter(open(arch_file_name, 'wb'))
+    arch_file = tarfile.open(arch_file_name, 'w:gz', fileobj = arch_file_writer)
     file_names = ['cmsRun-stdout.log', \
                   'cmsRun-stderr.log', \
                   'FrameworkJobReport.xml']
@@ -171,10 +192,40 @@ def make_logs_archive(arch_file_name):
             msg = "WARNING: %s is missing." % (file_name)
             print(msg)
     arch_file.close()
+    arch_file_writer.close()
+    try:
+        adler32, cksum = arch_file_writer.checksums()
+        G_LOGS_ARCHIVE_CHECKSUMS = {'adler32': adler32, 'cksum': cksum}
+    except Exception as ex:
+        msg = "WARNING: Unable to compute the checksums of %s: %s" % (arch_file_name, ex)
+        print(msg)
     return retval, retmsg
 
 ## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
+def get_source_file_checksums(source_file, is_log):
+    """
+    Return the checksums of a file to stage out, as computed when the file was
+    created (by CMSRunAnalysis for the output files, by make_logs_archive() for
+    the logs archive), or None if they are not known. The stageout
+    implementations that support it can then verify the transferred file
+    against these checksums, without reading the local file again.
+    """
+    if is_log:
+        return G_LOGS_ARCHIVE_CHECKSUMS
+    try:
+        output_file_info = get_output_file_from_job_report(os.path.split(source_file)[-1])
+    except Exception:
+        return None
+    if output_file_info is None:
+        return None
+    checksums = output_file_info.get(u'checksums')
+    if not checksums or not checksums.get(u'adler32'):
+        return None
+    return dict((str(key), str(value)) for key, value in checksums.items())
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
 def get_job_id(source):
     """
     Extract the job id from the file name.
@@ -418,6 +469,34 @@ def make_node_map():
 
 ## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
+def get_output_transfer(output_file_name_info, output_dest_pfn, dest_temp_dir, dest_site):
+    """
+    Return a dictionary with the arguments of perform_stageout() for an output
+    file, given as my_output_file.root=my_output_file_<job-id>.root, or None if
+    the output file is not given in this format.
+    """
+    if len(output_file_name_info.split('=')) != 2:
+        return None
+    output_file_name, output_dest_file_name = output_file_name_info.split('=')
+    output_dest_temp_lfn = os.path.join(dest_temp_dir, output_dest_file_name)
+    output_dest_pfn_path = os.path.dirname(output_dest_pfn)
+    if G_JOB_WRAPPER_EXIT_CODE != 0:
+        output_dest_pfn_path = os.path.join(output_dest_pfn_path, 'failed')
+    output_dest_pfn = os.path.join(output_dest_pfn_path, output_dest_file_name)
+    output_dest_lfn = None
+    ## TODO: This is a hack; the output destination LFN should be in the job ad.
+    if len(output_dest_pfn_path.split('/store/')) == 2:
+        output_dest_lfn = os.path.join('/store', output_dest_pfn_path.split('/store/')[1], output_dest_file_name)
+    return {'source_file'   : output_file_name,
+            'dest_temp_lfn' : output_dest_temp_lfn,
+            'dest_pfn'      : output_dest_pfn,
+            'dest_lfn'      : output_dest_lfn,
+            'dest_site'     : dest_site,
+            'is_log'        : False
+           }
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
 def perform_stageout(local_stageout_mgr, direct_stageout_impl, \
                      direct_stageout_command, direct_stageout_protocol, \
                      policy, \
@@ -426,7 +505,23 @@ def perform_stageout(local_stageout_mgr, direct_stageout_impl, \
     """
     Wrapper for local and direct stageouts.
     """
-    if policy == 'local':
+    if policy in ['local', 'remote'] and G_STAGEOUT_WORKERS > 1:
+        ## Do the transfer in a separate process, so that the timeout does not
+        ## depend on SIGALRM (same as for the concurrent stageout of the output
+        ## files).
+        transfer = {'source_file'   : source_file,
+                    'dest_temp_lfn' : dest_temp_lfn,
+                    'dest_pfn'      : dest_pfn,
+                    'dest_lfn'      : dest_lfn,
+                    'dest_site'     : dest_site,
+                    'is_log'        : is_log
+                   }
+        retval, retmsg = perform_concurrent_stageouts(local_stageout_mgr, direct_stageout_impl, \
+                                                      direct_stageout_command, \
+                                                      direct_stageout_protocol, \
+                                                      policy, [transfer], \
+                                                      source_site, inject)[0]
+    elif policy == 'local':
         retval, retmsg = perform_local_stageout(local_stageout_mgr, \
                                                 source_file, dest_temp_lfn, \
                                                 dest_lfn, dest_site, \
@@ -452,12 +547,35 @@ def perform_local_stageout(local_stageout_mgr, \
     """
     Wrapper for local stageouts.
     """
-    file_for_transfer = {'LFN': dest_temp_lfn, 'PFN': source_file}
     ## Start the clock for timeout counting.
     signal.signal(signal.SIGALRM, alarmHandler)
     signal.alarm(G_TRANSFERS_TIMEOUT)
     ## Do the local stageout.
-    retval, retmsg = 0, None
+    try:
+        retval, retmsg, stageout_info = transfer_local(local_stageout_mgr, \
+                                                       source_file, dest_temp_lfn, \
+                                                       is_log)
+    finally:
+        signal.alarm(0)
+    if retval == 0:
+        finish_local_stageout(local_stageout_mgr, stageout_info, \
+                              dest_temp_lfn, dest_lfn, dest_site, \
+                              source_site, is_log, inject)
+    return retval, retmsg
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def transfer_local(local_stageout_mgr, source_file, dest_temp_lfn, is_log):
+    """
+    Transfer a file to the local temporary storage with the local stageout
+    manager. Return a tuple (retval, retmsg, stageout_info), where stageout_info
+    is what the stageout manager returned (None in case of failure).
+    """
+    file_for_transfer = {'LFN': dest_temp_lfn, 'PFN': source_file}
+    checksums = get_source_file_checksums(source_file, is_log)
+    if checksums:
+        file_for_transfer['Checksums'] = checksums
+    retval, retmsg, stageout_info = 0, None, None
     try:
         ## Throws on any failure.
         print("       -----> Stageout manager log start")
@@ -476,38 +594,46 @@ def perform_local_stageout(local_stageout_mgr, \
         print(msg)
         print("       <----- Stageout manager log finish")
         retval, retmsg = 60307, msg
-    finally:
-        signal.alarm(0)
-    if retval == 0:
-        dest_temp_file_name = os.path.split(dest_temp_lfn)[-1]
-        dest_temp_se = stageout_info['SEName']
-
-        ## Fallback to previous behaviour where phedex is queried for location
-        if source_site == 'unknown':
-            source_site = G_NODE_MAP.get(dest_temp_se, 'unknown')
-
-        sites_added_ok = add_sites_to_job_report(dest_temp_file_name, \
-                                                 is_log, source_site, \
-                                                 dest_site if inject else 'unknown', \
-                                                 True, None)
-        if not sites_added_ok:
-            msg = "WARNING: Ignoring failure in adding the above information to the job report."
-            print(msg)
-        if inject:
-            file_transfer_info = {'source'             : {'lfn': dest_temp_lfn, 'site': source_site},
-                                  'destination'        : {'lfn': dest_lfn,      'site': dest_site     },
-                                  'is_log'             : is_log,
-                                  'local_stageout_mgr' : local_stageout_mgr,
-                                  'inject'             : True
-                                 }
-            G_ASO_TRANSFER_REQUESTS.append(file_transfer_info)
-    return retval, retmsg
+    return retval, retmsg, stageout_info
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def finish_local_stageout(local_stageout_mgr, stageout_info, \
+                          dest_temp_lfn, dest_lfn, dest_site, \
+                          source_site, is_log, inject):
+    """
+    Record a successful local stageout in the job report and, if the file has to
+    be transferred by ASO, in the list of transfer requests.
+    """
+    dest_temp_file_name = os.path.split(dest_temp_lfn)[-1]
+    dest_temp_se = stageout_info['SEName']
+
+    ## Fallback to previous behaviour where phedex is queried for location
+    if source_site == 'unknown':
+        source_site = G_NODE_MAP.get(dest_temp_se, 'unknown')
+
+    sites_added_ok = add_sites_to_job_report(dest_temp_file_name, \
+                                             is_log, source_site, \
+                                             dest_site if inject else 'unknown', \
+                                             True, None)
+    if not sites_added_ok:
+        msg = "WARNING: Ignoring failure in adding the above information to the job report."
+        print(msg)
+    if inject:
+        file_transfer_info = {'source'             : {'lfn': dest_temp_lfn, 'site': source_site},
+                              'destination'        : {'lfn': dest_lfn,      'site': dest_site     },
+                              'is_log'             : is_log,
+                              'local_stageout_mgr' : local_stageout_mgr,
+                              'inject'             : True
+                             }
+        G_ASO_TRANSFER_REQUESTS.append(file_transfer_info)
 
 ## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
-def inject_to_aso(file_transfer_info):
+def check_aso_injection_requirements():
     """
-    Inject a document to the ASO database.
+    Check that we have all the information needed to inject documents to the
+    ASO database.
     """
     for attr in ['CRAB_ASOURL', 'CRAB_AsyncDest', 'DESIRED_CMSDataset', \
                  'CRAB_UserGroup', 'CRAB_UserRole', 'CRAB_DBSURL', \
@@ -528,7 +654,17 @@ def inject_to_aso(file_transfer_info):
         msg += " Cannot inject to ASO."
         print(msg)
         return 80000, msg
+    return 0, None
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
+def make_aso_document(file_transfer_info):
+    """
+    Prepare the ASO database document for a file transfer request. Return the
+    document id, the information to add to the document (both when the
+    document is new and when it is already in the database) and the document
+    to commit in case it is new.
+    """
     file_name = os.path.split(file_transfer_info['source']['lfn'])[-1]
     file_type = 'log' if file_transfer_info['is_log'] else 'output'
 
@@ -554,7 +690,7 @@ def inject_to_aso(file_transfer_info):
         msg  = "ERROR: Unable to determine local node name."
         msg += " Cannot inject to ASO."
         print(msg)
-        return 80000, msg
+        return 80000, msg, None, None, None
 
     role = str(G_JOB_AD['CRAB_UserRole'])
     if str(G_JOB_AD['CRAB_UserRole']).lower() == 'undefined':
@@ -599,45 +735,17 @@ def inject_to_aso(file_transfer_info):
     msg = "Stageout request document so far:\n%s" % (pprint.pformat(doc_new_info))
     print(msg)
 
-    couch_server = CMSCouch.CouchServer(dburl = G_JOB_AD['CRAB_ASOURL'], \
-                                        ckey = os.environ['X509_USER_PROXY'], \
-                                        cert = os.environ['X509_USER_PROXY'])
-    couch_database = couch_server.connectDatabase("asynctransfer", create = False)
-
-    needs_commit = True
-    try:
-        doc = couch_database.document(doc_id)
-        ## The document is already in ASO database. This means we are retrying
-        ## the job and the document was injected by a previous job retry. The
-        ## transfer status must be terminal ('done', 'failed' or 'killed'),
-        ## since the post-job doesn't exit until all transfers are finished.
-        transfer_status = doc.get('state')
-        msg = "LFN %s (id %s) is already in ASO database (file transfer status is '%s')."
-        msg = msg % (file_transfer_info['source']['lfn'], doc_id, transfer_status)
-        if transfer_status in ['new', 'acquired', 'retry']:
-            msg += "\nFile transfer status is not terminal ('done', 'failed' or 'killed')."
-            msg += " Will not upload a new stageout request for the current job retry."
-            needs_commit = False
-        else:
-            msg += " Uploading new stageout request for the current job retry."
-        print(msg)
-    except CMSCouch.CouchNotFoundError:
-        ## The document is not yet in ASO database. We commit a new document.
-        msg  = "LFN %s (id %s) is not yet in ASO database."
-        msg  = msg % (file_transfer_info['source']['lfn'], doc_id)
-        msg += " Uploading new stageout request."
-        print(msg)
-        input_dataset = G_JOB_AD['DESIRED_CMSDataset']
-        if str(G_JOB_AD['DESIRED_CMSDataset']).lower() == 'undefined':
-            input_dataset = ''
-        primary_dataset = G_JOB_AD['CRAB_PrimaryDataset']
-        if input_dataset:
-            input_dataset_or_primary_dataset = input_dataset
-        elif primary_dataset:
-            input_dataset_or_primary_dataset = '/'+primary_dataset # Adding the '/' until we fix ASO
-        else:
-            input_dataset_or_primary_dataset = '/'+'NotDefined' # Adding the '/' until we fix ASO
-        doc = {'_id': doc_id,
+    input_dataset = G_JOB_AD['DESIRED_CMSDataset']
+    if str(G_JOB_AD['DESIRED_CMSDataset']).lower() == 'undefined':
+        input_dataset = ''
+    primary_dataset = G_JOB_AD['CRAB_PrimaryDataset']
+    if input_dataset:
+        input_dataset_or_primary_dataset = input_dataset
+    elif primary_dataset:
+        input_dataset_or_primary_dataset = '/'+primary_dataset # Adding the '/' until we fix ASO
+    else:
+        input_dataset_or_primary_dataset = '/'+'NotDefined' # Adding the '/' until we fix ASO
+    new_doc = {'_id': doc_id,
                'workflow': G_JOB_AD['CRAB_ReqName'],
                'jobid': G_JOB_AD['CRAB_Id'],
                'rest_host': G_JOB_AD['CRAB_RestHost'],
@@ -655,21 +763,136 @@ def inject_to_aso(file_transfer_info):
                'role': role,
                'group': group,
               }
+    return 0, None, doc_id, doc_new_info, new_doc
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def inject_to_aso(file_transfer_infos):
+    """
+    Inject the documents for the given file transfer requests to the ASO
+    database. We open one single connection to the database, load all the
+    existing documents with one request and commit all the new/updated
+    documents with one bulk request. Documents that hit a conflict (i.e. that
+    were modified by someone else in the meanwhile) are loaded and committed
+    again, up to G_ASO_INJECTION_MAX_ATTEMPTS times. Return a list with the
+    (return code, return message) of each file transfer request.
+    """
+    results = [None] * len(file_transfer_infos)
+    retval, retmsg = check_aso_injection_requirements()
+    if retval != 0:
+        return [(retval, retmsg)] * len(file_transfer_infos)
+
+    ## Dictionary doc_id -> (index, lfn, doc_new_info, new_doc).
+    docs_info = {}
+    pending = []
+    for index, file_transfer_info in enumerate(file_transfer_infos):
+        retval, retmsg, doc_id, doc_new_info, new_doc = make_aso_document(file_transfer_info)
+        if retval != 0:
+            results[index] = (retval, retmsg)
+            continue
+        docs_info[doc_id] = (index, file_transfer_info['source']['lfn'], doc_new_info, new_doc)
+        pending.append(doc_id)
+    if not pending:
+        return results
+
+    def set_result(doc_ids, retval, retmsg):
+        for doc_id in doc_ids:
+            results[docs_info[doc_id][0]] = (retval, retmsg)
+
+    try:
+        couch_server = CMSCouch.CouchServer(dburl = G_JOB_AD['CRAB_ASOURL'], \
+                                            ckey = os.environ['X509_USER_PROXY'], \
+                                            cert = os.environ['X509_USER_PROXY'])
+        couch_database = couch_server.connectDatabase("asynctransfer", create = False)
     except Exception:
-        msg  = "Error loading document from ASO database."
+        msg  = "Error connecting to ASO database."
         msg += " Transfer submission failed."
         msg += "\n%s" % (traceback.format_exc())
         print(msg)
-        return 60320, msg
-    if needs_commit:
-        doc.update(doc_new_info)
-        commit_result = couch_database.commitOne(doc)[0]
-        if 'error' in commit_result:
-            msg = "Couldn't add to ASO database; error follows:\n%s" % (commit_result)
+        set_result(pending, 60320, msg)
+        return results
+
+    num_committed = 0
+    for attempt in range(1, G_ASO_INJECTION_MAX_ATTEMPTS + 1):
+        ## Load (with one request) the documents that are already in the database.
+        try:
+            existing_docs = {}
+            all_docs = couch_database.allDocs({'include_docs': True}, pending)
+            for row in all_docs.get('rows', []):
+                if row.get('doc'):
+                    existing_docs[row['key']] = row['doc']
+        except Exception:
+            msg  = "Error loading documents from ASO database."
+            msg += " Transfer submission failed."
+            msg += "\n%s" % (traceback.format_exc())
             print(msg)
-            return 60320, msg
-        msg = "Final stageout job description:\n%s" % (pprint.pformat(doc))
-        print(msg)
+            set_result(pending, 60320, msg)
+            break
+        to_commit, docs_to_commit = [], {}
+        for doc_id in pending:
+            _, lfn, doc_new_info, new_doc = docs_info[doc_id]
+            if doc_id in existing_docs:
+                ## The document is already in ASO database. This means we are
+                ## retrying the job and the document was injected by a previous
+                ## job retry. The transfer status must be terminal ('done',
+                ## 'failed' or 'killed'), since the post-job doesn't exit until
+                ## all transfers are finished.
+                doc = existing_docs[doc_id]
+                transfer_status = doc.get('state')
+                msg = "LFN %s (id %s) is already in ASO database (file transfer status is '%s')."
+                msg = msg % (lfn, doc_id, transfer_status)
+                if transfer_status in ['new', 'acquired', 'retry']:
+                    msg += "\nFile transfer status is not terminal ('done', 'failed' or 'killed')."
+                    msg += " Will not upload a new stageout request for the current job retry."
+                    print(msg)
+                    set_result([doc_id], 0, None)
+                    continue
+                msg += " Uploading new stageout request for the current job retry."
+                print(msg)
+            else:
+                ## The document is not yet in ASO database. We commit a new document.
+                msg  = "LFN %s (id %s) is not yet in ASO database."
+                msg  = msg % (lfn, doc_id)
+                msg += " Uploading new stageout request."
+                print(msg)
+                doc = dict(new_doc)
+            doc.update(doc_new_info)
+            couch_database.queue(doc)
+            to_commit.append(doc_id)
+            docs_to_commit[doc_id] = doc
+        if not to_commit:
+            break
+        ## Commit (with one request) all the new and updated documents.
+        try:
+            commit_results = couch_database.commit()
+        except Exception:
+            msg  = "Error committing documents to ASO database."
+            msg += " Transfer submission failed."
+            msg += "\n%s" % (traceback.format_exc())
+            print(msg)
+            set_result(to_commit, 60320, msg)
+            break
+        commit_results = dict((commit_result.get('id'), commit_result) for commit_result in commit_results)
+        pending = []
+        for doc_id in to_commit:
+            commit_result = commit_results.get(doc_id, {'id': doc_id, 'error': 'no commit result'})
+            if 'error' not in commit_result:
+                msg = "Final stageout job description:\n%s" % (pprint.pformat(docs_to_commit[doc_id]))
+                print(msg)
+                set_result([doc_id], 0, None)
+                num_committed += 1
+            elif commit_result['error'] == 'conflict' and attempt < G_ASO_INJECTION_MAX_ATTEMPTS:
+                msg  = "Document %s was modified in ASO database while we were updating it." % (doc_id)
+                msg += " Will load it and try again."
+                print(msg)
+                pending.append(doc_id)
+            else:
+                msg = "Couldn't add to ASO database; error follows:\n%s" % (commit_result)
+                print(msg)
+                set_result([doc_id], 60320, msg)
+        if not pending:
+            break
+    if num_committed > 0:
         if get_from_job_report('aso_start_time') is None or \
            get_from_job_report('aso_start_timestamp') is None:
             msg  = "Setting"
@@ -683,7 +906,7 @@ def inject_to_aso(file_transfer_info):
             if not is_ok:
                 msg = "WARNING: Failed to set aso_start_time in job report."
                 print(msg)
-    return 0, None
+    return results
 
 ## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -694,25 +917,52 @@ def perform_direct_stageout(direct_stageout_impl, \
     """
     Wrapper for direct stageouts.
     """
-    ## Keep track of the directly staged out files. First use case is to remove
-    ## them in case of stageout failure.
-    global G_DIRECT_STAGEOUTS
+    register_direct_stageout(dest_pfn, dest_site, is_log)
+    ## Start the clock for timeout counting.
+    signal.signal(signal.SIGALRM, alarmHandler)
+    signal.alarm(G_TRANSFERS_TIMEOUT)
+    ## Do the direct stageout.
+    try:
+        retval, retmsg, _ = transfer_direct(direct_stageout_impl, \
+                                            direct_stageout_command, \
+                                            direct_stageout_protocol, \
+                                            source_file, dest_pfn, is_log)
+    finally:
+        signal.alarm(0)
+    if retval == 0:
+        finish_direct_stageout(dest_pfn, dest_site, is_log)
+    return retval, retmsg
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def register_direct_stageout(dest_pfn, dest_site, is_log):
+    """
+    Keep track of the directly staged out files. First use case is to remove
+    them in case of stageout failure.
+    """
     direct_stageout_info = {'dest_pfn'  : dest_pfn,
                             'dest_site' : dest_site,
                             'is_log'    : is_log,
                             'removed'   : False
                            }
     G_DIRECT_STAGEOUTS.append(direct_stageout_info)
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def transfer_direct(direct_stageout_impl, \
+                    direct_stageout_command, direct_stageout_protocol, \
+                    source_file, dest_pfn, is_log):
+    """
+    Transfer a file to the permanent storage with the direct stageout
+    implementation. Return a tuple (retval, retmsg, None), like transfer_local().
+    """
     retval, retmsg = 0, None
     try:
-        ## Start the clock for timeout counting.
-        signal.signal(signal.SIGALRM, alarmHandler)
-        signal.alarm(G_TRANSFERS_TIMEOUT)
-        ## Do the direct stageout.
         try:
             print("       -----> Stageout implementation log start")
             direct_stageout_impl(direct_stageout_protocol, \
-                                 source_file, dest_pfn, None, None)
+                                 source_file, dest_pfn, None, \
+                                 get_source_file_checksums(source_file, is_log))
             print("       <----- Stageout implementation log finish")
         except Alarm:
             print("       <----- Stageout implementation log finish")
@@ -732,24 +982,198 @@ def perform_direct_stageout(direct_stageout_impl, \
             ## StageOutError.StageOutFailure has error code 60311.
             raise StageOutError.StageOutFailure(msg, Command = direct_stageout_command, Protocol = direct_stageout_protocol, \
                                                 LFN = dest_pfn, InputPFN = source_file, TargetPFN = dest_pfn)
-        finally:
-            signal.alarm(0)
     except WMException.WMException as ex:
         msg  = "Error during direct stageout:"
         msg += "\n%s" % (str(ex))
         print(msg)
         print("       <----- Stageout implementation log finish")
         retval, retmsg = ex.data.get("ErrorCode", 60307), msg
-    if retval == 0:
-        dest_file_name = os.path.split(dest_pfn)[-1]
-        sites_added_ok = add_sites_to_job_report(dest_file_name, is_log, \
-                                                 None, dest_site, \
-                                                 None, True)
-        if not sites_added_ok:
-            msg = "WARNING: Ignoring failure in adding the above information to the job report."
-            print(msg)
+    return retval, retmsg, None
 
-    return retval, retmsg
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def finish_direct_stageout(dest_pfn, dest_site, is_log):
+    """
+    Record a successful direct stageout in the job report.
+    """
+    dest_file_name = os.path.split(dest_pfn)[-1]
+    sites_added_ok = add_sites_to_job_report(dest_file_name, is_log, \
+                                             None, dest_site, \
+                                             None, True)
+    if not sites_added_ok:
+        msg = "WARNING: Ignoring failure in adding the above information to the job report."
+        print(msg)
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def run_transfer_process(transfer_func, transfer_args, result_conn, log_file):
+    """
+    Body of the process doing one transfer in concurrent stageout mode. The
+    output goes to log_file and the (retval, retmsg, stageout_info) tuple
+    returned by the transfer function is sent back through result_conn.
+    """
+    ## Own process group, so that on timeout we can kill also the commands
+    ## (e.g. gfal-copy) started by the stageout plugin.
+    try:
+        os.setpgid(0, 0)
+    except OSError:
+        pass
+    os.dup2(log_file.fileno(), sys.stdout.fileno())
+    os.dup2(log_file.fileno(), sys.stderr.fileno())
+    try:
+        result = transfer_func(*transfer_args)
+    except Exception:
+        msg  = "ERROR: Unhandled exception when performing stageout."
+        msg += "\n%s" % (traceback.format_exc())
+        print(msg)
+        result = (60318, msg, None)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    result_conn.send(result)
+    result_conn.close()
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def start_transfer_process(transfer_func, transfer_args):
+    """
+    Start a process doing one transfer. Return a dictionary with what is needed
+    to wait for it and to collect its result.
+    """
+    ## Whatever is still in our buffer would otherwise end up in the log file
+    ## of the child.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    log_file = tempfile.TemporaryFile()
+    result_conn, child_conn = multiprocessing.Pipe(False)
+    process = multiprocessing.Process(target = run_transfer_process, \
+                                      args = (transfer_func, transfer_args, child_conn, log_file))
+    process.start()
+    ## Same as in the child; whichever comes first.
+    try:
+        os.setpgid(process.pid, process.pid)
+    except OSError:
+        pass
+    ## Only the child writes; closing our copy of its end of the pipe lets us
+    ## see when the child dies without sending a result.
+    child_conn.close()
+    return {'process'     : process,
+            'result_conn' : result_conn,
+            'log_file'    : log_file,
+            'deadline'    : time.time() + G_TRANSFERS_TIMEOUT
+           }
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def collect_transfer_process(transfer_process, source_file):
+    """
+    Collect the result of a transfer process that sent its result, died, or
+    reached the timeout (in which case it is killed). Return a tuple
+    (retval, retmsg, stageout_info, log), where log is the output of the process.
+    """
+    process = transfer_process['process']
+    result_conn = transfer_process['result_conn']
+    result = None
+    if result_conn.poll():
+        try:
+            result = result_conn.recv()
+        except EOFError:
+            pass
+    elif time.time() >= transfer_process['deadline']:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            process.terminate()
+        msg  = "Timeout reached during stageout of %s;" % (source_file)
+        msg += " setting return code to 60403."
+        result = (60403, msg, None)
+    process.join()
+    result_conn.close()
+    if result is None:
+        msg  = "ERROR: Stageout process for %s exited" % (source_file)
+        msg += " with code %s without reporting its result." % (process.exitcode)
+        result = (60318, msg, None)
+    log_file = transfer_process['log_file']
+    log_file.seek(0)
+    log = log_file.read()
+    log_file.close()
+    return result + (log,)
+
+## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+def perform_concurrent_stageouts(local_stageout_mgr, direct_stageout_impl, \
+                                 direct_stageout_command, direct_stageout_protocol, \
+                                 policy, transfers, source_site, inject):
+    """
+    Stage out files doing up to G_STAGEOUT_WORKERS transfers at the same time,
+    each in a separate process that is killed if it reaches the timeout. The
+    transfers are given as a list of dictionaries with the source_file,
+    dest_temp_lfn, dest_pfn, dest_lfn, dest_site and is_log arguments of
+    perform_stageout(). Once a transfer fails, no other transfer is started.
+
+    The transfers are started in the order of the list, and their logs and the
+    job report updates are done in the same order once all the transfers are
+    over, so the outcome doesn't depend on which transfer finishes first.
+    Return a list with a tuple (retval, retmsg) for each transfer, or None for
+    the transfers that were not started because a previous one failed.
+    """
+    if policy == 'local':
+        transfer_func = transfer_local
+        get_transfer_args = lambda transfer: (local_stageout_mgr, transfer['source_file'], \
+                                              transfer['dest_temp_lfn'], transfer['is_log'])
+    else:
+        transfer_func = transfer_direct
+        get_transfer_args = lambda transfer: (direct_stageout_impl, direct_stageout_command, \
+                                              direct_stageout_protocol, transfer['source_file'], \
+                                              transfer['dest_pfn'], transfer['is_log'])
+    if len(transfers) > 1:
+        msg  = "Will do %s stageout of %d files" % (policy, len(transfers))
+        msg += " with up to %d concurrent transfers." % (G_STAGEOUT_WORKERS)
+        print(msg)
+    results = [None] * len(transfers)
+    pending = range(len(transfers))
+    running = {}
+    failed = False
+    while running or (pending and not failed):
+        while pending and not failed and len(running) < G_STAGEOUT_WORKERS:
+            index = pending.pop(0)
+            transfer = transfers[index]
+            if policy == 'remote':
+                register_direct_stageout(transfer['dest_pfn'], transfer['dest_site'], transfer['is_log'])
+            running[index] = start_transfer_process(transfer_func, get_transfer_args(transfer))
+        timeout = max(0, min([info['deadline'] for info in running.values()]) - time.time())
+        result_conns = [info['result_conn'] for info in running.values()]
+        ready = select.select(result_conns, [], [], timeout)[0]
+        for index, info in running.items():
+            if info['result_conn'] in ready or time.time() >= info['deadline']:
+                results[index] = collect_transfer_process(info, transfers[index]['source_file'])
+                del running[index]
+                if results[index][0] != 0:
+                    failed = True
+    for transfer, result in zip(transfers, results):
+        if result is None:
+            continue
+        retval, retmsg, stageout_info, log = result
+        file_name = os.path.basename(transfer['source_file'])
+        msg = "       -----> Transfer log of %s start" % (file_name)
+        print(msg)
+        print(log.rstrip('\n'))
+        if retval == 60403:
+            print(retmsg)
+        msg = "       <----- Transfer log of %s finish (status %d)" % (file_name, retval)
+        print(msg)
+        if retval != 0:
+            continue
+        if policy == 'local':
+            ## The stageout manager of the transfer process knows about the
+            ## file, but ours has to know as well in case we clean the storage.
+            local_stageout_mgr.completedFiles[transfer['dest_temp_lfn']] = stageout_info
+            finish_local_stageout(local_stageout_mgr, stageout_info, \
+                                  transfer['dest_temp_lfn'], transfer['dest_lfn'], \
+                                  transfer['dest_site'], source_site, \
+                                  transfer['is_log'], inject)
+        else:
+            finish_direct_stageout(transfer['dest_pfn'], transfer['dest_site'], transfer['is_log'])
+    return [result[:2] if result else None for result in results]
 
 ## = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -1069,6 +1493,15 @@ def main():
         print("==== NOT PERFORMING STAGEOUT AS CRAB_NoWNStageout is 1 ====")
         update_exit_info(exit_info, 0, 'OK', True)
         return exit_info
+    ## If CRAB_StageoutWorkers has been set to an integer value > 1 (maybe with
+    ## extraJDL from the client) then we do that many transfers at a time.
+    global G_STAGEOUT_WORKERS
+    try:
+        G_STAGEOUT_WORKERS = max(1, int(G_JOB_AD.get('CRAB_StageoutWorkers', 1)))
+    except (TypeError, ValueError):
+        msg  = "WARNING: Invalid value of CRAB_StageoutWorkers in job's HTCondor ClassAd."
+        msg += " Will stage out the files one after the other."
+        print(msg)
     ## If we couldn't read CRAB_SaveLogsFlag from the job ad, we assume False.
     if 'CRAB_SaveLogsFlag' not in G_JOB_AD:
         msg  = "WARNING: Job's HTCondor ClassAd is missing attribute CRAB_SaveLogsFlag."
@@ -1617,42 +2050,62 @@ def main():
             msg  = "====== %s: " % (time.asctime(time.gmtime()))
             msg += "Starting %s stageout of user output files." % (policy)
             print(msg)
-            for output_file_name_info, output_dest_pfn in zip(output_files, dest_files[1:]):
+            ## In concurrent stageout mode, do all the transfers first (up to
+            ## the first output file with an invalid format) and then go through
+            ## their results in order, as if they had been done one by one.
+            concurrent_results = None
+            if G_STAGEOUT_WORKERS > 1 and policy in ['local', 'remote']:
+                output_transfers = []
+                for output_file_name_info, output_dest_pfn in zip(output_files, dest_files[1:]):
+                    output_transfer = get_output_transfer(output_file_name_info, output_dest_pfn, \
+                                                          dest_temp_dir, dest_site)
+                    if output_transfer is None:
+                        break
+                    output_transfers.append(output_transfer)
+                try:
+                    concurrent_results = perform_concurrent_stageouts(local_stageout_mgr, \
+                                                                      direct_stageout_impl, \
+                                                                      direct_stageout_command, \
+                                                                      direct_stageout_protocol, \
+                                                                      policy, output_transfers, \
+                                                                      source_site, inject = transfer_outputs)
+                except Exception:
+                    msg  = "ERROR: Unhandled exception when performing concurrent stageout."
+                    msg += "\n%s" % (traceback.format_exc())
+                    print(msg)
+                    concurrent_results = [(60318, msg)] * len(output_transfers)
+            for output_index, (output_file_name_info, output_dest_pfn) in enumerate(zip(output_files, dest_files[1:])):
                 ## The output_file_name_info is something like this:
                 ## my_output_file.root=my_output_file_<job-id>.root
-                if len(output_file_name_info.split('=')) != 2:
+                output_transfer = get_output_transfer(output_file_name_info, output_dest_pfn, \
+                                                      dest_temp_dir, dest_site)
+                if output_transfer is None:
                     msg = "ERROR: Invalid output format (%s)." % (output_file_name_info)
                     print(msg)
                     cur_retval, cur_retmsg = 80000, msg
                 else:
                     cur_retval, cur_retmsg = None, None
-                    output_file_name, output_dest_file_name = output_file_name_info.split('=')
+                    output_file_name = output_transfer['source_file']
                     msg  = "-----> %s: " % (time.asctime(time.gmtime()))
                     msg += "Starting %s stageout of %s." % (policy, output_file_name)
                     print(msg)
-                    output_dest_temp_lfn = os.path.join(dest_temp_dir, output_dest_file_name)
-                    output_dest_pfn_path = os.path.dirname(output_dest_pfn)
-                    if G_JOB_WRAPPER_EXIT_CODE != 0:
-                        output_dest_pfn_path = os.path.join(output_dest_pfn_path, 'failed')
-                    output_dest_pfn = os.path.join(output_dest_pfn_path, output_dest_file_name)
-                    output_dest_lfn = None
-                    ## TODO: This is a hack; the output destination LFN should
-                    ## be in the job ad.
-                    if len(output_dest_pfn_path.split('/store/')) == 2:
-                        output_dest_lfn = os.path.join('/store', output_dest_pfn_path.split('/store/')[1], output_dest_file_name)
                     try:
-                        cur_retval, \
-                        cur_retmsg = perform_stageout(local_stageout_mgr, \
-                                                      direct_stageout_impl, \
-                                                      direct_stageout_command, \
-                                                      direct_stageout_protocol, \
-                                                      policy, \
-                                                      output_file_name, \
-                                                      output_dest_temp_lfn, \
-                                                      output_dest_pfn, \
-                                                      output_dest_lfn, \
-                                                      dest_site, source_site, \
-                                                      is_log = False, inject = transfer_outputs)
+                        if concurrent_results is not None:
+                            cur_retval, cur_retmsg = concurrent_results[output_index] or \
+                                                     (60318, "Stageout of %s was not attempted." % (output_file_name))
+                        else:
+                            cur_retval, \
+                            cur_retmsg = perform_stageout(local_stageout_mgr, \
+                                                          direct_stageout_impl, \
+                                                          direct_stageout_command, \
+                                                          direct_stageout_protocol, \
+                                                          policy, \
+                                                          output_file_name, \
+                                                          output_transfer['dest_temp_lfn'], \
+                                                          output_transfer['dest_pfn'], \
+                                                          output_transfer['dest_lfn'], \
+                                                          dest_site, source_site, \
+                                                          is_log = False, inject = transfer_outputs)
                     except Exception as ex:
                         msg  = "ERROR: Unhandled exception when performing stageout."
                         msg += "\n%s" % (traceback.format_exc())
@@ -1790,24 +2243,20 @@ def main():
             if 'CRAB_ASOURL' in G_JOB_AD and G_JOB_AD['CRAB_ASOURL']:
                 msg = "Will use ASO server at %s." % (G_JOB_AD['CRAB_ASOURL'])
                 print(msg)
-            for file_transfer_info in G_ASO_TRANSFER_REQUESTS:
-                if not file_transfer_info['inject']:
-                    continue
-                file_name = os.path.basename(file_transfer_info['source']['lfn'])
-                msg  = "-----> %s: " % (time.asctime(time.gmtime()))
-                msg += "Starting injection for %s." % (file_name)
+            file_transfer_infos = [file_transfer_info for file_transfer_info in G_ASO_TRANSFER_REQUESTS \
+                                   if file_transfer_info['inject']]
+            try:
+                results = inject_to_aso(file_transfer_infos)
+            except Exception:
+                msg  = "ERROR: Unhandled exception when injecting documents to ASO."
+                msg += "\n%s" % (traceback.format_exc())
                 print(msg)
-                try:
-                    cur_retval, cur_retmsg = inject_to_aso(file_transfer_info)
-                except Exception:
-                    msg  = "ERROR: Unhandled exception when injecting document to ASO."
-                    msg += "\n%s" % (traceback.format_exc())
-                    print(msg)
-                    if cur_retval in [None, 0]:
-                        cur_retval, cur_retmsg = 60318, msg
-                msg  = "<----- %s: " % (time.asctime(time.gmtime()))
-                msg += "Finished injection for %s" % (file_name)
-                msg += " (status %d)." % (cur_retval)
+                results = [(60318, msg)] * len(file_transfer_infos)
+            for file_transfer_info, result in zip(file_transfer_infos, results):
+                cur_retval, cur_retmsg = result if result else (60318, "Document was not injected.")
+                file_name = os.path.basename(file_transfer_info['source']['lfn'])
+                msg  = "Injection for %s" % (file_name)
+                msg += " finished with status %d." % (cur_retval)
                 print(msg)
                 if cmscp_status['aso_injection']['return_code'] in [None, 0]:
                     cmscp_status['aso_injection']['return_code'] = cur_retval
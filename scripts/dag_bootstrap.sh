@@ -105,4 +105,10 @@ if [ "X$_CONDOR_JOB_AD" != "X" ]; then
   cat $_CONDOR_JOB_AD
 fi
 echo "Now running the job in `pwd`..."
+# The pre-jobs and post-jobs are run by the task manager daemon of the DAG (started on demand);
+# the client falls back to TaskManagerBootstrap if the daemon is not available.
+if [ "$1" == "PREJOB" ] || [ "$1" == "POSTJOB" ];
+then
+    exec nice -n 19 python2.6 -m TaskWorker.TaskManagerClient "$@"
+fi
 exec nice -n 19 python2.6 -m TaskWorker.TaskManagerBootstrap "$@"
@@ -73,6 +73,8 @@ then
 fi
 
 touch jobReport.json.$CRAB_Id
+# Replaced by the gzipped CMSSW output snippet written by CMSRunAnalysis.py (if any).
+touch cmsRunSnippet.$CRAB_Id.gz
 
 echo "======== PROXY INFORMATION START at $(TZ=GMT date) ========"
 voms-proxy-info -all
@@ -86,6 +88,10 @@ echo "CMSRunAnalysis.sh complete at $(TZ=GMT date) with (short) exit status $EXI
 echo "======== CMSRunAnalsysis.sh at $(TZ=GMT date) FINISHING ========"
 
 mv jobReport.json jobReport.json.$CRAB_Id
+if [ -f cmsRun-stdout-snippet.log.gz ];
+then
+    mv cmsRun-stdout-snippet.log.gz cmsRunSnippet.$CRAB_Id.gz
+fi
 
 if [[ $EXIT_STATUS == 137 ]]
 then
@@ -20,7 +20,7 @@ systems = \
   },
   'CRABInterface':
   {
-    'py_modules' : ['PandaServerInterface','CRABQuality', 'HTCondorUtils', 'HTCondorLocator', 'ServerUtilities'],
+    'py_modules' : ['PandaServerInterface','CRABQuality', 'HTCondorUtils', 'HTCondorLocator', 'ServerUtilities', 'PFNResolver'],
     'python': ['CRABInterface','CRABInterface/Pages',
                'Databases',
                  'Databases/FileMetaDataDB', 'Databases/FileMetaDataDB/Oracle',
@@ -33,7 +33,7 @@ systems = \
     'py_modules' : ['PandaServerInterface', 'RESTInteractions', 'ApmonIf',
                     'apmon', 'DashboardAPI', 'Logger', 'ProcInfo',
                     'CRABQuality', 'HTCondorUtils', 'HTCondorLocator',
-                    'ServerUtilities', 'MultiProcessingLog', 'CMSGroupMapper'],
+                    'ServerUtilities', 'MultiProcessingLog', 'CMSGroupMapper', 'PFNResolver'],
     'python': ['TaskWorker', 'TaskWorker/Actions', 'TaskWorker/DataObjects',
                 'TaskWorker/Actions/Recurring', 'taskbuffer']
   },
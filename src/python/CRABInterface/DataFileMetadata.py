@@ -24,57 +24,67 @@ class DataFileMetadata(object):
         binds = {'taskname': taskname, 'filetype': filetype}
         rows = self.api.query(None, None, self.FileMetaData.GetFromTaskAndType_sql, **binds)
         for row in rows:
-            yield {'taskname': taskname,
-                   'filetype': filetype,
-                   'pandajobid': row[0],
-                   'outdataset': row[1],
-                   'acquisitionera': row[2],
-                   'swversion': row[3],
-                   'inevents': row[4],
-                   'globaltag': row[5],
-                   'publishname': row[6],
-                   'location': row[7],
-                   'tmplocation': row[8],
-                   'runlumi': literal_eval(row[9].read()),
-                   'adler32': row[10],
-                   'cksum': row[11],
-                   'md5': row[12],
-                   'lfn': row[13],
-                   'filesize': row[14],
-                   'parents': literal_eval(row[15].read()),
-                   'state': row[16],
-                   'created': str(row[17]),
-                   'tmplfn': row[18]}
+            yield self._rowToFile(taskname, filetype, row)
 
-    def inject(self, *args, **kwargs):
-        self.logger.debug("Calling jobmetadata inject with parameters %s" % kwargs)
+    def getJobFiles(self, taskname, jobid, filetype):
+        """Same as getFiles, but only for the files of one job (uses the task/job/type index)"""
+        self.logger.debug("Calling jobmetadata for task %s, job %s and filetype %s" % (taskname, jobid, filetype))
+        binds = {'taskname': taskname, 'jobid': jobid, 'filetype': filetype}
+        rows = self.api.query(None, None, self.FileMetaData.GetFromTaskJobAndType_sql, **binds)
+        for row in rows:
+            yield self._rowToFile(taskname, filetype, row)
 
-        bindnames = set(kwargs.keys()) - set(['outfileruns', 'outfilelumis'])
-        binds = {}
-        for name in bindnames:
-            binds[name] = [str(kwargs[name])]
-        binds['runlumi'] = [str(dict(list(zip(map(str, kwargs['outfileruns']), [map(str, lumilist.split(',')) for lumilist in kwargs['outfilelumis']]))))]
+    def getFileByLfn(self, taskname, lfn):
+        """Retrieve the metadata of a single file (uses the task/lfn primary key). Nothing is returned if the file is not there"""
+        self.logger.debug("Calling jobmetadata for task %s and lfn %s" % (taskname, lfn))
+        binds = {'taskname': taskname, 'lfn': lfn}
+        rows = self.api.query(None, None, self.FileMetaData.GetFromTaskAndLfn_sql, **binds)
+        for row in rows:
+            yield self._rowToFile(taskname, row[19], row)
+
+    @staticmethod
+    def _rowToFile(taskname, filetype, row):
+        return {'taskname': taskname,
+                'filetype': filetype,
+                'pandajobid': row[0],
+                'outdataset': row[1],
+                'acquisitionera': row[2],
+                'swversion': row[3],
+                'inevents': row[4],
+                'globaltag': row[5],
+                'publishname': row[6],
+                'location': row[7],
+                'tmplocation': row[8],
+                'runlumi': literal_eval(row[9].read()),
+                'adler32': row[10],
+                'cksum': row[11],
+                'md5': row[12],
+                'lfn': row[13],
+                'filesize': row[14],
+                'parents': literal_eval(row[15].read()),
+                'state': row[16],
+                'created': str(row[17]),
+                'tmplfn': row[18]}
 
-        #Changed to Select if exist, update, else insert
+    def inject(self, records):
+        """Insert the metadata of a list of files, or update it for the files which are already there.
+           All the records are bound as arrays to a single MERGE statement, i.e. one database round
+           trip and one transaction no matter how many files are passed.
+
+           :arg list records: list of dictionaries with the (validated) PUT parameters of each file."""
+        self.logger.debug("Calling jobmetadata inject for %d files with parameters %s" % (len(records), records))
+
+        binds = {}
+        for record in records:
+            for name in set(record.keys()) - set(['outfileruns', 'outfilelumis']):
+                binds.setdefault(name, []).append(str(record[name]))
+            binds.setdefault('runlumi', []).append(str(dict(list(zip(map(str, record['outfileruns']), \
+                                                   [map(str, lumilist.split(',')) for lumilist in record['outfilelumis']])))))
         binds['outtmplfn'] = binds['outlfn']
-        row = self.api.query(None, None, self.FileMetaData.GetCurrent_sql, 
-                              outlfn=binds['outlfn'][0], taskname=binds['taskname'][0])
-        try:
-            #just one row is picked up by the previous query
-            row = next(row)
-        except StopIteration:
-            #StipIteration will be raised if no rows was found
-            self.logger.debug('No rows selected. Inserting new row into filemetadata')
-            self.api.modify(self.FileMetaData.New_sql, **binds)
-            return []
-        self.logger.debug('Changing filemetadata information about job %s' % row)
-        update_bind = {}
-        update_bind['outtmplocation'] = binds['outtmplocation']
-        update_bind['outsize'] = binds['outsize']
-        update_bind['taskname'] = binds['taskname']
-        update_bind['outlfn'] = binds['outlfn']
-        update_bind['outtmplfn'] = binds['outlfn']
-        self.api.modify(self.FileMetaData.Update_sql, **update_bind)
+
+        ## Every record is either inserted or updated by the merge, but MySQL counts an updated row
+        ## twice in the rowcount, so do not check the number of modified rows.
+        self.api.modifynocheck(self.FileMetaData.Merge_sql, **binds)
         return []
 
     def changeState(self, *args, **kwargs):#kwargs are (taskname, outlfn, filestate)
@@ -2,6 +2,7 @@ import re
 import json
 import time
 import copy
+import shutil
 import StringIO
 import tempfile
 from ast import literal_eval
@@ -10,6 +11,7 @@ import pycurl
 import classad
 
 from ServerUtilities import FEEDBACKMAIL
+from PFNResolver import PFNResolver
 import WMCore.Database.CMSCouch as CMSCouch
 from WMCore.WMSpec.WMTask import buildLumiMask
 from WMCore.DataStructs.LumiList import LumiList
@@ -18,6 +20,8 @@ from CRABInterface.DataWorkflow import DataWorkflow
 from WMCore.Services.pycurl_manager import ResponseHeader
 from WMCore.REST.Error import ExecutionError, InvalidParameter
 from CRABInterface.Utils import conn_handler, global_user_throttle
+from CRABInterface.WebDirCache import CurlPool, WebDirCache
+from CRABInterface.JobLogParser import JobLogParser, JobLogState, JobLogCheckpoints, completeEventsLength
 from Databases.FileMetaDataDB.Oracle.FileMetaData.FileMetaData import GetFromTaskAndType
 
 import HTCondorUtils
@@ -34,6 +38,14 @@ class HTCondorDataWorkflow(DataWorkflow):
     """ HTCondor implementation of the status command.
     """
 
+    def __init__(self, config):
+        DataWorkflow.__init__(self, config)
+        self.jobLogParser = JobLogParser(self.logger)
+        self.curlPool = CurlPool()
+        self.webDirCache = WebDirCache()
+        ## Where to save the state of the job logs parsing (kept only in memory if not set).
+        self.jobLogCheckpoints = JobLogCheckpoints(cachedir=getattr(config, 'statuscachedir', None))
+
     @classmethod
     @conn_handler(services=['centralconfig'])
     def chooseScheduler(cls, scheddname=None, backend_urls=None):
@@ -121,33 +133,39 @@ class HTCondorDataWorkflow(DataWorkflow):
         if howmany != -1:
             rows = rows[:howmany]
         #jobids=','.join(map(str,jobids)), limit=str(howmany) if howmany!=-1 else str(len(jobids)*100))
+        ## Choose the LFN and site of each file, then resolve all the LFNs at each site at once.
+        files = []
         for row in rows:
-            try:
-                jobid = row[GetFromTaskAndType.PANDAID]
-                if row[GetFromTaskAndType.DIRECTSTAGEOUT]:
-                    lfn  = row[GetFromTaskAndType.LFN]
-                    site = row[GetFromTaskAndType.LOCATION]
-                    self.logger.debug("LFN: %s and site %s" % (lfn, site))
-                    pfn  = self.phedex.getPFN(site, lfn)[(site, lfn)]
-                else:
-                    if jobid in finishedIds:
-                        lfn  = row[GetFromTaskAndType.LFN]
-                        site = row[GetFromTaskAndType.LOCATION]
-                        self.logger.debug("LFN: %s and site %s" % (lfn, site))
-                        pfn  = self.phedex.getPFN(site, lfn)[(site, lfn)]
-                    elif jobid in transferingIds:
-                        lfn  = row[GetFromTaskAndType.TMPLFN]
-                        site = row[GetFromTaskAndType.TMPLOCATION]
-                        self.logger.debug("LFN: %s and site %s" % (lfn, site))
-                        pfn  = self.phedex.getPFN(site, lfn)[(site, lfn)]
-                    else:
-                        continue
-            except Exception as err:
-                self.logger.exception(err)
+            jobid = row[GetFromTaskAndType.PANDAID]
+            if row[GetFromTaskAndType.DIRECTSTAGEOUT] or jobid in finishedIds:
+                lfn  = row[GetFromTaskAndType.LFN]
+                site = row[GetFromTaskAndType.LOCATION]
+            elif jobid in transferingIds:
+                lfn  = row[GetFromTaskAndType.TMPLFN]
+                site = row[GetFromTaskAndType.TMPLOCATION]
+            else:
+                continue
+            self.logger.debug("LFN: %s and site %s" % (lfn, site))
+            files.append((row, jobid, lfn, site))
+        lfnsPerSite = {}
+        for _, _, lfn, site in files:
+            lfnsPerSite.setdefault(site, []).append(lfn)
+        pfns = {}
+        try:
+            resolver = PFNResolver(self.phedex, logger=self.logger)
+            for site, lfns in lfnsPerSite.iteritems():
+                for lfn, pfn in resolver.getPFNs(site, lfns).iteritems():
+                    pfns[site, lfn] = pfn
+        except Exception as err:
+            self.logger.exception(err)
+            raise ExecutionError("Exception while contacting PhEDEX.")
+
+        for row, jobid, lfn, site in files:
+            if (site, lfn) not in pfns:
+                self.logger.error("PhEDEx could not map LFN %s at site %s" % (lfn, site))
                 raise ExecutionError("Exception while contacting PhEDEX.")
-
             yield {'jobid': jobid,
-                   'pfn': pfn,
+                   'pfn': pfns[site, lfn],
                    'lfn': lfn,
                    'size': row[GetFromTaskAndType.SIZE],
                    'checksum' : {'cksum' : row[GetFromTaskAndType.CKSUM], 'md5' : row[GetFromTaskAndType.ADLER32], 'adler32' : row[GetFromTaskAndType.ADLER32]}
@@ -482,25 +500,10 @@ class HTCondorDataWorkflow(DataWorkflow):
         return [result]
 
 
-    cpu_re = re.compile(r"Usr \d+ (\d+):(\d+):(\d+), Sys \d+ (\d+):(\d+):(\d+)")
-    def insertCpu(self, event, info):
-        if 'TotalRemoteUsage' in event:
-            m = self.cpu_re.match(event['TotalRemoteUsage'])
-            if m:
-                g = [int(i) for i in m.groups()]
-                user = g[0]*3600 + g[1]*60 + g[2]
-                sys = g[3]*3600 + g[4]*60 + g[5]
-                info['TotalUserCpuTimeHistory'][-1] = user
-                info['TotalSysCpuTimeHistory'][-1] = sys
-        else:
-            if 'RemoteSysCpu' in event:
-                info['TotalSysCpuTimeHistory'][-1] = float(event['RemoteSysCpu'])
-            if 'RemoteUserCpu' in event:
-                info['TotalUserCpuTimeHistory'][-1] = float(event['RemoteUserCpu'])
-
     @classmethod
-    def prepareCurl(cls):
-        curl = pycurl.Curl()
+    def prepareCurl(cls, curl=None):
+        if curl is None:
+            curl = pycurl.Curl()
         curl.setopt(pycurl.NOSIGNAL, 0)
         curl.setopt(pycurl.TIMEOUT, 30)
         curl.setopt(pycurl.CONNECTTIMEOUT, 30)
@@ -530,96 +533,114 @@ class HTCondorDataWorkflow(DataWorkflow):
                                   "contact %s if the error persist. Error from curl: %s"
                                   % (url, FEEDBACKMAIL, str(e))))
 
-    def taskWebStatus(self, task_ad, verbose, statusResult):
-        nodes = {}
-        url = task_ad['CRAB_UserWebDir']
-        curl = self.prepareCurl()
-        fp = tempfile.TemporaryFile()
-        curl.setopt(pycurl.WRITEFUNCTION, fp.write)
+    def getWebDirFile(self, curl, url, decode, conditional=True):
+        """
+        Download a file from the task webdir and return a tuple (HTTP status, decoded content).
+        The content is decoded with decode(fp), where fp is a file object with the downloaded data.
+        If conditional is True, the decoded content is cached and the file is downloaded and
+        decoded again only if it changed on the schedd (If-None-Match/If-Modified-Since).
+        """
+        cached = self.webDirCache.get(url) if conditional else None
+        body = StringIO.StringIO()
         hbuf = StringIO.StringIO()
+        curl.setopt(pycurl.URL, url)
+        curl.setopt(pycurl.HTTPHEADER, cached.conditionalHeaders() if cached else [])
+        curl.setopt(pycurl.WRITEFUNCTION, body.write)
         curl.setopt(pycurl.HEADERFUNCTION, hbuf.write)
         try:
+            self.myPerform(curl, url)
+            header = ResponseHeader(hbuf.getvalue())
+            if header.status == 304 and cached:
+                self.logger.debug("%s did not change since last download, using the cached content" % url)
+                return 200, cached.getData()
+            if header.status != 200:
+                return header.status, None
+            body.seek(0)
+            data = decode(body)
+            if conditional:
+                self.webDirCache.put(url, header.header, data)
+            return header.status, data
+        finally:
+            curl.setopt(pycurl.HTTPHEADER, [])
+            body.close()
+            hbuf.close()
+
+    def taskWebStatus(self, task_ad, verbose, statusResult):
+        nodes = {}
+        url = task_ad['CRAB_UserWebDir']
+
+        def decodeNodeState(body):
+            """ Parse the node state into the nodes found so far. For the simple status (no
+                job log nor site ad) nodes is empty: the result depends only on the file content
+                and can therefore be cached.
+            """
+            fp = tempfile.TemporaryFile()
+            try:
+                shutil.copyfileobj(body, fp)
+                fp.seek(0)
+                parsed = {} if verbose == 0 else nodes
+                self.parseNodeState(fp, parsed)
+                return parsed
+            finally:
+                fp.close()
+
+        with self.curlPool.handle(url) as curl:
+            self.prepareCurl(curl)
             self.logger.debug("Retrieving task status from web with verbosity %d." % verbose)
-            if verbose == 1:
-                jobs_url = url + "/jobs_log.txt"
-                curl.setopt(pycurl.URL, jobs_url)
-                self.logger.info("Starting download of job log")
-                self.myPerform(curl, jobs_url)
-                self.logger.info("Finished download of job log")
-                header = ResponseHeader(hbuf.getvalue())
-                if header.status == 200:
-                    fp.seek(0)
-                    self.logger.debug("Starting parse of job log")
-                    self.parseJobLog(fp, nodes)
-                    self.logger.debug("Finished parse of job log")
-                else:
-                    raise ExecutionError("Cannot get jobs log file. Retry in a minute if you just submitted the task")
-            elif verbose == 2:
-                site_url = url + "/site_ad.txt"
-                curl.setopt(pycurl.URL, site_url)
-                self.logger.debug("Starting download of site ad")
-                self.myPerform(curl, site_url)
-                self.logger.debug("Finished download of site ad")
-                header = ResponseHeader(hbuf.getvalue())
-                if header.status == 200:
-                    fp.seek(0)
-                    self.logger.debug("Starting parse of site ad")
-                    self.parseSiteAd(fp, task_ad, nodes)
-                    self.logger.debug("Finished parse of site ad")
-                else:
-                    raise ExecutionError("Cannot get site ad. Retry in a minute if you just submitted the task")
+            if verbose in [1, 2]:
+                fp = tempfile.TemporaryFile()
+                hbuf = StringIO.StringIO()
+                curl.setopt(pycurl.WRITEFUNCTION, fp.write)
+                curl.setopt(pycurl.HEADERFUNCTION, hbuf.write)
+                try:
+                    if verbose == 1:
+                        jobs_url = url + "/jobs_log.txt"
+                        curl.setopt(pycurl.URL, jobs_url)
+                        self.getJobLog(curl, fp, hbuf, jobs_url, nodes)
+                    else:
+                        site_url = url + "/site_ad.txt"
+                        curl.setopt(pycurl.URL, site_url)
+                        self.logger.debug("Starting download of site ad")
+                        self.myPerform(curl, site_url)
+                        self.logger.debug("Finished download of site ad")
+                        header = ResponseHeader(hbuf.getvalue())
+                        if header.status == 200:
+                            fp.seek(0)
+                            self.logger.debug("Starting parse of site ad")
+                            self.parseSiteAd(fp, task_ad, nodes)
+                            self.logger.debug("Finished parse of site ad")
+                        else:
+                            raise ExecutionError("Cannot get site ad. Retry in a minute if you just submitted the task")
+                finally:
+                    fp.close()
+                    hbuf.close()
 
             nodes_url = url + "/node_state.txt"
-            curl.setopt(pycurl.URL, nodes_url)
-            # Before executing any new curl, truncate and clean temp file
-            fp, hbuf = self.cleanTempFileAndBuff(fp, hbuf)
             self.logger.debug("Starting download of node state")
-            self.myPerform(curl, nodes_url)
+            status, nodeState = self.getWebDirFile(curl, nodes_url, decodeNodeState, conditional = (verbose == 0))
             self.logger.debug("Finished download of node state")
-            header = ResponseHeader(hbuf.getvalue())
-            if header.status == 200:
-                fp.seek(0)
-                self.logger.debug("Starting parse of node state")
-                self.parseNodeState(fp, nodes)
-                self.logger.debug("Finished parse of node state")
-            else:
+            if status != 200:
                 raise MissingNodeStatus("Cannot get node state log. Retry in a minute if you just submitted the task")
+            nodes.update(nodeState)
 
-            site_url = url + "/error_summary.json"
-            # Before executing any new curl, truncate and clean temp file
-            fp, hbuf = self.cleanTempFileAndBuff(fp, hbuf)
-            curl.setopt(pycurl.URL, site_url)
+            summary_url = url + "/error_summary.json"
             self.logger.debug("Starting download of error summary file")
-            self.myPerform(curl, site_url)
+            status, errorReport = self.getWebDirFile(curl, summary_url, json.load)
             self.logger.debug("Finished download of error summary file")
-            header = ResponseHeader(hbuf.getvalue())
-            if header.status == 200:
-                fp.seek(0)
-                self.logger.debug("Starting parse of summary file")
-                self.parseErrorReport(fp, nodes)
-                self.logger.debug("Finished parse of summary file")
+            if status == 200:
+                self.applyErrorReport(errorReport, nodes)
             else:
                 self.logger.debug("No error summary available")
 
-            # Before executing any new curl, truncate and clean temp file
-            fp, hbuf = self.cleanTempFileAndBuff(fp, hbuf)
             aso_url = url + "/aso_status.json"
-            curl.setopt(pycurl.URL, aso_url)
             self.logger.debug("Starting download of aso state")
-            curl.perform()
+            status, asoState = self.getWebDirFile(curl, aso_url, json.load)
             self.logger.debug("Finished download of aso state")
-            header = ResponseHeader(hbuf.getvalue())
-            if header.status == 200:
-                fp.seek(0)
-                self.logger.debug("Starting parsing of aso state")
-                self.parseASOState(fp, nodes, statusResult)
-                self.logger.debug("Finished parsing of aso state")
+            if status == 200:
+                self.applyASOState(asoState, nodes, statusResult)
             else:
                 self.logger.debug("No aso state file available")
             return nodes
-        finally:
-            fp.close()
-            hbuf.close()
 
 
     def publicationStatus(self, workflow, asourl):
@@ -674,129 +695,64 @@ class HTCondorDataWorkflow(DataWorkflow):
         return publicationInfo
 
 
-    node_name_re = re.compile("DAG Node: Job(\d+)")
-    node_name2_re = re.compile("Job(\d+)")
     def parseJobLog(self, fp, nodes):
-        node_map = {}
-        count = 0
-        for event in HTCondorUtils.readEvents(fp):
-            count += 1
-            eventtime = time.mktime(time.strptime(event['EventTime'], "%Y-%m-%dT%H:%M:%S"))
-            if event['MyType'] == 'SubmitEvent':
-                m = self.node_name_re.match(event['LogNotes'])
-                if m:
-                    node = m.groups()[0]
-                    proc = event['Cluster'], event['Proc']
-                    info = nodes.setdefault(node, {'Retries': 0, 'Restarts': 0, 'SiteHistory': [], 'ResidentSetSize': [], 'SubmitTimes': [], 'StartTimes': [],
-                                                'EndTimes': [], 'TotalUserCpuTimeHistory': [], 'TotalSysCpuTimeHistory': [], 'WallDurations': [], 'JobIds': []})
-                    info['State'] = 'idle'
-                    info['JobIds'].append("%d.%d" % proc)
-                    info['RecordedSite'] = False
-                    info['SubmitTimes'].append(eventtime)
-                    info['TotalUserCpuTimeHistory'].append(0)
-                    info['TotalSysCpuTimeHistory'].append(0)
-                    info['WallDurations'].append(0)
-                    info['ResidentSetSize'].append(0)
-                    info['Retries'] = len(info['SubmitTimes'])-1
-                    node_map[proc] = node
-            elif event['MyType'] == 'ExecuteEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                nodes[node]['StartTimes'].append(eventtime)
-                nodes[node]['State'] = 'running'
-                nodes[node]['RecordedSite'] = False
-            elif event['MyType'] == 'JobTerminatedEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                nodes[node]['EndTimes'].append(eventtime)
-                nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
-                self.insertCpu(event, nodes[node])
-                if event['TerminatedNormally']:
-                    if event['ReturnValue'] == 0:
-                        nodes[node]['State'] = 'transferring'
-                    else:
-                        nodes[node]['State'] = 'cooloff'
-                else:
-                    nodes[node]['State']  = 'cooloff'
-            elif event['MyType'] == 'PostScriptTerminatedEvent':
-                m = self.node_name2_re.match(event['DAGNodeName'])
-                if m:
-                    node = m.groups()[0]
-                    if event['TerminatedNormally']:
-                        if event['ReturnValue'] == 0:
-                            nodes[node]['State'] = 'finished'
-                        elif event['ReturnValue'] == 2:
-                            nodes[node]['State'] = 'failed'
-                        else:
-                            nodes[node]['State'] = 'cooloff'
-                    else:
-                        nodes[node]['State']  = 'cooloff'
-            elif event['MyType'] == 'ShadowExceptionEvent' or event["MyType"] == "JobReconnectFailedEvent" or event['MyType'] == 'JobEvictedEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                if nodes[node]['State'] != 'idle':
-                    nodes[node]['EndTimes'].append(eventtime)
-                    if nodes[node]['WallDurations'] and nodes[node]['EndTimes'] and nodes[node]['StartTimes']:
-                        nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
-                    nodes[node]['State'] = 'idle'
-                    self.insertCpu(event, nodes[node])
-                    nodes[node]['TotalUserCpuTimeHistory'].append(0)
-                    nodes[node]['TotalSysCpuTimeHistory'].append(0)
-                    nodes[node]['WallDurations'].append(0)
-                    nodes[node]['ResidentSetSize'].append(0)
-                    nodes[node]['SubmitTimes'].append(-1)
-                    nodes[node]['JobIds'].append(nodes[node]['JobIds'][-1])
-                    nodes[node]['Restarts'] += 1
-            elif event['MyType'] == 'JobAbortedEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                if nodes[node]['State'] == "idle" or nodes[node]['State'] == "held":
-                    nodes[node]['StartTimes'].append(-1)
-                    if not nodes[node]['RecordedSite']:
-                        nodes[node]['SiteHistory'].append("Unknown")
-                nodes[node]['State'] = 'killed'
-                self.insertCpu(event, nodes[node])
-            elif event['MyType'] == 'JobHeldEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                if nodes[node]['State'] == 'running':
-                    nodes[node]['EndTimes'].append(eventtime)
-                    if nodes[node]['WallDurations'] and nodes[node]['EndTimes'] and nodes[node]['StartTimes']:
-                        nodes[node]['WallDurations'][-1] = nodes[node]['EndTimes'][-1] - nodes[node]['StartTimes'][-1]
-                    self.insertCpu(event, nodes[node])
-                    nodes[node]['TotalUserCpuTimeHistory'].append(0)
-                    nodes[node]['TotalSysCpuTimeHistory'].append(0)
-                    nodes[node]['WallDurations'].append(0)
-                    nodes[node]['ResidentSetSize'].append(0)
-                    nodes[node]['SubmitTimes'].append(-1)
-                    nodes[node]['JobIds'].append(nodes[node]['JobIds'][-1])
-                    nodes[node]['Restarts'] += 1
-                nodes[node]['State'] = 'held'
-            elif event['MyType'] == 'JobReleaseEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                nodes[node]['State'] = 'idle'
-            elif event['MyType'] == 'JobAdInformationEvent':
-                node = node_map[event['Cluster'], event['Proc']]
-                if (not nodes[node]['RecordedSite']) and ('JOBGLIDEIN_CMSSite' in event) and not event['JOBGLIDEIN_CMSSite'].startswith("$$"):
-                    nodes[node]['SiteHistory'].append(event['JOBGLIDEIN_CMSSite'])
-                    nodes[node]['RecordedSite'] = True
-                self.insertCpu(event, nodes[node])
-            elif event['MyType'] == 'JobImageSizeEvent':
-                nodes[node]['ResidentSetSize'][-1] = int(event['ResidentSetSize'])
-                if nodes[node]['StartTimes']:
-                    nodes[node]['WallDurations'][-1] = eventtime - nodes[node]['StartTimes'][-1]
-                self.insertCpu(event, nodes[node])
-            elif event["MyType"] == "JobDisconnectedEvent" or event["MyType"] == "JobReconnectedEvent":
-                # These events don't really affect the node status
-                pass
+        """Parse the whole job log in fp and fill nodes with the status history of each node."""
+        state = JobLogState()
+        count = self.jobLogParser.parse(fp, state)
+        self.logger.debug("There were %d events in the job log." % count)
+        JobLogParser.finalize(state, nodes)
+
+
+    content_range_re = re.compile(r"^bytes (?:(\d+)-\d+|\*)/(\d+)$")
+    def getJobLog(self, curl, fp, hbuf, jobs_url, nodes):
+        """
+        Download and parse the job log, starting from where the previous call stopped: only the
+        bytes appended since then are requested (HTTP Range) and parsed on top of the saved state.
+        If the saved state does not match the file on the schedd anymore, start from scratch.
+        """
+        state = self.jobLogCheckpoints.get(jobs_url)
+        while True:
+            if state.offset:
+                curl.setopt(pycurl.RANGE, "%d-" % state.offset)
+            try:
+                self.logger.info("Starting download of job log from byte %d" % state.offset)
+                self.myPerform(curl, jobs_url)
+                self.logger.info("Finished download of job log")
+            finally:
+                if state.offset:
+                    curl.unsetopt(pycurl.RANGE)
+            header = ResponseHeader(hbuf.getvalue())
+            contentRange = dict((k.lower(), v) for k, v in header.header.items()).get('content-range', '')
+            m = self.content_range_re.match(contentRange.strip())
+            if header.status == 200:
+                ## Either we asked for the whole file or the server ignored the range.
+                if state.offset:
+                    state = JobLogState()
+                break
+            elif header.status == 206 and m and m.group(1) and int(m.group(1)) == state.offset:
+                break
+            elif header.status == 416 and m and int(m.group(2)) == state.offset:
+                ## Nothing new in the job log since last time.
+                fp, hbuf = self.cleanTempFileAndBuff(fp, hbuf)
+                break
+            elif state.offset and header.status in [206, 416]:
+                self.logger.info("Job log checkpoint does not match the log on the schedd (%s). Parsing it from scratch." % contentRange)
+                state = JobLogState()
+                fp, hbuf = self.cleanTempFileAndBuff(fp, hbuf)
             else:
-                self.logger.warning("Unknown event type: %s" % event['MyType'])
+                raise ExecutionError("Cannot get jobs log file. Retry in a minute if you just submitted the task")
 
-        self.logger.debug("There were %d events in the job log." % count)
-        now = time.time()
-        for node, info in nodes.items():
-            last_start = now
-            if info['StartTimes']:
-                last_start = info['StartTimes'][-1]
-            while len(info['WallDurations']) < len(info['SiteHistory']):
-                info['WallDurations'].append(now - last_start)
-            while len(info['WallDurations']) > len(info['SiteHistory']):
-                info['SiteHistory'].append("Unknown")
+        ## Only parse complete events, the schedd might be in the middle of writing the last one.
+        complete = completeEventsLength(fp)
+        fp.truncate(complete)
+        fp.seek(0)
+        self.logger.debug("Starting parse of job log")
+        count = self.jobLogParser.parse(fp, state) if complete else 0
+        self.logger.debug("Finished parse of job log: %d new events (%d in total)." % (count, state.count))
+        if complete:
+            state.offset += complete
+            self.jobLogCheckpoints.save(jobs_url, state)
+        JobLogParser.finalize(state, nodes)
 
 
     def parseASOState(self, fp, nodes, statusResult):
@@ -809,8 +765,13 @@ class HTCondorDataWorkflow(DataWorkflow):
             statusResult: the dictionary it is going to be returned by the status to the client.
                           we need this to add a warning in case there are jobs missing in the node_state file
         """
+        self.applyASOState(json.load(fp), nodes, statusResult)
+
+
+    def applyASOState(self, data, nodes, statusResult):
+        """ Same as parseASOState, but for the already decoded content of the aso_status file.
+        """
         transfers = {}
-        data = json.load(fp)
         for docid, result in data['results'].items():
             jobid = str(result['value']['jobid'])
             if not jobid in nodes:
@@ -833,10 +794,14 @@ class HTCondorDataWorkflow(DataWorkflow):
 
     @classmethod
     def parseErrorReport(cls, fp, nodes):
+        fp.seek(0)
+        cls.applyErrorReport(json.load(fp), nodes)
+
+
+    @classmethod
+    def applyErrorReport(cls, data, nodes):
         def last(joberrors):
             return joberrors[max(joberrors, key=int)]
-        fp.seek(0)
-        data = json.load(fp)
         #iterate over the jobs and set the error dict for those which are failed
         for jobid, statedict in nodes.iteritems():
             if 'State' in statedict and statedict['State'] == 'failed' and jobid in data:
@@ -0,0 +1,309 @@
+"""
+Incremental parser of the DAG job log (jobs_log.txt) used by crab status -long.
+
+The job log only grows while the task runs, so instead of parsing it from the
+beginning at every status request we keep a checkpoint with the byte offset up
+to which the log was parsed and the per-node state built so far. The next
+request only needs to download and parse the events appended after that offset.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+import HTCondorUtils
+
+## Each event in the (classic format) HTCondor user log is terminated by this line.
+EVENT_TERMINATOR = "\n...\n"
+
+
+_hourCache = {}
+def eventTimeToEpoch(eventtime):
+    """Convert an event time in the fixed format '%Y-%m-%dT%H:%M:%S' (local time) to seconds
+       since the epoch. Same result as time.mktime(time.strptime(eventtime, "%Y-%m-%dT%H:%M:%S")),
+       but the (expensive) conversion is done only once per hour: the UTC offset can only change
+       at the beginning of an hour, so minutes and seconds can be simply added to the hour start.
+    """
+    hour = eventtime[:13]
+    start = _hourCache.get(hour)
+    if start is None:
+        if len(_hourCache) > 10000:
+            _hourCache.clear()
+        start = time.mktime((int(eventtime[0:4]), int(eventtime[5:7]), int(eventtime[8:10]), int(eventtime[11:13]), 0, 0, 0, 0, -1))
+        _hourCache[hour] = start
+    return start + int(eventtime[14:16]) * 60 + int(eventtime[17:19])
+
+
+def newNodeInfo():
+    return {'Retries': 0, 'Restarts': 0, 'SiteHistory': [], 'ResidentSetSize': [], 'SubmitTimes': [], 'StartTimes': [],
+            'EndTimes': [], 'TotalUserCpuTimeHistory': [], 'TotalSysCpuTimeHistory': [], 'WallDurations': [], 'JobIds': []}
+
+
+class JobLogState(object):
+    """The checkpoint of the job log parsing: where to restart from and what was found so far."""
+
+    def __init__(self):
+        self.offset = 0     # Number of bytes of the job log already parsed (always at an event boundary).
+        self.nodeMap = {}   # (Cluster, Proc) -> node
+        self.nodes = {}     # node -> info dictionary (see newNodeInfo)
+        self.count = 0      # Number of events parsed
+
+
+class JobLogParser(object):
+    """Apply the events of the job log to a JobLogState."""
+
+    node_name_re = re.compile(r"DAG Node: Job(\d+)")
+    node_name2_re = re.compile(r"Job(\d+)")
+    cpu_re = re.compile(r"Usr \d+ (\d+):(\d+):(\d+), Sys \d+ (\d+):(\d+):(\d+)")
+
+    def __init__(self, logger=None):
+        self.logger = logger if logger else logging.getLogger("CRABLogger.JobLogParser")
+        self.handlers = {'SubmitEvent'             : self.submitEvent,
+                         'ExecuteEvent'            : self.executeEvent,
+                         'JobTerminatedEvent'      : self.terminatedEvent,
+                         'PostScriptTerminatedEvent': self.postScriptTerminatedEvent,
+                         'ShadowExceptionEvent'    : self.evictedEvent,
+                         'JobReconnectFailedEvent' : self.evictedEvent,
+                         'JobEvictedEvent'         : self.evictedEvent,
+                         'JobAbortedEvent'         : self.abortedEvent,
+                         'JobHeldEvent'            : self.heldEvent,
+                         'JobReleaseEvent'         : self.releaseEvent,
+                         'JobAdInformationEvent'   : self.adInformationEvent,
+                         'JobImageSizeEvent'       : self.imageSizeEvent,
+                         # These events don't really affect the node status
+                         'JobDisconnectedEvent'    : None,
+                         'JobReconnectedEvent'     : None,
+                        }
+
+    def parse(self, fp, state):
+        """Apply to state all the events in the file object fp (that must contain only complete events)."""
+        count = 0
+        for event in HTCondorUtils.readEvents(fp):
+            count += 1
+            eventtype = event['MyType']
+            if eventtype not in self.handlers:
+                self.logger.warning("Unknown event type: %s" % eventtype)
+                continue
+            handler = self.handlers[eventtype]
+            if handler:
+                handler(event, eventTimeToEpoch(event['EventTime']), state)
+        state.count += count
+        return count
+
+    @staticmethod
+    def finalize(state, nodes):
+        """Fill nodes with a copy of the state nodes, completing the wall times and site
+           histories of the jobs which have not finished yet (these depend on the current time,
+           so they can not be saved in the checkpoint).
+        """
+        nodes.update(pickle.loads(pickle.dumps(state.nodes, pickle.HIGHEST_PROTOCOL)))
+        now = time.time()
+        for node, info in nodes.items():
+            last_start = now
+            if info['StartTimes']:
+                last_start = info['StartTimes'][-1]
+            while len(info['WallDurations']) < len(info['SiteHistory']):
+                info['WallDurations'].append(now - last_start)
+            while len(info['WallDurations']) > len(info['SiteHistory']):
+                info['SiteHistory'].append("Unknown")
+
+    def insertCpu(self, event, info):
+        if 'TotalRemoteUsage' in event:
+            m = self.cpu_re.match(event['TotalRemoteUsage'])
+            if m:
+                g = [int(i) for i in m.groups()]
+                user = g[0]*3600 + g[1]*60 + g[2]
+                sys = g[3]*3600 + g[4]*60 + g[5]
+                info['TotalUserCpuTimeHistory'][-1] = user
+                info['TotalSysCpuTimeHistory'][-1] = sys
+        else:
+            if 'RemoteSysCpu' in event:
+                info['TotalSysCpuTimeHistory'][-1] = float(event['RemoteSysCpu'])
+            if 'RemoteUserCpu' in event:
+                info['TotalUserCpuTimeHistory'][-1] = float(event['RemoteUserCpu'])
+
+    @staticmethod
+    def newRestart(info):
+        info['TotalUserCpuTimeHistory'].append(0)
+        info['TotalSysCpuTimeHistory'].append(0)
+        info['WallDurations'].append(0)
+        info['ResidentSetSize'].append(0)
+        info['SubmitTimes'].append(-1)
+        info['JobIds'].append(info['JobIds'][-1])
+        info['Restarts'] += 1
+
+    def submitEvent(self, event, eventtime, state):
+        m = self.node_name_re.match(event['LogNotes'])
+        if m:
+            node = m.groups()[0]
+            proc = event['Cluster'], event['Proc']
+            info = state.nodes.setdefault(node, newNodeInfo())
+            info['State'] = 'idle'
+            info['JobIds'].append("%d.%d" % proc)
+            info['RecordedSite'] = False
+            info['SubmitTimes'].append(eventtime)
+            info['TotalUserCpuTimeHistory'].append(0)
+            info['TotalSysCpuTimeHistory'].append(0)
+            info['WallDurations'].append(0)
+            info['ResidentSetSize'].append(0)
+            info['Retries'] = len(info['SubmitTimes'])-1
+            state.nodeMap[proc] = node
+
+    def executeEvent(self, event, eventtime, state):
+        info = state.nodes[state.nodeMap[event['Cluster'], event['Proc']]]
+        info['StartTimes'].append(eventtime)
+        info['State'] = 'running'
+        info['RecordedSite'] = False
+
+    def terminatedEvent(self, event, eventtime, state):
+        info = state.nodes[state.nodeMap[event['Cluster'], event['Proc']]]
+        info['EndTimes'].append(eventtime)
+        info['WallDurations'][-1] = info['EndTimes'][-1] - info['StartTimes'][-1]
+        self.insertCpu(event, info)
+        if event['TerminatedNormally'] and event['ReturnValue'] == 0:
+            info['State'] = 'transferring'
+        else:
+            info['State'] = 'cooloff'
+
+    def postScriptTerminatedEvent(self, event, eventtime, state):
+        m = self.node_name2_re.match(event['DAGNodeName'])
+        if m:
+            info = state.nodes[m.groups()[0]]
+            if event['TerminatedNormally']:
+                if event['ReturnValue'] == 0:
+                    info['State'] = 'finished'
+                elif event['ReturnValue'] == 2:
+                    info['State'] = 'failed'
+                else:
+                    info['State'] = 'cooloff'
+            else:
+                info['State'] = 'cooloff'
+
+    def evictedEvent(self, event, eventtime, state):
+        info = state.nodes[state.nodeMap[event['Cluster'], event['Proc']]]
+        if info['State'] != 'idle':
+            info['EndTimes'].append(eventtime)
+            if info['WallDurations'] and info['EndTimes'] and info['StartTimes']:
+                info['WallDurations'][-1] = info['EndTimes'][-1] - info['StartTimes'][-1]
+            info['State'] = 'idle'
+            self.insertCpu(event, info)
+            self.newRestart(info)
+
+    def abortedEvent(self, event, eventtime, state):
+        info = state.nodes[state.nodeMap[event['Cluster'], event['Proc']]]
+        if info['State'] == "idle" or info['State'] == "held":
+            info['StartTimes'].append(-1)
+            if not info['RecordedSite']:
+                info['SiteHistory'].append("Unknown")
+        info['State'] = 'killed'
+        self.insertCpu(event, info)
+
+    def heldEvent(self, event, eventtime, state):
+        info = state.nodes[state.nodeMap[event['Cluster'], event['Proc']]]
+        if info['State'] == 'running':
+            info['EndTimes'].append(eventtime)
+            if info['WallDurations'] and info['EndTimes'] and info['StartTimes']:
+                info['WallDurations'][-1] = info['EndTimes'][-1] - info['StartTimes'][-1]
+            self.insertCpu(event, info)
+            self.newRestart(info)
+        info['State'] = 'held'
+
+    def releaseEvent(self, event, eventtime, state):
+        state.nodes[state.nodeMap[event['Cluster'], event['Proc']]]['State'] = 'idle'
+
+    def adInformationEvent(self, event, eventtime, state):
+        info = state.nodes[state.nodeMap[event['Cluster'], event['Proc']]]
+        if (not info['RecordedSite']) and ('JOBGLIDEIN_CMSSite' in event) and not event['JOBGLIDEIN_CMSSite'].startswith("$$"):
+            info['SiteHistory'].append(event['JOBGLIDEIN_CMSSite'])
+            info['RecordedSite'] = True
+        self.insertCpu(event, info)
+
+    def imageSizeEvent(self, event, eventtime, state):
+        node = state.nodeMap.get((event['Cluster'], event['Proc']))
+        if node is None:
+            return
+        info = state.nodes[node]
+        info['ResidentSetSize'][-1] = int(event['ResidentSetSize'])
+        if info['StartTimes']:
+            info['WallDurations'][-1] = eventtime - info['StartTimes'][-1]
+        self.insertCpu(event, info)
+
+
+def completeEventsLength(fp, chunksize=65536):
+    """Return the number of bytes at the beginning of the file object fp that contain only complete
+       events, i.e. the position right after the last event terminator. The log may be read while
+       the schedd is still writing an event at its end: such an event will be parsed next time.
+    """
+    fp.seek(0, os.SEEK_END)
+    end = fp.tell()
+    overlap = len(EVENT_TERMINATOR) - 1
+    while end > 0:
+        start = max(0, end - chunksize)
+        fp.seek(start)
+        idx = fp.read(end - start).rfind(EVENT_TERMINATOR)
+        if idx >= 0:
+            return start + idx + len(EVENT_TERMINATOR)
+        if start == 0:
+            break
+        end = start + overlap
+    return 0
+
+
+class JobLogCheckpoints(object):
+    """Process-wide store of the JobLogState of each job log, keyed by the job log URL.
+
+       The states are kept pickled, so that each request works on its own copy (requests
+       for the same task can be served concurrently by different threads). The most recently
+       used ones are kept in memory; if a cache directory is given they are also saved there,
+       so that they survive restarts and are shared between processes.
+    """
+
+    def __init__(self, cachedir=None, maxinmemory=200):
+        self.cachedir = cachedir
+        self.maxinmemory = maxinmemory
+        self.lock = threading.Lock()
+        self.checkpoints = OrderedDict()
+        self.logger = logging.getLogger("CRABLogger.JobLogCheckpoints")
+
+    def _filename(self, url):
+        return os.path.join(self.cachedir, "%s.joblog.pkl" % hashlib.sha1(url).hexdigest())
+
+    def get(self, url):
+        """Return a copy of the last saved JobLogState of url, or a new (empty) JobLogState."""
+        with self.lock:
+            data = self.checkpoints.pop(url, None)
+            if data is not None:
+                self.checkpoints[url] = data
+        if data is None and self.cachedir:
+            try:
+                with open(self._filename(url), 'rb') as fd:
+                    data = fd.read()
+            except IOError:
+                pass
+        if data is not None:
+            try:
+                return pickle.loads(data)
+            except Exception: #pylint: disable=broad-except
+                self.logger.exception("Cannot load the job log checkpoint of %s. Starting from scratch." % url)
+        return JobLogState()
+
+    def save(self, url, state):
+        data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.checkpoints.pop(url, None)
+            self.checkpoints[url] = data
+            while len(self.checkpoints) > self.maxinmemory:
+                self.checkpoints.popitem(last=False)
+        if self.cachedir:
+            try:
+                fd, tmpname = tempfile.mkstemp(dir=self.cachedir)
+                with os.fdopen(fd, 'wb') as tmpfd:
+                    tmpfd.write(data)
+                os.rename(tmpname, self._filename(url))
+            except (IOError, OSError):
+                self.logger.exception("Cannot save the job log checkpoint of %s." % url)
@@ -1,6 +1,6 @@
 # WMCore dependecies here
 from WMCore.REST.Error import InvalidParameter
-from WMCore.REST.Server import RESTEntity, restcall
+from WMCore.REST.Server import RESTEntity, RESTArgs, restcall
 from WMCore.REST.Validation import validate_str, validate_strlist, validate_num, validate_numlist
 
 # CRABServer dependecies here
@@ -9,8 +9,12 @@ from CRABInterface.Regexps import *
 from CRABInterface.DataFileMetadata import DataFileMetadata
 
 # external dependecies here
+import json
 import cherrypy
 
+## Upper limit to the number of file records accepted in a single PUT (one transaction).
+MAX_FILEMETADATA_PER_PUT = 10000
+
 
 class RESTFileMetadata(RESTEntity):
     """REST entity to handle job metadata information"""
@@ -24,40 +28,30 @@ class RESTFileMetadata(RESTEntity):
         authz_login_valid()
 
         if method in ['PUT']:
-            #TODO check optional parameter
-            #TODO check all the regexp
-            validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
-            validate_strlist("outfilelumis", param, safe, RX_LUMILIST)
-            validate_numlist("outfileruns", param, safe)
-            if len(safe.kwargs["outfileruns"]) != len(safe.kwargs["outfilelumis"]):
-                raise InvalidParameter("The number of runs and the number of lumis lists are different")
-            validate_strlist("inparentlfns", param, safe, RX_PARENTLFN)
-            validate_str("globalTag", param, safe, RX_GLOBALTAG, optional=True)
-            validate_num("pandajobid", param, safe, optional=False)
-            validate_num("outsize", param, safe, optional=False)
-            validate_str("publishdataname", param, safe, RX_PUBLISH, optional=False)
-            validate_str("appver", param, safe, RX_CMSSW, optional=False)
-            validate_str("outtype", param, safe, RX_OUTTYPES, optional=False)
-            validate_str("checksummd5", param, safe, RX_CHECKSUM, optional=False)
-            validate_str("checksumcksum", param, safe, RX_CHECKSUM, optional=False)
-            validate_str("checksumadler32", param, safe, RX_CHECKSUM, optional=False)
-            validate_str("outlocation", param, safe, RX_CMSSITE, optional=False)
-            validate_str("outtmplocation", param, safe, RX_CMSSITE, optional=False)
-            validate_str("acquisitionera", param, safe, RX_TASKNAME, optional=False)#TODO Do we really need this?
-            validate_str("outdatasetname", param, safe, RX_OUTDSLFN, optional=False)#TODO temporary, need to come up with a regex
-            validate_str("outlfn", param, safe, RX_PARENTLFN, optional=False)
-            validate_str("outtmplfn", param, safe, RX_PARENTLFN, optional=True)
-            validate_num("events", param, safe, optional=False)
-            validate_str("filestate", param, safe, RX_FILESTATE, optional=True)
-            validate_num("directstageout", param, safe, optional=True)
-            safe.kwargs["directstageout"] = 'T' if safe.kwargs["directstageout"] else 'F' #'F' if not provided
+            ## Either a single file record passed as plain parameters, or a JSON encoded list
+            ## of file records (filemetadatalist) that are all injected in the same transaction.
+            if 'filemetadatalist' in param.kwargs:
+                safe.kwargs['filemetadatalist'] = self._validateFileMetadataList(param.kwargs.pop('filemetadatalist'))
+            else:
+                safe.kwargs['filemetadatalist'] = [self._validateFileMetadata(param)]
         elif method in ['POST']:
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
             validate_str("outlfn", param, safe, RX_LFN, optional=False)
             validate_str("filestate", param, safe, RX_FILESTATE, optional=False)
         elif method in ['GET']:
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
-            validate_str("filetype", param, safe, RX_OUTTYPES, optional=False)
+            validate_str("filetype", param, safe, RX_OUTTYPES, optional=True)
+            validate_str("lfn", param, safe, RX_PARENTLFN, optional=True)
+            validate_num("jobid", param, safe, optional=True)
+            # possible combinations to check
+            # 1) taskname + filetype
+            # 2) taskname + jobid + filetype
+            # 3) taskname + lfn
+            if safe.kwargs["lfn"]:
+                if safe.kwargs["filetype"] or safe.kwargs["jobid"] is not None:
+                    raise InvalidParameter("The lfn parameter can not be combined with the filetype and jobid parameters.")
+            elif not safe.kwargs["filetype"]:
+                raise InvalidParameter("You have to specify either the filetype (optionally with a jobid) or the lfn of the files to retrieve.")
         elif method in ['DELETE']:
             authz_operator()
             validate_str("taskname", param, safe, RX_TASKNAME, optional=True)
@@ -66,6 +60,67 @@ class RESTFileMetadata(RESTEntity):
                raise InvalidParameter("You have to specify a taskname or a number of hours. Files of this task or created before the number of hours"+\
                                         " will be deleted. Only one of the two parameters can be specified.")
 
+    def _validateFileMetadata(self, param):
+        """Validate the parameters describing one file and return them as a dictionary"""
+        safe = RESTArgs([], {})
+        #TODO check optional parameter
+        #TODO check all the regexp
+        validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
+        validate_strlist("outfilelumis", param, safe, RX_LUMILIST)
+        validate_numlist("outfileruns", param, safe)
+        if len(safe.kwargs["outfileruns"]) != len(safe.kwargs["outfilelumis"]):
+            raise InvalidParameter("The number of runs and the number of lumis lists are different")
+        validate_strlist("inparentlfns", param, safe, RX_PARENTLFN)
+        validate_str("globalTag", param, safe, RX_GLOBALTAG, optional=True)
+        validate_num("pandajobid", param, safe, optional=False)
+        validate_num("outsize", param, safe, optional=False)
+        validate_str("publishdataname", param, safe, RX_PUBLISH, optional=False)
+        validate_str("appver", param, safe, RX_CMSSW, optional=False)
+        validate_str("outtype", param, safe, RX_OUTTYPES, optional=False)
+        validate_str("checksummd5", param, safe, RX_CHECKSUM, optional=False)
+        validate_str("checksumcksum", param, safe, RX_CHECKSUM, optional=False)
+        validate_str("checksumadler32", param, safe, RX_CHECKSUM, optional=False)
+        validate_str("outlocation", param, safe, RX_CMSSITE, optional=False)
+        validate_str("outtmplocation", param, safe, RX_CMSSITE, optional=False)
+        validate_str("acquisitionera", param, safe, RX_TASKNAME, optional=False)#TODO Do we really need this?
+        validate_str("outdatasetname", param, safe, RX_OUTDSLFN, optional=False)#TODO temporary, need to come up with a regex
+        validate_str("outlfn", param, safe, RX_PARENTLFN, optional=False)
+        validate_str("outtmplfn", param, safe, RX_PARENTLFN, optional=True)
+        validate_num("events", param, safe, optional=False)
+        validate_str("filestate", param, safe, RX_FILESTATE, optional=True)
+        validate_num("directstageout", param, safe, optional=True)
+        safe.kwargs["directstageout"] = 'T' if safe.kwargs["directstageout"] else 'F' #'F' if not provided
+        return safe.kwargs
+
+    def _validateFileMetadataList(self, filemetadatalist):
+        """Validate a JSON encoded list of file records. Each record is a dictionary with the same
+           keys accepted by the single file PUT and is validated exactly as that one.
+        """
+        try:
+            records = json.loads(filemetadatalist)
+        except (TypeError, ValueError):
+            raise InvalidParameter("The filemetadatalist parameter is not a valid JSON document")
+        if not isinstance(records, list) or not records or not all(isinstance(record, dict) for record in records):
+            raise InvalidParameter("The filemetadatalist parameter must be a non empty list of file records")
+        if len(records) > MAX_FILEMETADATA_PER_PUT:
+            raise InvalidParameter("Too many file records in one request: %d (max %d)" % (len(records), MAX_FILEMETADATA_PER_PUT))
+        validated = []
+        for record in records:
+            ## Make the record look like url encoded parameters, so that the same validation can be used.
+            kwargs = {}
+            for key, value in record.iteritems():
+                if isinstance(value, list):
+                    kwargs[str(key)] = [str(val) for val in value]
+                elif value is not None:
+                    kwargs[str(key)] = str(value)
+            recparam = RESTArgs([], kwargs)
+            validated.append(self._validateFileMetadata(recparam))
+            if recparam.kwargs:
+                raise InvalidParameter("Invalid parameters in file record: %s" % ', '.join(sorted(recparam.kwargs.keys())))
+        if len(set(record['taskname'] for record in validated)) != 1:
+            raise InvalidParameter("All the file records in a request must belong to the same task")
+        return validated
+
     ## A few notes about how the following methods (put, post, get, delete) work when decorated with restcall.
     ## * The order of the arguments is irrelevant. For example, these two definitions are equivalent:
     ##   def get(self, a, b) or def get(self, b, a)
@@ -76,14 +131,9 @@ class RESTFileMetadata(RESTEntity):
     ## * The name of the arguments has to be the same as used in the http request, and the same as used in validate().
 
     @restcall
-    def put(self, taskname, outfilelumis, inparentlfns, globalTag, outfileruns, pandajobid, outsize, publishdataname, appver, outtype, checksummd5,\
-            checksumcksum, checksumadler32, outlocation, outtmplocation, outdatasetname, acquisitionera, outlfn, events, filestate, directstageout, outtmplfn):
-        """Insert a new job metadata information"""
-        return self.jobmetadata.inject(taskname=taskname, outfilelumis=outfilelumis, inparentlfns=inparentlfns, globalTag=globalTag, outfileruns=outfileruns,\
-                           pandajobid=pandajobid, outsize=outsize, publishdataname=publishdataname, appver=appver, outtype=outtype, checksummd5=checksummd5,\
-                           checksumcksum=checksumcksum, checksumadler32=checksumadler32, outlocation=outlocation, outtmplocation=outtmplocation,\
-                           outdatasetname=outdatasetname, acquisitionera=acquisitionera, outlfn=outlfn, outtmplfn=outtmplfn, events=events, filestate=filestate, \
-                           directstageout=directstageout)
+    def put(self, filemetadatalist):
+        """Insert (or update if already there) the metadata information of one or more files"""
+        return self.jobmetadata.inject(filemetadatalist)
 
     @restcall
     def post(self, taskname, outlfn, filestate):
@@ -92,12 +142,18 @@ class RESTFileMetadata(RESTEntity):
         return self.jobmetadata.changeState(taskname=taskname, outlfn=outlfn, filestate=filestate)
 
     @restcall
-    def get(self, taskname, filetype):
+    def get(self, taskname, filetype, jobid, lfn):
         """Retrieves a specific job metadata information.
 
            :arg str taskname: unique name identifier of the task;
            :arg str filetype: filter the file type to return;
+           :arg int jobid: only return the files of this job (together with filetype);
+           :arg str lfn: only return the file with this lfn;
            :retrun: generator looping through the resulting db rows."""
+        if lfn:
+            return self.jobmetadata.getFileByLfn(taskname, lfn)
+        if jobid is not None:
+            return self.jobmetadata.getJobFiles(taskname, jobid, filetype)
         return self.jobmetadata.getFiles(taskname, filetype)
 
     @restcall
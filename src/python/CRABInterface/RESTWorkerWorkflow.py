@@ -36,6 +36,7 @@ class RESTWorkerWorkflow(RESTEntity):
             validate_str("subuser", param, safe, RX_DN, optional=False)
         elif method in ['POST']:
             validate_str("workflow", param, safe, RX_TASKNAME, optional=True)
+            validate_strlist("workflows", param, safe, RX_TASKNAME)
             validate_str("status", param, safe, RX_STATUS, optional=True)
             validate_str("getstatus", param, safe, RX_STATUS, optional=True)
             validate_num("jobset", param, safe, optional=True)
@@ -53,6 +54,7 @@ class RESTWorkerWorkflow(RESTEntity):
             # 4) taskname + status == (1)
             # 5)            status + limit + getstatus + workername
             # 6) taskname + runs + lumis
+            # 7) tasknames + status (+ getstatus)
         elif method in ['GET']:
             validate_str("workername", param, safe, RX_WORKER_NAME, optional=True)
             validate_str("getstatus", param, safe, RX_STATUS, optional=True)
@@ -80,7 +82,7 @@ class RESTWorkerWorkflow(RESTEntity):
         return []
 
     @restcall
-    def post(self, workflow, status, subresource, jobset, failure, resubmittedjobs, getstatus, workername, limit, runs, lumis):
+    def post(self, workflow, workflows, status, subresource, jobset, failure, resubmittedjobs, getstatus, workername, limit, runs, lumis):
         """ Updates task information """
         if failure is not None:
             try:
@@ -102,6 +104,7 @@ class RESTWorkerWorkflow(RESTEntity):
                                                                                                    "get_status": [getstatus],
                                                                                                    "limit": [limit],
                                                                                                    "set_status": [status]}},
+                  "bulkstate": {"args": (workflows, status, getstatus), "method": self.setBulkStatus, "kwargs": {}},
                   "lumimask": {"args": (runs, lumis,), "method": self.setLumiMask, "kwargs": {"taskname": [workflow]}}
 
         }
@@ -143,6 +146,20 @@ class RESTWorkerWorkflow(RESTEntity):
         """ Delete a task from the DB """
         raise NotImplementedError
 
+    def setBulkStatus(self, workflows, status, getstatus):
+        """ Set the status of many tasks with a single request. If getstatus is given, only the
+            tasks that are still in that status are updated, so that an update that was delayed
+            (e.g. retried by the TaskWorker after a 503) does not overwrite a newer status.
+        """
+        if not workflows or status is None:
+            raise InvalidParameter("The bulkstate subresource requires a list of workflows and a status")
+        binds = {"status": [status]*len(workflows), "taskname": workflows}
+        if getstatus is None:
+            self.api.modify(self.Task.SetStatusTask_sql, **binds)
+        else:
+            binds["getstatus"] = [getstatus]*len(workflows)
+            self.api.modifynocheck(self.Task.SetStatusTaskIfStatus_sql, **binds)
+
     def setLumiMask(self, runs, lumis, **binds):
         """ Load the old splitargs, convert it into the corresponding dict, and change runs and lumis
             accordingly to what the TaskWorker provided
@@ -90,7 +90,7 @@ RX_TEXT_FAIL = re.compile(r"^[A-Za-z0-9\-\._\s\=\+/]{0,10000}$")
 ## user dn
 RX_DN = re.compile(r"^/(?:C|O|DC)=.*/CN=.")
 ## worker subresources
-RX_SUBPOSTWORKER = re.compile(r"^state|start|failure|success|process|lumimask$")
+RX_SUBPOSTWORKER = re.compile(r"^state|bulkstate|start|failure|success|process|lumimask$")
 RX_SUBGETWORKER = re.compile(r"jobgroup")
 
 # Schedulers
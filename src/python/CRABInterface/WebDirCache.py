@@ -0,0 +1,102 @@
+"""
+Caches used by the status command when reading the task files from the schedd webdir.
+
+Most of the status requests find the same node_state.txt, error_summary.json and
+aso_status.json they found at the previous request. We therefore remember the
+validators (ETag, Last-Modified) and the decoded content of each file, and ask
+the schedd for the file only if it changed (conditional GET). The curl handles
+are also reused, so that the connections to the schedds are kept alive.
+"""
+import logging
+import threading
+import cPickle as pickle
+from urlparse import urlparse
+from contextlib import contextmanager
+from collections import OrderedDict
+
+import pycurl
+
+
+class CurlPool(object):
+    """Keep the idle curl handles per host, so that the connection to each schedd can be reused."""
+
+    def __init__(self, maxidleperhost=4):
+        self.maxidleperhost = maxidleperhost
+        self.lock = threading.Lock()
+        self.idle = {}
+
+    @contextmanager
+    def handle(self, url):
+        """Context manager returning a (reset) curl handle for the host of url."""
+        host = urlparse(url).netloc
+        with self.lock:
+            handles = self.idle.get(host, [])
+            curl = handles.pop() if handles else None
+        if curl is None:
+            curl = pycurl.Curl()
+        else:
+            ## Clear all the options (but keep the open connections).
+            curl.reset()
+        try:
+            yield curl
+        except:
+            ## Do not reuse a handle left in an unknown state.
+            curl.close()
+            raise
+        with self.lock:
+            handles = self.idle.setdefault(host, [])
+            if len(handles) < self.maxidleperhost:
+                handles.append(curl)
+                curl = None
+        if curl is not None:
+            curl.close()
+
+
+class WebDirCacheEntry(object):
+    """The validators and the (pickled) decoded content of one downloaded file."""
+
+    def __init__(self, etag, lastmodified, data):
+        self.etag = etag
+        self.lastmodified = lastmodified
+        self.pickled = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+    def conditionalHeaders(self):
+        headers = []
+        if self.etag:
+            headers.append("If-None-Match: %s" % self.etag)
+        if self.lastmodified:
+            headers.append("If-Modified-Since: %s" % self.lastmodified)
+        return headers
+
+    def getData(self):
+        """Return a new copy of the decoded content, that the caller is free to modify."""
+        return pickle.loads(self.pickled)
+
+
+class WebDirCache(object):
+    """LRU cache of WebDirCacheEntry objects, keyed by URL."""
+
+    def __init__(self, maxentries=1000):
+        self.maxentries = maxentries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.logger = logging.getLogger("CRABLogger.WebDirCache")
+
+    def get(self, url):
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is not None:
+                self.entries[url] = entry
+        return entry
+
+    def put(self, url, headers, data):
+        """Save the decoded content of url, if the response headers allow a conditional GET next time."""
+        headers = dict((key.lower(), value.strip()) for key, value in headers.items())
+        etag, lastmodified = headers.get('etag'), headers.get('last-modified')
+        with self.lock:
+            self.entries.pop(url, None)
+            if not etag and not lastmodified:
+                return
+            self.entries[url] = WebDirCacheEntry(etag, lastmodified, data)
+            while len(self.entries) > self.maxentries:
+                self.entries.popitem(last=False)
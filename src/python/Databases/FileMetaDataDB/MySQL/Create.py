@@ -52,3 +52,7 @@ class Create(DBCreator):
               CONSTRAINT fk_tm_taskname FOREIGN KEY (tm_taskname) REFERENCES tasks (tm_taskname)
             )ENGINE=InnoDB
         """
+        ## Used to retrieve the files of a given job without scanning all the files of the task.
+        self.create['c_filemetadata_taskjobtype_idx'] = """
+            CREATE INDEX fmd_taskjobtype_idx ON filemetadata (tm_taskname, panda_job_id, fmd_type)
+        """
@@ -75,6 +75,7 @@ class Task(object):
 		             WHERE tm_taskname = %(tm_taskname)s"
 
     SetStatusTask_sql = "UPDATE tasks SET tm_task_status = upper(%(status)s) WHERE tm_taskname = %(taskname)s"
+    SetStatusTaskIfStatus_sql = "UPDATE tasks SET tm_task_status = upper(%(status)s) WHERE tm_taskname = %(taskname)s AND tm_task_status = upper(%(getstatus)s)"
 
     UpdateWorker_sql = """UPDATE tasks SET tw_name = %(tw_name)s, tm_task_status = %(set_status)s \
                 WHERE tm_taskname IN (SELECT tm_taskname FROM (SELECT tm_taskname FROM tasks \
@@ -119,6 +119,7 @@ class Task(object):
    
     #SetStatusTask
     SetStatusTask_sql = "UPDATE tasks SET tm_task_status = upper(:status) WHERE tm_taskname = :taskname"
+    SetStatusTaskIfStatus_sql = "UPDATE tasks SET tm_task_status = upper(:status) WHERE tm_taskname = :taskname AND tm_task_status = upper(:getstatus)"
    
     #UpdateWorker
     UpdateWorker_sql = """UPDATE tasks SET tw_name = :tw_name, tm_task_status = :set_status \
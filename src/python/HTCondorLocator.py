@@ -3,12 +3,24 @@ import types
 import bisect
 import random
 import time
+import logging
+import threading
 import classad
 import htcondor
 
 from . import HTCondorUtils
 
 CollectorCache = {}
+
+## Seconds during which a schedd handle is used without asking the collector again.
+SCHEDD_HANDLE_TTL = 600
+## Seconds during which a failed collector query for a schedd is not repeated.
+SCHEDD_NEGATIVE_TTL = 60
+## Seconds after which a schedd ad that could not be refreshed is no longer used.
+SCHEDD_HANDLE_MAX_AGE = 1800
+## Seconds between two passes of the background refresh of the schedd ads.
+SCHEDD_REFRESH_INTERVAL = 120
+
 # From http://stackoverflow.com/questions/3679694/a-weighted-version-of-random-choice
 def weighted_choice(choices):
     values, weights = list(zip(*choices))
@@ -21,6 +33,135 @@ def weighted_choice(choices):
     i = bisect.bisect(cum_weights, x)
     return values[i]
 
+class ScheddRegistry(object):
+    """
+    Process-wide registry of the schedd handles (htcondor.Schedd object, address
+    and ad), keyed by (collector, schedd name).
+
+    A handle is used for ttl seconds without asking the collector again. Handles
+    that were used recently are refreshed by a background thread before they
+    expire, so that normally nobody waits for the collector. If the collector
+    can not be queried, the last known ad is used until it is maxage seconds
+    old; if there is none, the failure is remembered for negativettl seconds,
+    during which the collector is not queried again for that schedd. Users of a
+    handle should call invalidate() when an operation on the schedd fails with
+    a RuntimeError, so that the next user asks the collector again.
+    """
+    def __init__(self, ttl=SCHEDD_HANDLE_TTL, negativettl=SCHEDD_NEGATIVE_TTL, \
+                 maxage=SCHEDD_HANDLE_MAX_AGE, refreshinterval=SCHEDD_REFRESH_INTERVAL):
+        self.ttl = ttl
+        self.negativettl = negativettl
+        self.maxage = maxage
+        self.refreshinterval = refreshinterval
+        self.lock = threading.Lock()
+        ## (collector, schedd) -> {'handle': (scheddObj, address, scheddAd) or None,
+        ##                         'updated': time of the last successful query,
+        ##                         'failed': time of the last failed query or None,
+        ##                         'error': error of the last failed query,
+        ##                         'used': time of the last get()}
+        self.entries = {}
+        self.refresher = None
+        self.logger = logging.getLogger(__name__)
+
+    def _query(self, collector, schedd):
+        """
+        Ask the collector for the ad of the schedd and return a new handle.
+        We hold HTCondorUtils.HTCondorLock, as the refresher thread also talks
+        to the collector.
+        """
+        with HTCondorUtils.HTCondorLock:
+            coll = htcondor.Collector(collector)
+            schedds = coll.query(htcondor.AdTypes.Schedd, 'regexp(%s, Name)' % HTCondorUtils.quote(schedd))
+            if not schedds:
+                raise Exception("Schedd %s not found in collector %s" % (schedd, collector))
+            scheddAd = schedds[0]
+            return htcondor.Schedd(scheddAd), scheddAd['MyAddress'], scheddAd
+
+    def _update(self, key):
+        """
+        Query the collector for the given key and update the entry. Return the
+        entry, possibly with the old handle if the query failed.
+        """
+        try:
+            handle = self._query(*key)
+            error = None
+        except Exception as ex:
+            handle = None
+            error = ex
+        now = time.time()
+        with self.lock:
+            entry = self.entries.setdefault(key, {'handle': None, 'updated': 0, 'failed': None, 'error': None, 'used': now})
+            if handle is not None:
+                entry.update({'handle': handle, 'updated': now, 'failed': None, 'error': None})
+            else:
+                entry.update({'failed': now, 'error': error})
+            return dict(entry)
+
+    def get(self, collector, schedd):
+        """
+        Return the tuple (scheddObj, address, scheddAd) for the schedd.
+        """
+        key = (collector, schedd)
+        now = time.time()
+        with self.lock:
+            self._startRefresher()
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['used'] = now
+                entry = dict(entry)
+        if entry is None or (now - entry['updated'] >= self.ttl and \
+                             (entry['failed'] is None or now - entry['failed'] >= self.negativettl)):
+            entry = self._update(key)
+        if entry['handle'] is not None and now - entry['updated'] < self.maxage:
+            if entry['failed'] is not None:
+                self.logger.warning("Unable to contact the collector %s; using the %d seconds old ad of %s.", \
+                                    collector, now - entry['updated'], schedd)
+            return entry['handle']
+        if entry['handle'] is not None:
+            raise Exception("Unable to contact the collector and cached results are too old for using: %s" % str(entry['error']))
+        raise Exception("Unable to contact the collector and cached results does not exist for %s: %s" % (schedd, str(entry['error'])))
+
+    def invalidate(self, collector, schedd):
+        """
+        Forget the handle of the schedd.
+        """
+        with self.lock:
+            self.entries.pop((collector, schedd), None)
+
+    def _startRefresher(self):
+        """
+        Start the refresher thread, if not running. It is not running in a process
+        forked after the thread was started, so we check every time. Called with
+        self.lock held.
+        """
+        if self.refresher is not None and self.refresher.is_alive():
+            return
+        self.refresher = threading.Thread(target=self._refresh, name="ScheddRegistryRefresher")
+        self.refresher.daemon = True
+        self.refresher.start()
+
+    def _refresh(self):
+        """
+        Body of the refresher thread: refresh the handles that were used within
+        maxage seconds and would expire before the next pass.
+        """
+        while True:
+            time.sleep(self.refreshinterval)
+            now = time.time()
+            with self.lock:
+                keys = [key for key, entry in self.entries.items() \
+                        if now - entry['used'] < self.maxage and \
+                           now - entry['updated'] >= self.ttl - self.refreshinterval and \
+                           (entry['failed'] is None or now - entry['failed'] >= self.negativettl)]
+            for key in keys:
+                entry = self._update(key)
+                if entry['failed'] is not None:
+                    self.logger.warning("Failed to refresh the ad of schedd %s from collector %s: %s", key[1], key[0], str(entry['error']))
+
+## The schedd handles don't depend on who asks for them, so all the locators share them.
+SCHEDD_REGISTRY = ScheddRegistry()
+
+
 class HTCondorLocator(object):
 
     def __init__(self, config):
@@ -98,6 +239,24 @@ class HTCondorLocator(object):
         scheddObj = htcondor.Schedd(self.scheddAd)
         return scheddObj, address
 
+    def getCachedScheddObj(self, schedd):
+        """
+        Same as getScheddObjNew, but going through the process-wide SCHEDD_REGISTRY,
+        so that the collector is usually not queried.
+        """
+        scheddObj, address, self.scheddAd = SCHEDD_REGISTRY.get(self.getCollector(), schedd)
+        return scheddObj, address
+
+    def scheddFailed(self, schedd, error):
+        """
+        To be called when an operation on the schedd failed with error (either the
+        exception or the message returned by HTCondorUtils.AuthenticatedSubprocess).
+        If the error comes from the HTCondor library (RuntimeError), the schedd
+        handle is dropped from the registry, so that it is looked up again.
+        """
+        if isinstance(error, RuntimeError) or 'RuntimeError' in str(error):
+            SCHEDD_REGISTRY.invalidate(self.getCollector(), schedd)
+
     def cacheCollectorOutput(self, cacheName, output):
         """
         Saves Collector output in tmp directory.
@@ -1,5 +1,7 @@
 
 import os
+import fcntl
+import threading
 import traceback
 
 import classad
@@ -23,16 +25,30 @@ except:
 
 readEvents = getattr(htcondor, 'readEvents', htcondor.read_events)
 
+## Held by the threads that use the HTCondor library in the background (see
+## HTCondorLocator.ScheddRegistry) and while forking, so that we never fork
+## while another thread is inside the library.
+HTCondorLock = threading.Lock()
+
 class AuthenticatedSubprocess(object):
 
     def __init__(self, proxy):
         self.proxy = proxy
 
     def __enter__(self):
-        self.r, self.w = os.pipe()
-        self.rpipe = os.fdopen(self.r, 'r')
-        self.wpipe = os.fdopen(self.w, 'w')
-        self.pid = os.fork()
+        ## The pipe is created, and its write end closed in the parent, under the lock, so
+        ## that the children of the other sessions never inherit the write end: the parent
+        ## would not see the end of the output of its child until all of them exited.
+        ## FD_CLOEXEC does the same for the processes spawned meanwhile by other threads.
+        with HTCondorLock:
+            self.r, self.w = os.pipe()
+            for fd in [self.r, self.w]:
+                fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+            self.rpipe = os.fdopen(self.r, 'r')
+            self.wpipe = os.fdopen(self.w, 'w')
+            self.pid = os.fork()
+            if self.pid != 0:
+                self.wpipe.close()
         if self.pid == 0:
             htcondor.SecMan().invalidateAllSessions()
             htcondor.param['SEC_CLIENT_AUTHENTICATION_METHODS'] = 'FS,GSI'
@@ -40,8 +56,6 @@ class AuthenticatedSubprocess(object):
             htcondor.param['DELEGATE_JOB_GSI_CREDENTIALS_LIFETIME'] = '0'
             os.environ['X509_USER_PROXY'] = self.proxy
             self.rpipe.close()
-        else:
-            self.wpipe.close()
         return self.pid, self.rpipe
 
     def __exit__(self, a, b, c):
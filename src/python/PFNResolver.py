@@ -0,0 +1,152 @@
+"""
+LFN to PFN resolution shared by the TaskWorker (DAG creation) and the REST
+interface (output and log listing).
+
+Asking PhEDEx for the PFN of every single LFN is slow when there are many
+files. The trivial file catalogs of the sites map an LFN to a PFN by replacing
+the beginning of the LFN, and the rule is the same for all the LFNs that share
+the first few directories (e.g. /store/user/<username>). So, for each (node,
+protocol, LFN prefix), we derive the rule from the first LFN resolved by PhEDEx
+and apply it locally to all the other LFNs. With a cold cache PhEDEx is asked
+only for one sample LFN per prefix. The rules are kept in a process-wide LRU
+cache and expire after a while. LFNs that can not be resolved locally are sent
+to PhEDEx in chunks of PHEDEX_CHUNK_SIZE, to keep the requests short.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+## Number of leading directories of an LFN that identify the rule used to map it.
+LFN_PREFIX_DEPTH = 3
+
+## Maximum number of LFNs in one PhEDEx request.
+PHEDEX_CHUNK_SIZE = 100
+
+## Cached value meaning that the PFNs for an LFN prefix can not be derived locally.
+NO_RULE = None
+
+
+def getLFNPrefix(lfn):
+    """
+    Return the first LFN_PREFIX_DEPTH directories of the lfn,
+    e.g. /store/user/jdoe for /store/user/jdoe/dataset/file.root.
+    """
+    return '/'.join(lfn.split('/')[:LFN_PREFIX_DEPTH+1])
+
+
+def deriveRule(lfn, pfn):
+    """
+    Return the PFN prefix that, prepended to the lfn, gives the pfn,
+    or NO_RULE if the pfn is not such a simple concatenation.
+    """
+    if lfn and pfn and pfn.endswith(lfn):
+        return pfn[:len(pfn)-len(lfn)]
+    return NO_RULE
+
+
+class PFNRuleCache(object):
+    """
+    LRU cache of the LFN to PFN rules, keyed by (node, protocol, LFN prefix).
+    Entries older than ttl seconds are considered expired.
+    """
+    def __init__(self, maxentries=1000, ttl=3600):
+        self.maxentries = maxentries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Return (found, rule) for the given key.
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return False, NO_RULE
+            timestamp, rule = entry
+            if time.time() - timestamp > self.ttl:
+                return False, NO_RULE
+            self.entries[key] = entry
+            return True, rule
+
+    def put(self, key, rule):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time(), rule)
+            while len(self.entries) > self.maxentries:
+                self.entries.popitem(last=False)
+
+## The rules don't depend on who asks for them, so all the resolvers share them.
+RULE_CACHE = PFNRuleCache()
+
+
+class PFNResolver(object):
+    """
+    Resolve LFNs to PFNs at a node, applying locally the rules derived from
+    previous PhEDEx answers and asking PhEDEx for all the others.
+    """
+    def __init__(self, phedex, protocol='srmv2', cache=None, logger=None):
+        self.phedex = phedex
+        self.protocol = protocol
+        self.cache = RULE_CACHE if cache is None else cache
+        self.logger = logger if logger else logging.getLogger(__name__)
+
+    def getPFNs(self, node, lfns):
+        """
+        Return a dictionary {lfn: pfn} with the PFNs of the given lfns at the node.
+        LFNs that PhEDEx could not map are missing from the dictionary. Exceptions
+        raised by the PhEDEx service are propagated to the caller.
+        """
+        pfns = {}
+        byPrefix = {}
+        for lfn in set(lfns):
+            byPrefix.setdefault(getLFNPrefix(lfn), []).append(lfn)
+        leftovers = []
+        unknown = {}
+        for prefix, group in byPrefix.iteritems():
+            found, rule = self.cache.get((node, self.protocol, prefix))
+            if not found:
+                unknown[prefix] = group
+            elif rule is NO_RULE:
+                leftovers.extend(group)
+            else:
+                pfns.update((lfn, rule + lfn) for lfn in group)
+        ## Learn the rules of the unknown prefixes from one sample LFN each.
+        samples = dict((group[0], prefix) for prefix, group in unknown.iteritems())
+        pfn_info = self.queryPhEDEx(node, samples.keys())
+        for sample, prefix in samples.iteritems():
+            group = unknown[prefix]
+            if (node, sample) not in pfn_info:
+                leftovers.extend(group[1:])
+                continue
+            pfns[sample] = pfn_info[node, sample]
+            rule = deriveRule(sample, pfns[sample])
+            self.cache.put((node, self.protocol, prefix), rule)
+            if rule is NO_RULE:
+                leftovers.extend(group[1:])
+            else:
+                pfns.update((lfn, rule + lfn) for lfn in group[1:])
+        pfn_info = self.queryPhEDEx(node, leftovers)
+        for lfn in leftovers:
+            if (node, lfn) in pfn_info:
+                pfns[lfn] = pfn_info[node, lfn]
+        return pfns
+
+    def queryPhEDEx(self, node, lfns):
+        """
+        Ask PhEDEx for the PFNs of the lfns at the node, PHEDEX_CHUNK_SIZE LFNs at a time.
+        Return the PhEDEx answer, a dictionary {(node, lfn): pfn}.
+        """
+        pfn_info = {}
+        for start in range(0, len(lfns), PHEDEX_CHUNK_SIZE):
+            chunk = lfns[start:start+PHEDEX_CHUNK_SIZE]
+            self.logger.debug("Asking PhEDEx for the PFNs of %d LFNs at %s" % (len(chunk), node))
+            pfn_info.update(self.phedex.getPFN(nodes=[node], lfns=chunk, protocol=self.protocol))
+        return pfn_info
+
+    def getPFN(self, node, lfn):
+        """
+        Return the PFN of a single lfn at the node, or None if PhEDEx could not map it.
+        """
+        return self.getPFNs(node, [lfn]).get(lfn)
@@ -7,6 +7,7 @@ from __future__ import absolute_import
 
 import os
 import re
+import zlib
 import datetime
 import traceback
 import subprocess
@@ -227,6 +228,96 @@ def isFailurePermanent(reason, gridJob=False):
     return False, ""
 
 
+class StreamingChecksum(object):
+    """
+    Compute the adler32 and the cksum (POSIX CRC, as given by the cksum command)
+    checksums of a stream of data in one pass. The adler32 is computed here, while
+    the data is also fed to a cksum process, that runs in parallel on another core.
+    The checksums are returned in the same format as calculateChecksums in WMCore.
+    """
+    def __init__(self):
+        self.adler32 = 1
+        self.size = 0
+        ## close_fds: when several streams are checksummed by concurrent threads, the cksum
+        ## processes must not inherit the stdin pipes of each other, otherwise they would
+        ## never see the end of their input.
+        self.cksumProcess = subprocess.Popen("cksum", stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=True)
+
+    def update(self, data):
+        self.adler32 = zlib.adler32(data, self.adler32)
+        self.size += len(data)
+        self.cksumProcess.stdin.write(data)
+
+    def checksums(self):
+        """
+        Finish the stream and return the tuple (adler32, cksum).
+        """
+        cksumStdout, _ = self.cksumProcess.communicate()
+        cksumStdout = cksumStdout.split()
+        if self.cksumProcess.returncode != 0 or len(cksumStdout) != 2 or int(cksumStdout[1]) != self.size:
+            raise RuntimeError("Something went wrong with the cksum calculation!")
+        return "%08x" % (self.adler32 & 0xffffffff), cksumStdout[0]
+
+
+class ChecksummingWriter(object):
+    """
+    File-like object that writes to fileobj and computes the checksums of what is
+    written, so that a file can be checksummed while it is being created.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hasher = StreamingChecksum()
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.fileobj.write(data)
+
+    def tell(self):
+        return self.fileobj.tell()
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.fileobj.close()
+
+    def checksums(self):
+        return self.hasher.checksums()
+
+
+def calculateChecksums(filename, chunksize=8*1024*1024):
+    """
+    Return the tuple (adler32, cksum) of the given file, reading it only once.
+    """
+    hasher = StreamingChecksum()
+    with open(filename, 'rb') as fd:
+        while True:
+            chunk = fd.read(chunksize)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.checksums()
+
+
+def calculateChecksumsForFiles(filenames, nthreads=4):
+    """
+    Return a dictionary with the (adler32, cksum) tuple of each of the given files.
+    The files are checksummed in parallel by a pool of threads (the reads and the
+    cksum processes don't hold the interpreter lock).
+    """
+    from multiprocessing.pool import ThreadPool
+    filenames = list(filenames)
+    if len(filenames) <= 1 or nthreads <= 1:
+        return dict((filename, calculateChecksums(filename)) for filename in filenames)
+    pool = ThreadPool(min(nthreads, len(filenames)))
+    try:
+        results = pool.map(calculateChecksums, filenames)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(filenames, results))
+
+
 def parseJobAd(filename):
     jobAd = {}
     with open(filename) as fd:
@@ -0,0 +1,126 @@
+"""
+Cancellation of ASO transfers in bulk, shared by DagmanKiller (kill of a task)
+and by the post-job (timeout of the transfers of a job).
+
+Cancelling a transfer means setting the 'state' field of its document in the ASO
+database to 'killed'; killing the actual FTS transfers (if possible) is left to
+ASO. Instead of loading and committing the documents one by one, we load them in
+pages of up to PAGE_SIZE documents (one _all_docs request per page), change them
+locally and write each page back with one _bulk_docs request. Only the documents
+that could not be written because of a conflict (or whose page failed as a whole)
+are tried again, after a backoff.
+"""
+import time
+import datetime
+import logging
+
+## Maximum number of documents loaded and committed with one request. It must be
+## smaller than the size of the CMSCouch database queue, otherwise the queue would
+## be committed while we fill it, and we would lose the commit results.
+PAGE_SIZE = 500
+
+## Seconds to wait before the first retry; the wait is doubled at each retry.
+RETRY_BACKOFF = 10
+
+
+def addFailureReason(doc, reason):
+    """
+    Add the reason to the 'failure_reason' field of the document, which can be
+    empty, a string or a list.
+    """
+    if not reason:
+        return
+    if doc.get('failure_reason'):
+        if isinstance(doc['failure_reason'], list):
+            doc['failure_reason'].append(reason)
+        elif isinstance(doc['failure_reason'], basestring):
+            doc['failure_reason'] = [doc['failure_reason'], reason]
+    else:
+        doc['failure_reason'] = reason
+
+
+def cancelTransfers(couchDatabase, docIdsReasons, logger=None, select=None, extraFields=None, \
+                    maxRetries=3, backoff=RETRY_BACKOFF, pageSize=PAGE_SIZE):
+    """
+    Cancel the ASO transfers of the documents in docIdsReasons, a dictionary
+    {document id: reason for the cancellation (or None)}. If select is given,
+    only the documents for which select(doc) is true are cancelled; the others
+    are left untouched. The fields in the extraFields dictionary are also set in
+    each cancelled document.
+
+    Return a tuple (cancelled, notCancelled), where cancelled is the list of the
+    cancelled documents (as written to the database) and notCancelled is a list
+    of (document id, error message) tuples.
+    """
+    logger = logger if logger else logging.getLogger(__name__)
+    now = str(datetime.datetime.now())
+    cancelled, notCancelled = [], []
+    pending = list(docIdsReasons)
+    for retry in range(maxRetries + 1):
+        if not pending:
+            break
+        if retry > 0:
+            wait = backoff * 2 ** (retry - 1)
+            msg = "Will retry the cancellation of %d ASO transfers in %d seconds (retry number %d)." % (len(pending), wait, retry)
+            logger.info(msg)
+            time.sleep(wait)
+        lastTry = (retry == maxRetries)
+        failed = []
+        for start in range(0, len(pending), pageSize):
+            page = pending[start:start+pageSize]
+            try:
+                rows = couchDatabase.allDocs({'include_docs': True}, page)['rows']
+            except Exception as ex:
+                msg = "Error loading %d documents from ASO database: %s" % (len(page), str(ex))
+                logger.warning(msg)
+                failed.extend((docId, msg) for docId in page)
+                continue
+            docs = {}
+            for row in rows:
+                docId = row.get('key')
+                if row.get('doc'):
+                    docs[docId] = row['doc']
+                else:
+                    msg = "Could not cancel ASO transfer %s; document not found (%s)." % (docId, row.get('error', 'deleted'))
+                    logger.warning(msg)
+                    notCancelled.append((docId, msg))
+            written = []
+            for docId in page:
+                doc = docs.get(docId)
+                if doc is None or (select and not select(doc)):
+                    continue
+                doc['state'] = 'killed'
+                doc['end_time'] = now
+                doc['last_update'] = time.time()
+                doc.update(extraFields or {})
+                addFailureReason(doc, docIdsReasons[docId])
+                couchDatabase.queue(doc)
+                written.append(docId)
+            if not written:
+                continue
+            try:
+                results = couchDatabase.commit()
+            except Exception as ex:
+                msg = "Error committing %d documents to ASO database: %s" % (len(written), str(ex))
+                logger.warning(msg)
+                failed.extend((docId, msg) for docId in written)
+                continue
+            results = dict((result.get('id'), result) for result in results)
+            for docId in written:
+                result = results.get(docId, {'error': 'no commit result'})
+                if 'error' not in result:
+                    docs[docId]['_rev'] = result.get('rev')
+                    cancelled.append(docs[docId])
+                    continue
+                msg = "Error cancelling ASO transfer %s: %s" % (docId, result)
+                logger.warning(msg)
+                if result['error'] == 'conflict':
+                    failed.append((docId, msg))
+                else:
+                    notCancelled.append((docId, msg))
+        if lastTry:
+            notCancelled.extend(failed)
+        pending = [docId for docId, _ in failed]
+    msg = "Cancelled %d ASO transfers, failed to cancel %d." % (len(cancelled), len(notCancelled))
+    logger.info(msg)
+    return cancelled, notCancelled
@@ -4,7 +4,6 @@ import pprint
 import logging
 from httplib import HTTPException
 
-from WMCore.DataStructs.LumiList import LumiList
 from WMCore.Services.PhEDEx.PhEDEx import PhEDEx
 from WMCore.WorkQueue.WorkQueueUtils import get_dbs
 from WMCore.Services.DBS.DBSErrors import DBSReaderError
@@ -12,6 +11,35 @@ from TaskWorker.WorkerExceptions import TaskWorkerException
 
 from TaskWorker.Actions.DataDiscovery import DataDiscovery
 
+def matchSecondaryFiles(filedetails, secondarydetails):
+    """
+    Set the 'Parents' of each file in filedetails to the list of the files in
+    secondarydetails that have at least one (run, lumi) in common with it. Both
+    arguments are dictionaries {file name: file details} as returned by
+    listDatasetFileDetails, where the 'Lumis' of a file are {run: [lumis]}.
+
+    We first build an index from each (run, lumi) to the secondary files that
+    contain it, so that each file only has to look up its own lumis, instead of
+    intersecting its lumis with those of every secondary file.
+    """
+    ## The parents are kept in the order of secondarydetails.
+    order = {}
+    index = {}
+    for position, (secfilename, secinfos) in enumerate(secondarydetails.iteritems()):
+        order[secfilename] = position
+        for run, lumis in secinfos['Lumis'].iteritems():
+            run = int(run)
+            for lumi in lumis:
+                index.setdefault((run, int(lumi)), set()).add(secfilename)
+    for infos in filedetails.itervalues():
+        parents = set()
+        for run, lumis in infos['Lumis'].iteritems():
+            run = int(run)
+            for lumi in lumis:
+                parents.update(index.get((run, int(lumi)), ()))
+        infos['Parents'] = sorted(parents, key=order.get)
+
+
 class DBSDataDiscovery(DataDiscovery):
     """Performing the data discovery through CMS DBS service.
     """
@@ -124,16 +152,8 @@ class DBSDataDiscovery(DataDiscovery):
             if secondary:
                 moredetails = self.dbs.listDatasetFileDetails(secondary, getParents=False, validFileOnly=0)
 
-                for secfilename, secinfos in moredetails.items():
-                    secinfos['lumiobj'] = LumiList(runsAndLumis=secinfos['Lumis'])
-
                 self.logger.info("Beginning to match files from secondary dataset")
-                for filename, infos in filedetails.items():
-                    infos['Parents'] = []
-                    lumis = LumiList(runsAndLumis=infos['Lumis'])
-                    for secfilename, secinfos in moredetails.items():
-                        if len(lumis and secinfos['lumiobj']) > 0:
-                            infos['Parents'].append(secfilename)
+                matchSecondaryFiles(filedetails, moredetails)
                 self.logger.info("Done matching files from secondary dataset")
                 kwargs['task']['tm_use_parent'] = 1
         except Exception as ex: #TODO should we catch HttpException instead?
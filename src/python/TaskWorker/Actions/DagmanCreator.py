@@ -7,6 +7,7 @@ Generates the condor submit files and the master DAG.
 import os
 import re
 import json
+import time
 import shutil
 import string
 import tarfile
@@ -15,16 +16,14 @@ import commands
 import tempfile
 from ast import literal_eval
 from httplib import HTTPException
+from cStringIO import StringIO
 
 import TaskWorker.WorkerExceptions
 import TaskWorker.DataObjects.Result
 import TaskWorker.Actions.TaskAction as TaskAction
 from TaskWorker.WorkerExceptions import TaskWorkerException
 from ServerUtilities import insertJobIdSid
-
-import WMCore.WMSpec.WMTask
-import WMCore.Services.PhEDEx.PhEDEx as PhEDEx
-import WMCore.Services.SiteDB.SiteDB as SiteDB
+from PFNResolver import PFNResolver
 
 import classad
 
@@ -126,7 +125,7 @@ Log = job_log
 Arguments = "-a $(CRAB_Archive) --sourceURL=$(CRAB_ISB) --jobNumber=$(CRAB_Id) --cmsswVersion=$(CRAB_JobSW) --scramArch=$(CRAB_JobArch) '--inputFile=$(inputFiles)' '--runAndLumis=$(runAndLumiMask)' --lheInputFiles=$(lheInputFiles) --firstEvent=$(firstEvent) --firstLumi=$(firstLumi) --lastEvent=$(lastEvent) --firstRun=$(firstRun) --seeding=$(seeding) --scriptExe=$(scriptExe) --eventsPerLumi=$(eventsPerLumi) '--scriptArgs=$(scriptArgs)' -o $(CRAB_AdditionalOutputFiles)"
 
 transfer_input_files = CMSRunAnalysis.sh, cmscp.py%(additional_input_file)s
-transfer_output_files = jobReport.json.$(count)
+transfer_output_files = jobReport.json.$(count), cmsRunSnippet.$(count).gz
 # TODO: fold this into the config file instead of hardcoding things.
 Environment = SCRAM_ARCH=$(CRAB_JobArch);%(additional_environment_options)s
 should_transfer_files = YES
@@ -227,7 +226,8 @@ def transform_strings(input):
         else:
             info[var] = "{" + json.dumps(val)[1:-1] + "}"
 
-    info['lumimask'] = '"' + json.dumps(WMCore.WMSpec.WMTask.buildLumiMask(input['runs'], input['lumis'])).replace(r'"', r'\"') + '"'
+    from WMCore.WMSpec.WMTask import buildLumiMask
+    info['lumimask'] = '"' + json.dumps(buildLumiMask(input['runs'], input['lumis'])).replace(r'"', r'\"') + '"'
 
     splitArgName = SPLIT_ARG_MAP[input['splitalgo']]
     info['algoargs'] = '"' + json.dumps({'halt_job_on_file_boundaries': False, 'splitOnRun': False, splitArgName : input['algoargs']}).replace('"', r'\"') + '"'
@@ -249,6 +249,46 @@ def transform_strings(input):
     return info
 
 
+def addFileToTarball(tarball, name, content, mtime=None):
+    """
+    Add a regular file with the given content to an open tarball, directly from
+    memory (i.e. without creating and removing a temporary file).
+    """
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.size = len(content)
+    tarinfo.mtime = time.time() if mtime is None else mtime
+    tarinfo.mode = 0o644
+    tarball.addfile(tarinfo, StringIO(content))
+
+
+def createJobTarballs(dagSpecs):
+    """
+    Create run_and_lumis.tar.gz, with one job_lumis_<count>.json file per job, and
+    input_files.tar.gz, with one job_input_file_list_<count>.txt file per job (each
+    file containing the list of dataset files to be used by the job). The files
+    are streamed into the compressed tarballs one after the other.
+    """
+    mtime = time.time()
+    run_and_lumis_tar = tarfile.open("run_and_lumis.tar.gz", "w:gz")
+    input_files_tar = tarfile.open("input_files.tar.gz", "w:gz")
+    try:
+        for dagSpec in dagSpecs:
+            addFileToTarball(run_and_lumis_tar, 'job_lumis_%d.json' % (dagSpec['count']), str(dagSpec['runAndLumiMask']), mtime)
+            addFileToTarball(input_files_tar, 'job_input_file_list_%d.txt' % (dagSpec['count']), str(dagSpec['inputFiles']), mtime)
+    finally:
+        run_and_lumis_tar.close()
+        input_files_tar.close()
+
+
+def writeDag(fd, dagHeader, dagSpecs):
+    """
+    Write the DAG to the open file fd, one node fragment at a time, instead of
+    building the whole DAG text in memory.
+    """
+    fd.write(dagHeader)
+    fd.writelines(DAG_FRAGMENT % dagSpec for dagSpec in dagSpecs)
+
+
 def getLocation(default_name, checkout_location):
     """ Get the location of the runtime code (job wrapper, postjob, anything executed on the schedd
         and on the worker node)
@@ -282,7 +322,8 @@ class DagmanCreator(TaskAction.TaskAction):
 
     def __init__(self, *args, **kwargs):
         TaskAction.TaskAction.__init__(self, *args, **kwargs)
-        self.phedex = PhEDEx.PhEDEx() #TODO use config certs!
+        from WMCore.Services.PhEDEx.PhEDEx import PhEDEx
+        self.phedex = PhEDEx() #TODO use config certs!
 
 
     def buildDashboardInfo(self):
@@ -321,26 +362,17 @@ class DagmanCreator(TaskAction.TaskAction):
         """
         Given a directory and destination, resolve the directory to a srmv2 PFN
         """
-        lfns = [dest_dir]
-        dest_sites_ = [dest_site]
         try:
-            pfn_info = self.phedex.getPFN(nodes=dest_sites_, lfns=lfns)
+            pfn = PFNResolver(self.phedex, logger=self.logger).getPFN(dest_site, dest_dir)
         except HTTPException as ex:
             self.logger.error(ex.headers)
             raise TaskWorker.WorkerExceptions.TaskWorkerException("The CRAB3 server backend could not contact phedex to do the site+lfn=>pfn translation.\n"+\
                                 "This is could be a temporary phedex glitch, please try to submit a new task (resubmit will not work)"+\
                                 " and contact the experts if the error persists.\nError reason: %s" % str(ex))
-        results = []
-        for lfn in lfns:
-            found_lfn = False
-            if (dest_site, lfn) in pfn_info:
-                results.append(pfn_info[dest_site, lfn])
-                found_lfn = True
-                break
-            if not found_lfn:
-                raise TaskWorker.WorkerExceptions.NoAvailableSite("The CRAB3 server backend could not map LFN %s at site %s" % (lfn, dest_site)+\
-                                "This is a fatal error. Please, contact the experts")
-        return results[0]
+        if pfn is None:
+            raise TaskWorker.WorkerExceptions.NoAvailableSite("The CRAB3 server backend could not map LFN %s at site %s" % (dest_dir, dest_site)+\
+                            "This is a fatal error. Please, contact the experts")
+        return pfn
 
 
     def populateGlideinMatching(self, info):
@@ -624,8 +656,9 @@ class DagmanCreator(TaskAction.TaskAction):
                 continue
 
             if ignoreLocality:
-                sbj = SiteDB.SiteDBJSON({"key": self.config.TaskWorker.cmskey,
-                                         "cert": self.config.TaskWorker.cmscert})
+                from WMCore.Services.SiteDB.SiteDB import SiteDBJSON
+                sbj = SiteDBJSON({"key": self.config.TaskWorker.cmskey,
+                                  "cert": self.config.TaskWorker.cmscert})
                 try:
                     possiblesites = set(sbj.getAllCMSNames())
                 except Exception as ex:
@@ -709,33 +742,13 @@ class DagmanCreator(TaskAction.TaskAction):
             self.uploadWarning(msg, kwargs['task']['user_proxy'], kwargs['task']['tm_taskname'])
             self.logger.warning(msg)
 
-        ## Write down the DAG as needed by DAGMan.
-        dag = DAG_HEADER % {'resthost': kwargs['task']['resthost'], 'resturiwfdb': kwargs['task']['resturinoapi'] + '/workflowdb'}
-        for dagSpec in dagSpecs:
-            dag += DAG_FRAGMENT % dagSpec
-
-        ## Create a tarball with all the job lumi files.
-        run_and_lumis_tar = tarfile.open("run_and_lumis.tar.gz", "w:gz")
-        ## Also creating a tarball with the dataset input files.
-        ## Each .txt file in the tarball contains a list of dataset files to be used for the job.
-        input_files_tar = tarfile.open("input_files.tar.gz", "w:gz")
-        for dagSpec in dagSpecs:
-            job_lumis_file = 'job_lumis_'+ str(dagSpec['count']) +'.json'
-            job_input_file_list = 'job_input_file_list_' + str(dagSpec['count']) + '.txt'
-            with open(job_lumis_file, "w") as fd:
-                fd.write(str(dagSpec['runAndLumiMask']))
-            with open(job_input_file_list, "w") as fd:
-                fd.write(str(dagSpec['inputFiles']))
-            run_and_lumis_tar.add(job_lumis_file)
-            input_files_tar.add(job_input_file_list)
-            os.remove(job_lumis_file)
-            os.remove(job_input_file_list)
-        run_and_lumis_tar.close()
-        input_files_tar.close()
+        ## Create the tarballs with the job lumi files and the job input file lists.
+        createJobTarballs(dagSpecs)
 
-        ## Save the DAG into a file.
+        ## Write down the DAG as needed by DAGMan.
+        dagHeader = DAG_HEADER % {'resthost': kwargs['task']['resthost'], 'resturiwfdb': kwargs['task']['resturinoapi'] + '/workflowdb'}
         with open("RunJobs.dag", "w") as fd:
-            fd.write(dag)
+            writeDag(fd, dagHeader, dagSpecs)
 
         with open("site.ad", "w") as fd:
             fd.write(str(sitead))
@@ -1,9 +1,7 @@
 import re
-import time
 import socket
 import urllib
 import datetime
-import traceback
 
 import classad
 import htcondor
@@ -13,6 +11,7 @@ from httplib import HTTPException
 from ServerUtilities import FEEDBACKMAIL
 import TaskWorker.WorkerExceptions
 from TaskWorker.Actions.TaskAction import TaskAction
+from TaskWorker.Actions.ASOCancellation import cancelTransfers
 from TaskWorker.WorkerExceptions import TaskWorkerException
 from ServerUtilities import insertJobIdSid
 
@@ -58,11 +57,11 @@ class DagmanKiller(TaskAction):
         # Query HTCondor for information about running jobs and update Dashboard appropriately
         if self.task['tm_collector']:
             self.backendurls['htcondorPool'] = self.task['tm_collector']
-        loc = HTCondorLocator.HTCondorLocator(self.backendurls)
+        self.loc = HTCondorLocator.HTCondorLocator(self.backendurls)
 
         address = ""
         try:
-            self.schedd, address = loc.getScheddObjNew(self.task['tm_schedd'])
+            self.schedd, address = self.loc.getCachedScheddObj(self.task['tm_schedd'])
         except Exception as exp:
             msg  = "The CRAB server backend was not able to contact the Grid scheduler."
             msg += " Please try again later."
@@ -123,7 +122,7 @@ class DagmanKiller(TaskAction):
             msg =  "Error while connecting to asynctransfer CouchDB"
             self.logger.exception(msg)
             raise TaskWorkerException(msg)
-        self.queryKill = {'reduce':False, 'key':self.workflow, 'include_docs': True}
+        self.queryKill = {'reduce':False, 'key':self.workflow}
         try:
             filesKill = db.loadView('AsyncTransfer', 'forKill', self.queryKill)['rows']
         except Exception as ex:
@@ -132,39 +131,27 @@ class DagmanKiller(TaskAction):
             raise TaskWorkerException(msg)
         if len(filesKill) == 0:
             self.logger.warning('No files to kill found')
-        for idt in filesKill:
-            now = str(datetime.datetime.now())
-            id = idt['value']
-            data = {
-                'end_time': now,
-                'state': 'killed',
-                'last_update': time.time(),
-                'retry': now,
-               }
-            updateUri = "/%s/_design/AsyncTransfer/_update/updateJobs/%s?%s" % (db.name, id, urllib.urlencode(data))
-            jobid = idt.get('jobid')
-            jobretry = idt.get('job_retry_count')
-            if not self.task['kill_all']:
-                if idt.get("jobid") not in self.task['kill_ids']:
-                    continue
-            self.logger.info("Killing transfer %s (job ID %s; job retry %s)." % (id, str(jobid), str(jobretry)))
-            jobid = str(jobid)
-            jobretry = str(jobretry)
-            if jobid and jobretry != None:
-                jinfo = {'broker': hostname,
-                         'bossId': jobid,
-                         'StatusValue': 'killed',
-                        }
-                insertJobIdSid(jinfo, jobid, self.workflow, jobretry)
-                self.logger.info("Sending kill info to Dashboard: %s" % str(jinfo))
-                apmon.sendToML(jinfo)
-            try:
-                db.makeRequest(uri = updateUri, type = "PUT", decode = False)
-            except Exception as ex:
-                msg =  "Error updating document in couch"
-                msg += str(ex)
-                msg += str(traceback.format_exc())
-                raise TaskWorkerException(msg)
+            return True
+        def select(doc):
+            return self.task['kill_all'] or doc.get('jobid') in self.task['kill_ids']
+        docIdsReasons = dict((idt['value'], None) for idt in filesKill)
+        cancelled, notCancelled = cancelTransfers(db, docIdsReasons, self.logger, select=select, \
+                                                  extraFields={'retry': str(datetime.datetime.now())})
+        for doc in cancelled:
+            jobid = str(doc.get('jobid'))
+            jobretry = str(doc.get('job_retry_count'))
+            self.logger.info("Killed transfer %s (job ID %s; job retry %s)." % (doc['_id'], jobid, jobretry))
+            jinfo = {'broker': hostname,
+                     'bossId': jobid,
+                     'StatusValue': 'killed',
+                    }
+            insertJobIdSid(jinfo, jobid, self.workflow, jobretry)
+            self.logger.info("Sending kill info to Dashboard: %s" % str(jinfo))
+            apmon.sendToML(jinfo)
+        if notCancelled:
+            msg  = "Error updating %d documents in couch:\n" % (len(notCancelled))
+            msg += "\n".join(errmsg for _, errmsg in notCancelled)
+            raise TaskWorkerException(msg)
         return True
 
 
@@ -177,6 +164,7 @@ class DagmanKiller(TaskAction):
                 self.schedd.act(htcondor.JobAction.Remove, const)
         results = rpipe.read()
         if results != "OK":
+            self.loc.scheddFailed(self.task['tm_schedd'], results)
             msg  = "The CRAB server backend was not able to kill these jobs %s," % (ids)
             msg += " because the Grid scheduler answered with an error."
             msg += " This is probably a temporary glitch. Please try again later."
@@ -213,6 +201,7 @@ class DagmanKiller(TaskAction):
                     self.schedd.act(htcondor.JobAction.Remove, jobConst)
         results = rpipe.read()
         if results != "OK":
+            self.loc.scheddFailed(self.task['tm_schedd'], results)
             msg  = "The CRAB server backend was not able to kill the task,"
             msg += " because the Grid scheduler answered with an error."
             msg += " This is probably a temporary glitch. Please try again later."
@@ -60,7 +60,7 @@ class DagmanResubmitter(TaskAction):
         schedd = ""
         address = ""
         try:
-            schedd, address = loc.getScheddObjNew(task['tm_schedd'])
+            schedd, address = loc.getCachedScheddObj(task['tm_schedd'])
         except Exception as exp:
             msg  = "The CRAB server backend was not able to contact the Grid scheduler."
             msg += " Please try again later."
@@ -152,6 +152,7 @@ class DagmanResubmitter(TaskAction):
 
         results = rpipe.read()
         if results != "OK":
+            loc.scheddFailed(task['tm_schedd'], results)
             msg  = "The CRAB server backend was not able to resubmit the task,"
             msg += " because the Grid scheduler answered with an error."
             msg += " This is probably a temporary glitch. Please try again later."
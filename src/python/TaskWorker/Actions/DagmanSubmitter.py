@@ -198,7 +198,7 @@ class DagmanSubmitter(TaskAction.TaskAction):
         schedd = ""
         try:
             self.logger.debug("Duplicate check is getting the schedd obj. Collector is: %s", task['tm_collector'])
-            schedd, _address = loc.getScheddObjNew(task['tm_schedd'])
+            schedd, _address = loc.getCachedScheddObj(task['tm_schedd'])
             self.logger.debug("Got schedd obj for %s ", task['tm_schedd'])
         except Exception as exp:
             msg = "The CRAB server backend was not able to contact the Grid scheduler."
@@ -211,7 +211,11 @@ class DagmanSubmitter(TaskAction.TaskAction):
         rootConst = 'TaskType =?= "ROOT" && CRAB_ReqName =?= %s && (isUndefined(CRAB_Attempt) || CRAB_Attempt == 0)' % HTCondorUtils.quote(workflow)
 
         self.logger.debug("Duplicate check is querying the schedd: %s", rootConst)
-        results = list(schedd.xquery(rootConst, []))
+        try:
+            results = list(schedd.xquery(rootConst, []))
+        except RuntimeError as rte:
+            loc.scheddFailed(task['tm_schedd'], rte)
+            raise
         self.logger.debug("Schedd queried %s", results)
 
         if not results:
@@ -275,7 +279,7 @@ class DagmanSubmitter(TaskAction.TaskAction):
             schedd = ""
             try:
                 self.logger.debug("Getting schedd object")
-                schedd, address = loc.getScheddObjNew(task['tm_schedd'])
+                schedd, address = loc.getCachedScheddObj(task['tm_schedd'])
                 self.logger.debug("Got schedd object")
             except Exception as exp:
                 msg = "The CRAB server backend was not able to contact the Grid scheduler."
@@ -294,7 +298,11 @@ class DagmanSubmitter(TaskAction.TaskAction):
 
             self.logger.debug("Finally submitting to the schedd")
             if address:
-                self.submitDirect(schedd, 'dag_bootstrap_startup.sh', arg, info)
+                try:
+                    self.submitDirect(schedd, 'dag_bootstrap_startup.sh', arg, info)
+                except TaskWorkerException as twe:
+                    loc.scheddFailed(task['tm_schedd'], twe)
+                    raise
             else:
                 raise TaskWorkerException("Not able to get schedd address.")
             self.logger.debug("Submission finished")
@@ -5,6 +5,7 @@ from WMCore.DataStructs.Run import Run
 from WMCore.Services.SiteDB.SiteDB import SiteDBJSON
 
 from TaskWorker.Actions.TaskAction import TaskAction
+from TaskWorker.Actions.SiteMapping import SITE_MAPPING_CACHE
 from TaskWorker.DataObjects.Result import Result
 from TaskWorker.WorkerExceptions import TaskWorkerException
 
@@ -26,9 +27,12 @@ class DataDiscovery(TaskAction):
         discovery operations and fill up the WMCore objects.
         """
         self.logger.debug(" Formatting data discovery output ")
-        # TEMPORARY
-        pnn_psn_map = {}
-        sbj = SiteDBJSON({"key": self.config.TaskWorker.cmskey, "cert": self.config.TaskWorker.cmscert})
+        pnn_psn_map = SITE_MAPPING_CACHE.getMapping(self.config, self.logger)
+        ## Only used for the PNNs that are missing in the mapping; their translation
+        ## is added to the mapping of this process.
+        sbj = None
+        ## The CMS names of the locations of each block, computed once per block.
+        block_locations = {}
 
         wmfiles = []
         event_counter = 0
@@ -63,31 +67,35 @@ class DataDiscovery(TaskAction):
                 checksums = infos['Checksums']
             wmfile = File(lfn = lfn, events = infos['NumberOfEvents'], size = size, checksums = checksums, parents = infos['Parents'])
             wmfile['block'] = infos['BlockName']
-            wmfile['locations'] = []
-            for pnn in locations[infos['BlockName']]:
-                if pnn and pnn not in pnn_psn_map:
-                    self.logger.debug("Translating PNN %s" %pnn)
-                    try:
-                        pnn_psn_map[pnn] = sbj.PNNtoPSN(pnn)
-                    except KeyError as ke:
-                        self.logger.error("Impossible translating %s to a CMS name through SiteDB" %pnn)
-                        pnn_psn_map[pnn] = ''
-                    except httplib.HTTPException as ex:
-                        self.logger.error("Couldn't map SE to site: %s" % pnn)
-                        print("Couldn't map SE to site: %s" % pnn)
-                        print("got problem: %s" % ex)
-                        print("got another problem: %s" % ex.__dict__)
-                if pnn and pnn in pnn_psn_map:
-                    if isinstance(pnn_psn_map[pnn], list):
-                        wmfile['locations'].extend(pnn_psn_map[pnn])
-                    else:
-                        wmfile['locations'].append(pnn_psn_map[pnn])
+            if infos['BlockName'] not in block_locations:
+                psns = []
+                for pnn in locations[infos['BlockName']]:
+                    if pnn and pnn not in pnn_psn_map:
+                        self.logger.debug("Translating PNN %s" %pnn)
+                        if sbj is None:
+                            sbj = SiteDBJSON({"key": self.config.TaskWorker.cmskey, "cert": self.config.TaskWorker.cmscert})
+                        try:
+                            pnn_psn_map[pnn] = sbj.PNNtoPSN(pnn)
+                        except KeyError as ke:
+                            self.logger.error("Impossible translating %s to a CMS name through SiteDB" %pnn)
+                            pnn_psn_map[pnn] = ''
+                        except httplib.HTTPException as ex:
+                            self.logger.error("Couldn't map SE to site: %s" % pnn)
+                            print("Couldn't map SE to site: %s" % pnn)
+                            print("got problem: %s" % ex)
+                            print("got another problem: %s" % ex.__dict__)
+                    if pnn and pnn in pnn_psn_map:
+                        if isinstance(pnn_psn_map[pnn], list):
+                            psns.extend(pnn_psn_map[pnn])
+                        else:
+                            psns.append(pnn_psn_map[pnn])
+                block_locations[infos['BlockName']] = psns
+            wmfile['locations'] = list(block_locations[infos['BlockName']])
             wmfile['workflow'] = requestname
             event_counter += infos['NumberOfEvents']
             for run, lumis in infos['Lumis'].iteritems():
                 wmfile.addRun(Run(run, *lumis))
-                for lumi in lumis:
-                    uniquelumis.add((run, lumi))
+                uniquelumis.update((run, lumi) for lumi in lumis)
                 lumi_counter += len(lumis)
             wmfiles.append(wmfile)
             file_counter += 1
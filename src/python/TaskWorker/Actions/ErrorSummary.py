@@ -0,0 +1,246 @@
+"""
+The error summary of a task (error_summary.json in the spool directory), with
+the exit code and error of each job retry, as read from the job reports.
+
+Each post-job appends the entry of its job to a journal, which is folded into
+the error summary by compactErrorSummary(): from time to time by the post-jobs,
+by the last post-job running, and by the final step of the DAG. This module
+only needs the standard library, so that the final step can use it without
+importing the post-job.
+"""
+import os
+import glob
+import time
+import json
+import uuid
+import fcntl
+import errno
+
+G_ERROR_SUMMARY_FILE_NAME = "error_summary.json"
+G_ERROR_SUMMARY_JOURNAL_NAME = "error_summary.journal"
+G_ERROR_SUMMARY_WRITERS_LOCK_NAME = "error_summary.writers.lock"
+## Minimum time (in seconds) between two rewrites of the error summary, unless
+## the post-job is the last one running.
+ERROR_SUMMARY_COMPACT_INTERVAL = 60
+## Job reports without an entry in the journal (e.g. the post-job was killed before
+## writing it) are added to the error summary when they are older than this.
+ERROR_SUMMARY_ORPHAN_FJR_AGE = 3600
+
+
+def prepareErrorSummaryEntry(logger, job_id, crab_retry):
+    """ Read the job report of the given job id and crab retry and return the entry
+        (exit code, exit message, error) that should go to the error summary for it,
+        or None if there is nothing to report (e.g. the job report does not exist).
+    """
+    fjr_file_name = "job_fjr.%s.%s.json" % (job_id, crab_retry)
+    try:
+        frep = open(fjr_file_name)
+    except IOError:
+        logger.info("Job report file %s does not exist. Nothing to add to the error summary." % (fjr_file_name))
+        return None
+    logger.info("Processing job report file %s" % (fjr_file_name))
+    with frep:
+        try:
+            rep = None
+            exit_code = -1
+            rep = json.load(frep)
+            if not 'exitCode' in rep:
+                raise Exception("'exitCode' key not found in the report")
+            exit_code = rep['exitCode']
+            if not 'exitMsg'  in rep:
+                raise Exception("'exitMsg' key not found in the report")
+            exit_msg = rep['exitMsg']
+            if not 'steps'    in rep:
+                raise Exception("'steps' key not found in the report")
+            if not 'cmsRun'   in rep['steps']:
+                raise Exception("'cmsRun' key not found in report['steps']")
+            if not 'errors'   in rep['steps']['cmsRun']:
+                raise Exception("'errors' key not found in report['steps']['cmsRun']")
+            if rep['steps']['cmsRun']['errors']:
+                ## If there are errors in the job report, they come from the job execution. This
+                ## is the error we want to report to the user, so write it to the error summary.
+                if len(rep['steps']['cmsRun']['errors']) != 1:
+                    #this should never happen because the report has just one step, but just in case print a message
+                    logger.info("More than one error found in report['steps']['cmsRun']['errors']. Just considering the first one.")
+                msg  = "Updating error summary for jobid %s retry %s with following information:" % (job_id, crab_retry)
+                msg += "\n'exit code' = %s" % (exit_code)
+                msg += "\n'exit message' = %s" % (exit_msg)
+                msg += "\n'error message' = %s" % (rep['steps']['cmsRun']['errors'][0])
+                logger.info(msg)
+                return (exit_code, exit_msg, rep['steps']['cmsRun']['errors'][0])
+            if exit_code != 0:
+                ## If there are no errors in the job report, but there is an exit code and exit
+                ## message from the job (not post-job), we want to report them to the user. Even
+                ## a post-job exit code != 0 can be added later to the job report, the job exit
+                ## code takes precedence.
+                msg  = "Updating error summary for jobid %s retry %s with following information:" % (job_id, crab_retry)
+                msg += "\n'exit code' = %s" % (exit_code)
+                msg += "\n'exit message' = %s" % (exit_msg)
+                logger.info(msg)
+                return (exit_code, exit_msg, {})
+            ## In case the job exit code is 0, we still have to check if there is an exit
+            ## code from post-job. If there is a post-job exit code != 0, write it to the
+            ## error summary; otherwise write the exit code 0 and exit message from the job
+            ## (the message should be "OK").
+            postjob_exit_code = rep.get('postjob', {}).get('exitCode', -1)
+            postjob_exit_msg  = rep.get('postjob', {}).get('exitMsg', "No post-job error message available.")
+            if postjob_exit_code != 0:
+                ## Use exit code 90000 as a general exit code for failures in the post-processing step.
+                ## The 'crab status' error summary should not show this error code,
+                ## but replace it with the generic message "failed in post-processing".
+                msg  = "Updating error summary for jobid %s retry %s with following information:" % (job_id, crab_retry)
+                msg += "\n'exit code' = 90000 ('Post-processing failed')"
+                msg += "\n'exit message' = %s" % (postjob_exit_msg)
+                logger.info(msg)
+                return (90000, postjob_exit_msg, {})
+            msg  = "Updating error summary for jobid %s retry %s with following information:" % (job_id, crab_retry)
+            msg += "\n'exit code' = %s" % (exit_code)
+            msg += "\n'exit message' = %s" % (exit_msg)
+            logger.info(msg)
+            return (exit_code, exit_msg, {})
+        except Exception as ex:
+            logger.info(str(ex))
+            ## Write to the error summary that the job report is not valid or has no error
+            ## message.
+            if not rep:
+                exit_msg = 'Invalid framework job report. The framework job report exists, but it cannot be loaded.'
+            else:
+                exit_msg = rep['exitMsg'] if 'exitMsg' in rep else 'The framework job report could be loaded, but no error message was found there.'
+            msg  = "Updating error summary for jobid %s retry %s with following information:" % (job_id, crab_retry)
+            msg += "\n'exit code' = %s" % (exit_code)
+            msg += "\n'exit message' = %s" % (exit_msg)
+            logger.info(msg)
+            return (exit_code, exit_msg, {})
+
+
+def prepareErrorSummary(logger, job_id, crab_retry):
+    """ Append the error summary entry of this job to the error summary journal.
+        Each post-job only reads its own job report (instead of all the job reports
+        in the spool directory). The journal is folded into error_summary.json by
+        compactErrorSummary() here if the last compaction is older than
+        ERROR_SUMMARY_COMPACT_INTERVAL seconds; otherwise by the last post-job
+        running (see releaseErrorSummaryWriter()), by a later post-job or by the
+        final step of the DAG.
+    """
+    ## The job_id and crab_retry variables in PostJob are integers, while in the
+    ## error summary they are used as strings.
+    job_id = str(job_id)
+    crab_retry = str(crab_retry)
+
+    entry = prepareErrorSummaryEntry(logger, job_id, crab_retry)
+    if entry is None:
+        return
+    with open(G_ERROR_SUMMARY_JOURNAL_NAME, "a") as fjournal:
+        fcntl.flock(fjournal.fileno(), fcntl.LOCK_EX)
+        fjournal.write(json.dumps([job_id, crab_retry, entry]) + "\n")
+        fjournal.flush()
+    try:
+        age = time.time() - os.stat(G_ERROR_SUMMARY_FILE_NAME).st_mtime
+    except OSError:
+        age = ERROR_SUMMARY_COMPACT_INTERVAL
+    if age >= ERROR_SUMMARY_COMPACT_INTERVAL:
+        compactErrorSummary(logger)
+
+
+def addOrphanJobReports(logger, error_summary, journal_keys):
+    """ Add to the error summary the job reports older than ERROR_SUMMARY_ORPHAN_FJR_AGE
+        that have no entry in the error summary nor in the journal, as the post-jobs did
+        before writing the journal. Return True if the error summary was changed.
+    """
+    changed = False
+    now = time.time()
+    for fjr_file_name in glob.glob("job_fjr.*.*.json"):
+        fjr_file_name_split = fjr_file_name.split('.')
+        job_id, crab_retry = fjr_file_name_split[-3], fjr_file_name_split[-2]
+        if crab_retry in error_summary.get(job_id, {}) or (job_id, crab_retry) in journal_keys:
+            continue
+        try:
+            if now - os.stat(fjr_file_name).st_mtime < ERROR_SUMMARY_ORPHAN_FJR_AGE:
+                ## Its post-job may still be running.
+                continue
+        except OSError:
+            continue
+        entry = prepareErrorSummaryEntry(logger, job_id, crab_retry)
+        if entry is not None:
+            error_summary.setdefault(job_id, {})[crab_retry] = entry
+            changed = True
+    return changed
+
+
+def compactErrorSummary(logger):
+    """ Fold the entries in the error summary journal, and the job reports left without
+        an entry (see addOrphanJobReports()), into error_summary.json.
+        Whatever is already in the error summary is not changed (if there is more than
+        one entry for the same job id and crab retry, the first one wins). The journal
+        lock is held during the whole operation, so that no entry can be appended
+        between reading and truncating the journal.
+    """
+    with open(G_ERROR_SUMMARY_JOURNAL_NAME, "a+") as fjournal:
+        fcntl.flock(fjournal.fileno(), fcntl.LOCK_EX)
+        fjournal.seek(0)
+        lines = fjournal.readlines()
+        error_summary = {}
+        try:
+            with open(G_ERROR_SUMMARY_FILE_NAME) as fsummary:
+                error_summary = json.load(fsummary)
+        except (IOError, ValueError):
+            ## There is nothing to do if the error_summary file doesn't exist or is invalid.
+            ## Just recreate it.
+            logger.info("File %s is empty, wrong or does not exist. Will create a new file." % (G_ERROR_SUMMARY_FILE_NAME))
+        error_summary_changed = False
+        journal_keys = set()
+        for line in lines:
+            try:
+                job_id, crab_retry, entry = json.loads(line)
+            except ValueError:
+                ## A truncated line left by a post-job killed while writing.
+                logger.info("Skipping invalid line in %s: %s" % (G_ERROR_SUMMARY_JOURNAL_NAME, line.strip()))
+                continue
+            journal_keys.add((job_id, crab_retry))
+            if crab_retry in error_summary.get(job_id, {}):
+                continue
+            error_summary.setdefault(job_id, {})[crab_retry] = entry
+            error_summary_changed = True
+        if addOrphanJobReports(logger, error_summary, journal_keys):
+            error_summary_changed = True
+        ## If we have updated the error summary, write it to the json file.
+        ## Use a temporary file and rename, so that readers never see a partial file.
+        if error_summary_changed:
+            tmp_name = "%s.%s" % (G_ERROR_SUMMARY_FILE_NAME, uuid.uuid4())
+            with open(tmp_name, "w") as fd:
+                json.dump(error_summary, fd)
+            os.rename(tmp_name, G_ERROR_SUMMARY_FILE_NAME)
+        elif os.path.exists(G_ERROR_SUMMARY_FILE_NAME):
+            ## Still mark the time of this compaction.
+            os.utime(G_ERROR_SUMMARY_FILE_NAME, None)
+        ## A crash before this point only leaves entries to be folded (again) next time.
+        fjournal.truncate(0)
+    logger.info("Folded %d error summary journal entries into %s." % (len(lines), G_ERROR_SUMMARY_FILE_NAME))
+
+
+def acquireErrorSummaryWriter():
+    """ Register this post-job as a (possible) writer of the error summary journal by
+        taking a shared lock, held until releaseErrorSummaryWriter() or the end of the
+        process. Return the lock file.
+    """
+    flock = open(G_ERROR_SUMMARY_WRITERS_LOCK_NAME, "a")
+    fcntl.flock(flock.fileno(), fcntl.LOCK_SH)
+    return flock
+
+
+def releaseErrorSummaryWriter(logger, flock):
+    """ Release the shared lock of acquireErrorSummaryWriter() and, if no other post-job
+        holds it (i.e. this is the last post-job running), fold what is left in the
+        journal. A post-job still running will do the same when it finishes, so the
+        entries of the last post-jobs of a task are not left in the journal.
+    """
+    flock.close()
+    with open(G_ERROR_SUMMARY_WRITERS_LOCK_NAME, "a") as flock:
+        try:
+            fcntl.flock(flock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as ex:
+            if ex.errno in [errno.EAGAIN, errno.EACCES]:
+                return
+            raise
+        if os.path.exists(G_ERROR_SUMMARY_JOURNAL_NAME) and os.path.getsize(G_ERROR_SUMMARY_JOURNAL_NAME):
+            compactErrorSummary(logger)
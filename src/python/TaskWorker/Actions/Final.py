@@ -1,9 +1,12 @@
 
 
 import os
+import sys
 import urllib
+import logging
 
 from RESTInteractions import HTTPRequests
+from TaskWorker.Actions.ErrorSummary import compactErrorSummary
 
 # From the HTCondor documentation, dag_status has the following meaning
 #0: OK
@@ -26,6 +29,17 @@ class Final:
     """
 
     def execute(self, *args):
+        logger = logging.getLogger("Final")
+        if not logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter("%(asctime)s:%(levelname)s:%(module)s %(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+        ## Fold what the last post-jobs may have left in the error summary journal.
+        try:
+            compactErrorSummary(logger)
+        except Exception:
+            logger.exception("Failed to fold the error summary journal.")
         dag_status = int(args[0])
         failed_count = int(args[1])
         restinstance = args[2]
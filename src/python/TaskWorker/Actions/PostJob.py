@@ -60,8 +60,6 @@ import sys
 import time
 import json
 import uuid
-import glob
-import fcntl
 import errno
 import pprint
 import shutil
@@ -78,19 +76,22 @@ import logging.handlers
 from httplib import HTTPException
 
 import DashboardAPI
-import WMCore.Database.CMSCouch as CMSCouch
 
 from TaskWorker import __version__
 from RESTInteractions import HTTPRequests ## Why not to use from WMCore.Services.Requests import Requests
 from TaskWorker.Actions.RetryJob import RetryJob
 from TaskWorker.Actions.RetryJob import JOB_RETURN_CODES
+from TaskWorker.Actions.TaskStatistics import TaskStatistics
+from TaskWorker.Actions.ASOCancellation import cancelTransfers
 from ServerUtilities import isFailurePermanent, parseJobAd
+from TaskWorker.Actions.ErrorSummary import prepareErrorSummary, acquireErrorSummaryWriter, releaseErrorSummaryWriter
 
 ASO_JOB = None
+## Imported by ASOServerJob, which is the only user of the ASO database.
+CMSCouch = None
 config = None
 G_JOB_REPORT_NAME = None
 G_JOB_REPORT_NAME_NEW = None
-G_ERROR_SUMMARY_FILE_NAME = "error_summary.json"
 
 def sighandler(*args):
     if ASO_JOB:
@@ -109,133 +110,6 @@ def first_pj_execution():
 
 ##==============================================================================
 
-def prepareErrorSummary(logger, fsummary, job_id, crab_retry):
-    """ Load the current error_summary.json and do the equivalent of an 'ls job_fjr.*.json' to get the completed jobs.
-        Then, add the error reason of the job that are not in errorReport.json
-    """
-
-    ## The job_id and crab_retry variables in PostJob are integers, while here we
-    ## mostly use them as strings.
-    job_id = str(job_id)
-    crab_retry = str(crab_retry)
-
-    error_summary = {}
-    error_summary_changed = False
-
-    ## Open and load an already existing error summary.
-    try:
-        fsummary.seek(0)
-        error_summary = json.load(fsummary)
-    except (IOError, ValueError):
-        ## There is nothing to do if the error_summary file doesn't exist or is invalid.
-        ## Just recreate it.
-        logger.info("File %s is empty, wrong or does not exist. Will create a new file." % (G_ERROR_SUMMARY_FILE_NAME))
-
-    ## Iterate over all the job reports in the spool directory.
-    for fjr_file_name in glob.glob("job_fjr.*.*.json"):
-        fjr_file_name_split = fjr_file_name.split('.')
-        fjr_job_id, fjr_crab_retry = fjr_file_name_split[-3], fjr_file_name_split[-2]
-        ## If this job report has already been written to the error summary, we skip it,
-        ## because we assume whatever is in the error summary should not be changed.
-        if fjr_job_id in error_summary and fjr_crab_retry in error_summary[fjr_job_id]:
-            continue
-        logger.info("Processing job report file %s" % (fjr_file_name))
-        with open(fjr_file_name) as frep:
-            try:
-                rep = None
-                exit_code = -1
-                rep = json.load(frep)
-                if not 'exitCode' in rep:
-                    raise Exception("'exitCode' key not found in the report")
-                exit_code = rep['exitCode']
-                if not 'exitMsg'  in rep:
-                    raise Exception("'exitMsg' key not found in the report")
-                exit_msg = rep['exitMsg']
-                if not 'steps'    in rep:
-                    raise Exception("'steps' key not found in the report")
-                if not 'cmsRun'   in rep['steps']:
-                    raise Exception("'cmsRun' key not found in report['steps']")
-                if not 'errors'   in rep['steps']['cmsRun']:
-                    raise Exception("'errors' key not found in report['steps']['cmsRun']")
-                if rep['steps']['cmsRun']['errors']:
-                    ## If there are errors in the job report, they come from the job execution. This
-                    ## is the error we want to report to the user, so write it to the error summary.
-                    if len(rep['steps']['cmsRun']['errors']) != 1:
-                        #this should never happen because the report has just one step, but just in case print a message
-                        logger.info("More than one error found in report['steps']['cmsRun']['errors']. Just considering the first one.")
-                    msg  = "Updating error summary for jobid %s retry %s with following information:" % (fjr_job_id, fjr_crab_retry)
-                    msg += "\n'exit code' = %s" % (exit_code)
-                    msg += "\n'exit message' = %s" % (exit_msg)
-                    msg += "\n'error message' = %s" % (rep['steps']['cmsRun']['errors'][0])
-                    logger.info(msg)
-                    error_summary.setdefault(fjr_job_id, {})[fjr_crab_retry] = (exit_code, exit_msg, rep['steps']['cmsRun']['errors'][0])
-                    error_summary_changed = True
-                else:
-                    ## If there are no errors in the job report, but there is an exit code and exit
-                    ## message from the job (not post-job), we want to report them to the user only
-                    ## in case we know this is the terminal exit code and exit message. And this is
-                    ## the case if the exit code is not 0. Even a post-job exit code != 0 can be
-                    ## added later to the job report, the job exit code takes precedence, so we can
-                    ## already write it to the error summary.
-                    if exit_code != 0:
-                        msg  = "Updating error summary for jobid %s retry %s with following information:" % (fjr_job_id, fjr_crab_retry)
-                        msg += "\n'exit code' = %s" % (exit_code)
-                        msg += "\n'exit message' = %s" % (exit_msg)
-                        logger.info(msg)
-                        error_summary.setdefault(fjr_job_id, {})[fjr_crab_retry] = (exit_code, exit_msg, {})
-                        error_summary_changed = True
-                    else:
-                        ## In case the job exit code is 0, write to the error summary only if the job
-                        ## report file we are looking at is the one corresponding to the current job id
-                        ## and crab retry, since otherwise the job report can still get updated by its
-                        ## corresponding post-job.
-                        if fjr_job_id == job_id and fjr_crab_retry == crab_retry:
-                            ## In case the job exit code is 0, we still have to check if there is an exit
-                            ## code from post-job. If there is a post-job exit code != 0, write it to the
-                            ## error summary; otherwise write the exit code 0 and exit message from the job
-                            ## (the message should be "OK").
-                            postjob_exit_code = rep.get('postjob', {}).get('exitCode', -1)
-                            postjob_exit_msg  = rep.get('postjob', {}).get('exitMsg', "No post-job error message available.")
-                            if postjob_exit_code != 0:
-                                ## Use exit code 90000 as a general exit code for failures in the post-processing step.
-                                ## The 'crab status' error summary should not show this error code,
-                                ## but replace it with the generic message "failed in post-processing".
-                                msg  = "Updating error summary for jobid %s retry %s with following information:" % (fjr_job_id, fjr_crab_retry)
-                                msg += "\n'exit code' = 90000 ('Post-processing failed')"
-                                msg += "\n'exit message' = %s" % (postjob_exit_msg)
-                                logger.info(msg)
-                                error_summary.setdefault(fjr_job_id, {})[fjr_crab_retry] = (90000, postjob_exit_msg, {})
-                            else:
-                                msg  = "Updating error summary for jobid %s retry %s with following information:" % (fjr_job_id, fjr_crab_retry)
-                                msg += "\n'exit code' = %s" % (exit_code)
-                                msg += "\n'exit message' = %s" % (exit_msg)
-                                logger.info(msg)
-                                error_summary.setdefault(fjr_job_id, {})[fjr_crab_retry] = (exit_code, exit_msg, {})
-                            error_summary_changed = True
-            except Exception as ex:
-                logger.info(str(ex))
-                ## Write to the error summary that the job report is not valid or has no error
-                ## message, but only if the job report file we are looking at is the one
-                ## corresponding to the current job id and crab retry, since the job report can
-                ## still get updated by its corresponding post-job.
-                if fjr_job_id == job_id and fjr_crab_retry == crab_retry:
-                    if not rep:
-                        exit_msg = 'Invalid framework job report. The framework job report exists, but it cannot be loaded.'
-                    else:
-                        exit_msg = rep['exitMsg'] if 'exitMsg' in rep else 'The framework job report could be loaded, but no error message was found there.'
-                    msg  = "Updating error summary for jobid %s retry %s with following information:" % (fjr_job_id, fjr_crab_retry)
-                    msg += "\n'exit code' = %s" % (exit_code)
-                    msg += "\n'exit message' = %s" % (exit_msg)
-                    logger.info(msg)
-                    error_summary.setdefault(fjr_job_id, {})[fjr_crab_retry] = (exit_code, exit_msg, {})
-                    error_summary_changed = True
-
-    ## If we have updated the error summary, write it to the json file.
-    ## Use a temporary file and rename to avoid concurrent writing of the file.
-    if error_summary_changed:
-        fsummary.truncate(0)
-        json.dump(error_summary, fsummary)
-
 ##==============================================================================
 
 class ASOServerJob(object):
@@ -274,6 +148,8 @@ class ASOServerJob(object):
         self.aso_start_timestamp = aso_start_timestamp
         proxy = os.environ.get('X509_USER_PROXY', None)
         self.aso_db_url = self.job_ad['CRAB_ASOURL']
+        global CMSCouch
+        import WMCore.Database.CMSCouch as CMSCouch
         try:
             if first_pj_execution():
                 self.logger.info("Will use ASO server at %s." % (self.aso_db_url))
@@ -404,7 +280,7 @@ class ASOServerJob(object):
                 app, severity = None, None
                 self.failures[doc_id] = {'reasons': reason, 'app': app, 'severity': severity}
             if not_cancelled:
-                msg = "Failed to cancel %d ASO transfers: %s" % (len(not_cancelled), ", ".join(not_cancelled))
+                msg = "Failed to cancel %d ASO transfers: %s" % (len(not_cancelled), ", ".join(doc_id for doc_id, _ in not_cancelled))
                 self.logger.error(msg)
                 self.logger.info("====== Finished to cancel ongoing ASO transfers.")
                 self.logger.info("====== Finished to monitor ASO transfers.")
@@ -817,9 +693,11 @@ class ASOServerJob(object):
         Method used to "cancel/kill" ASO transfers. The only thing that this
         function does is to put the 'state' field of the corresponding documents in
         the ASO database to 'killed' (and the 'end_time' field to the current time).
-        Killing actual FTS transfers (if possible) is left to ASO.
+        Killing actual FTS transfers (if possible) is left to ASO. The documents are
+        loaded and committed in bulk; only those that failed are retried.
         """
         if doc_ids_reasons is None:
+            doc_ids_reasons = {}
             for doc_info in self.docs_in_transfer:
                 doc_id = doc_info['doc_id']
                 doc_ids_reasons[doc_id] = None
@@ -827,50 +705,18 @@ class ASOServerJob(object):
             msg = "There are no ASO transfers to cancel."
             self.logger.info(msg)
             return [], []
-        now = str(datetime.datetime.now())
-        cancelled, not_cancelled = [], []
         max_retries = max(int(max_retries), 0)
         if max_retries:
             msg = "In case of cancellation failure, will retry up to %d times." % (max_retries)
             self.logger.info(msg)
-        for retry in range(max_retries + 1):
-            if retry > 0:
-                time.sleep(3*60)
-                msg = "This is cancellation retry number %d." % (retry)
-                self.logger.info(msg)
-            for doc_id, reason in doc_ids_reasons.iteritems():
-                if doc_id in cancelled:
-                    continue
-                msg = "Cancelling ASO transfer %s" % (doc_id)
-                if reason:
-                    msg += " with following reason: %s" % (reason)
-                self.logger.info(msg)
-                doc = self.load_couch_document(doc_id)
-                if not doc:
-                    msg = "Could not cancel ASO transfer %s; failed to load document." % (doc_id)
-                    self.logger.warning(msg)
-                    if retry == max_retries:
-                        not_cancelled.append((doc_id, msg))
-                    continue
-                doc['state'] = 'killed'
-                doc['end_time'] = now
-                if reason:
-                    if doc['failure_reason']:
-                        if isinstance(doc['failure_reason'], list):
-                            doc['failure_reason'].append(reason)
-                        elif isinstance(doc['failure_reason'], str):
-                            doc['failure_reason'] = [doc['failure_reason'], reason]
-                    else:
-                        doc['failure_reason'] = reason
-                res = self.couch_database.commitOne(doc)
-                if 'error' in res:
-                    msg = "Error cancelling ASO transfer %s: %s" % (doc_id, res)
-                    self.logger.warning(msg)
-                    if retry == max_retries:
-                        not_cancelled.append((doc_id, msg))
-                else:
-                    cancelled.append(doc_id)
-        return cancelled, not_cancelled
+        for doc_id, reason in doc_ids_reasons.iteritems():
+            msg = "Cancelling ASO transfer %s" % (doc_id)
+            if reason:
+                msg += " with following reason: %s" % (reason)
+            self.logger.info(msg)
+        cancelled, not_cancelled = cancelTransfers(self.couch_database, doc_ids_reasons, self.logger, \
+                                                   maxRetries = max_retries, backoff = 60)
+        return [doc['_id'] for doc in cancelled], not_cancelled
 
     ##= = = = = ASOServerJob = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -1081,6 +927,20 @@ class PostJob():
             fd_stdout.truncate(0)
             fd_stdout.close()
             os.chmod(fname, 0o644)
+        ## Move the gzipped head and tail of the CMSSW stdout cmsRunSnippet.<job_id>.gz
+        ## to the schedd web directory, naming it cmsRun_snippet.<job_id>.<crab_retry>.txt.gz.
+        ## The file is empty if the job did not get to run CMSSW.
+        snippet = "cmsRunSnippet.%d.gz" % (self.job_id)
+        if os.path.exists(snippet):
+            if os.stat(snippet).st_size > 0:
+                fname = "cmsRun_snippet.%d.%d.txt.gz" % (self.job_id, self.crab_retry)
+                fname = os.path.join(self.logpath, fname)
+                msg = "Moving CMSSW output snippet from %s to %s." % (snippet, fname)
+                self.logger.debug(msg)
+                shutil.move(snippet, fname)
+                os.chmod(fname, 0o644)
+            else:
+                os.unlink(snippet)
         ## Copy the json job report file jobReport.json.<job_id> to
         ## job_fjr.<job_id>.<crab_retry>.json and create a symbolic link in the task web
         ## directory to the new job report file.
@@ -1213,6 +1073,7 @@ class PostJob():
         ## Call execute_internal().
         retval = JOB_RETURN_CODES.RECOVERABLE_ERROR
         retmsg = "Failure during post-job execution."
+        error_summary_writer = acquireErrorSummaryWriter()
         try:
             retval, retmsg = self.execute_internal()
             if retval == 4:
@@ -1223,6 +1084,10 @@ class PostJob():
             self.logger.exception(retmsg)
         finally:
             DashboardAPI.apmonFree()
+            try:
+                releaseErrorSummaryWriter(self.logger, error_summary_writer)
+            except:
+                self.logger.exception("Unknown error while folding the error summary journal.")
 
         ## Add the post-job exit code and error message to the job report.
         job_report = {}
@@ -1239,11 +1104,7 @@ class PostJob():
         ## fail jobs because this fails.
         self.logger.info("====== Starting to prepare error report.")
         try:
-            with open(G_ERROR_SUMMARY_FILE_NAME, "a+") as fsummary:
-                self.logger.debug("Acquiring lock on error summary file.")
-                fcntl.flock(fsummary.fileno(), fcntl.LOCK_EX)
-                self.logger.debug("Acquired lock on error summary file.")
-                prepareErrorSummary(self.logger, fsummary, self.job_id, self.crab_retry)
+            prepareErrorSummary(self.logger, self.job_id, self.crab_retry)
         except:
             msg = "Unknown error while preparing the error report."
             self.logger.exception(msg)
@@ -1737,40 +1598,55 @@ class PostJob():
                      'outdatasetname'  : '/FakeDataset/fakefile-FakePublish-5b6a581e4ddd41b130711a045d5fecb9/USER',
                      'directstageout'  : int(self.job_report.get('direct_stageout', 0))
                     }
+        self.upload_files_metadata([configreq], "logs archive file")
+
+    ## = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+    def upload_files_metadata(self, records, description):
+        """
+        Upload the metadata of a list of files with one single PUT to the filemetadata
+        REST API. Each record is the dictionary of parameters that the REST API accepts
+        for one file (with lists for 'outfileruns', 'outfilelumis' and 'inparentlfns').
+        All the records are inserted (or updated) by the server in one transaction.
+        """
+        if not records:
+            return
         rest_api = 'filemetadata'
         rest_uri = self.rest_uri_no_api + '/' + rest_api
         rest_url = self.rest_host + rest_uri
-        msg = "Uploading file metadata for %s to https://%s: %s"
-        msg = msg % (self.logs_arch_file_name, rest_url, configreq)
+        msg = "Uploading file metadata for %d %s to https://%s: %s" % (len(records), description, rest_url, records)
         self.logger.debug(msg)
+        configreq = {'filemetadatalist': json.dumps(records)}
         try:
             self.server.put(rest_uri, data = urllib.urlencode(configreq))
         except HTTPException as hte:
-            msg = "Error uploading logs file metadata: %s" % (str(hte.headers))
+            msg = "Error uploading %s metadata: %s" % (description, str(hte.headers))
             self.logger.error(msg)
-            if not hte.headers.get('X-Error-Detail', '') == 'Object already exists' or \
-               not hte.headers.get('X-Error-Http', -1) == '400':
-                raise
+            ## If all the files made it to the database anyway we can proceed.
+            for record in records:
+                if not self.file_exists(record['outlfn']):
+                    raise
+            msg = "Ignoring the error since all the files are already in the database"
+            self.logger.debug(msg)
 
     ## = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
-    def file_exists(self, lfn, type):
+    def file_exists(self, lfn):
         """ Because of a bug in Oracle we need to do this if we get an exception while executing the filemetadata insert. See:
             https://cern.service-now.com/nav_to.do?uri=incident.do?sys_id=92982f051d497500c7138e7019d56af9%26sysparm_view=RPT72d916c9f0d3d94079046a0c9f0e01d6
-            With the February deployment we should change the merge to an insert/update
+            Only the given lfn is looked up (by primary key), so the cost does not depend on the number of files in the task.
         """
 
         try:
             configreq = {"taskname" : self.job_ad['CRAB_ReqName'],
-                         "filetype" : type
+                         "lfn"      : lfn
             }
             res, _, _ = self.server.get(self.rest_uri_no_api + '/filemetadata', data = configreq)
-            lfns = [x['lfn'] for x in res[u'result']]
         except HTTPException as hte:
-            msg = "Error getting list of file metadata: %s" % (str(hte.headers))
+            msg = "Error getting file metadata for %s: %s" % (lfn, str(hte.headers))
             self.logger.error(msg)
             return False
-        return (lfn in lfns)
+        return bool(res[u'result'])
 
     ## = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -1788,6 +1664,7 @@ class PostJob():
             self.logger.info("Skipping input filemetadata upload as no inputs were found")
             return
         direct_stageout = int(self.job_report.get(u'direct_stageout', 0))
+        records = []
         for ifile in self.job_report['steps']['cmsRun']['input']['source']:
             if ifile['input_source_class'] != 'PoolSource' or not ifile['lfn']:
                 #TODO: should we also check that "input_type" = "primaryFiles"?
@@ -1815,29 +1692,15 @@ class PostJob():
                          "outdatasetname"  : "/FakeDataset/fakefile-FakePublish-5b6a581e4ddd41b130711a045d5fecb9/USER",
                          "directstageout"  : direct_stageout
                         }
-            configreq = configreq.items()
             outfileruns = []
             outfilelumis = []
             for run, lumis in ifile[u'runs'].iteritems():
                 outfileruns.append(str(run))
                 outfilelumis.append(','.join(map(str, lumis)))
-            for run in outfileruns:
-                configreq.append(("outfileruns", run))
-            for lumis in outfilelumis:
-                configreq.append(("outfilelumis", lumis))
-            msg = "Uploading file metadata for input file %s" % ifile['lfn']
-            self.logger.debug(msg)
-            try:
-                self.server.put(self.rest_uri_no_api + '/filemetadata', data = urllib.urlencode(configreq))
-            except HTTPException as hte:
-                msg = "Error uploading input file metadata: %s" % (str(hte.headers))
-                self.logger.error(msg)
-                if not self.file_exists(lfn, 'POOLIN'):
-                    raise
-                else:
-                    msg = "Ignoring the error since the file %s is already in the database" % lfn
-                    self.logger.debug(msg)
-
+            configreq['outfileruns'] = outfileruns
+            configreq['outfilelumis'] = outfilelumis
+            records.append(configreq)
+        self.upload_files_metadata(records, "input files")
 
     ## = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -1853,6 +1716,7 @@ class PostJob():
                 edm_file_count += 1
         multiple_edm = edm_file_count > 1
         output_datasets = set()
+        records = []
         for file_info in self.output_files_info:
             publishname = self.publish_name
             if 'pset_hash' in file_info:
@@ -1891,37 +1755,16 @@ class PostJob():
                          'directstageout'  : int(file_info['direct_stageout']),
                          'globalTag'       : 'None'
                         }
-            configreq = configreq.items()
             if 'outfileruns' in file_info:
-                for run in file_info['outfileruns']:
-                    configreq.append(("outfileruns", run))
+                configreq['outfileruns'] = file_info['outfileruns']
             if 'outfilelumis' in file_info:
-                for lumis in file_info['outfilelumis']:
-                    configreq.append(("outfilelumis", lumis))
+                configreq['outfilelumis'] = file_info['outfilelumis']
             if 'inparentlfns' in file_info:
-                for lfn in file_info['inparentlfns']:
-                    # If the user specified a PFN as input, then the LFN is an empty string
-                    # and does not pass validation.
-                    if lfn:
-                        configreq.append(("inparentlfns", lfn))
-            filename = file_info['pfn'].split('/')[-1]
-            rest_api = 'filemetadata'
-            rest_uri = self.rest_uri_no_api + '/' + rest_api
-            rest_url = self.rest_host + rest_uri
-            msg = "Uploading file metadata for %s to https://%s: %s" % (filename, rest_url, configreq)
-            self.logger.debug(msg)
-            try:
-                self.server.put(rest_uri, data = urllib.urlencode(configreq))
-            except HTTPException as hte:
-                ## BrianB. Suppressing this exception is a tough decision.
-                ## If the file made it back alright, I suppose we can proceed.
-                msg = "Error uploading output file metadata: %s" % (str(hte.headers))
-                self.logger.error(msg)
-                if not self.file_exists(file_info['outlfn'], file_info['filetype']):
-                    raise
-                else:
-                    msg = "Ignoring the error since the file %s is already in the database" % lfn
-                    self.logger.debug(msg)
+                # If the user specified a PFN as input, then the LFN is an empty string
+                # and does not pass validation.
+                configreq['inparentlfns'] = [lfn for lfn in file_info['inparentlfns'] if lfn]
+            records.append(configreq)
+        self.upload_files_metadata(records, "output files")
 
         if not os.path.exists('output_datasets') and output_datasets:
             configreq = [('subresource', 'addoutputdatasets'),
@@ -2287,14 +2130,14 @@ class PostJob():
 
     def check_abort_dag(self, rval):
         """
-        For each job that failed with a fatal error, its id is written into the file
-        task_statistics.FATAL_ERROR. For each job that didn't fail with a fatal or
-        recoverable error, its id is written into the file task_statistics.OK.
-        Notice that these files may contain repeated job ids.
-        Based on these statistics we may decide to abort the whole DAG.
+        For each job that failed with a fatal error, its id is recorded in the task
+        statistics under FATAL_ERROR. For each job that didn't fail with a fatal or
+        recoverable error, its id is recorded under OK.
+        Based on the number of distinct job ids in these statistics we may decide to
+        abort the whole DAG. As when the statistics were kept in the task_statistics.OK
+        and task_statistics.FATAL_ERROR files, which only existed after the first job
+        with that outcome, the DAG is not aborted while no job has succeeded.
         """
-        file_name_jobs_fatal = "task_statistics.FATAL_ERROR"
-        file_name_jobs_ok    = "task_statistics.OK"
         ## Return code 3 is reserved to abort the entire DAG. Don't let the code
         ## otherwise use it.
         if rval == 3:
@@ -2303,19 +2146,10 @@ class PostJob():
             return rval
         try:
             limit = int(self.job_ad['CRAB_FailedNodeLimit'])
-            fatal_failed_jobs = []
-            with open(file_name_jobs_fatal, 'r') as fd:
-                for job_id in fd.readlines():
-                    if job_id not in fatal_failed_jobs:
-                        fatal_failed_jobs.append(job_id)
-            num_fatal_failed_jobs = len(fatal_failed_jobs)
-            successful_jobs = []
-            with open(file_name_jobs_ok, 'r') as fd:
-                for job_id in fd.readlines():
-                    if job_id not in successful_jobs:
-                        successful_jobs.append(job_id)
-            num_successful_jobs = len(successful_jobs)
-            if (num_successful_jobs + num_fatal_failed_jobs) > limit:
+            task_statistics = TaskStatistics()
+            num_fatal_failed_jobs = task_statistics.count_jobs('FATAL_ERROR')
+            num_successful_jobs = task_statistics.count_jobs('OK')
+            if num_successful_jobs and (num_successful_jobs + num_fatal_failed_jobs) > limit:
                 if num_fatal_failed_jobs > num_successful_jobs:
                     msg  = "There are %d (fatal) failed nodes and %d successful nodes,"
                     msg += " adding up to a total of %d (more than the limit of %d)."
@@ -13,6 +13,7 @@ from ApmonIf import ApmonIf
 
 from ServerUtilities import getWebdirForDb, insertJobIdSid, setDashboardLogs
 from TaskWorker.Actions.RetryJob import JOB_RETURN_CODES
+from TaskWorker.Actions.TaskStatistics import TaskStatistics
 
 import CMSGroupMapper
 
@@ -219,36 +220,24 @@ class PreJob:
 
     def get_statistics(self):
         """
-        Need a doc string here.
+        Return the number of job executions per status in the whole task.
         """
-        results = {}
         try:
-            for state in JOB_RETURN_CODES._fields:
-                count = 0
-                with open("task_statistics.%s" % (state)) as fd:
-                    for line in fd:
-                        count += 1
-                results[state] = count
-        except:
+            stats = TaskStatistics().get_statistics()
+        except Exception:
             return {}
-        return results
+        return dict((state, stats.get(state, 0)) for state in JOB_RETURN_CODES._fields)
 
 
     def get_site_statistics(self, site):
         """
-        Need a doc string here.
+        Return the number of job executions per status at the given site.
         """
-        results = {}
         try:
-            for state in JOB_RETURN_CODES._fields:
-                count = 0
-                with open("task_statistics.%s.%s" % (site, state)) as fd:
-                    for line in fd:
-                        count += 1
-                results[state] = count
-        except:
+            stats = TaskStatistics().get_statistics(site)
+        except Exception:
             return {}
-        return results
+        return dict((state, stats.get(state, 0)) for state in JOB_RETURN_CODES._fields)
 
 
     def calculate_blacklist(self):
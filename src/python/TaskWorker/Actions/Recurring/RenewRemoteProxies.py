@@ -1,11 +1,14 @@
 from __future__ import print_function
 import os
+import re
 import sys
 import time
 import json
 import urllib
 import logging
+import threading
 import traceback
+from multiprocessing.pool import ThreadPool
 
 import classad
 import htcondor
@@ -24,6 +27,67 @@ class RenewRemoteProxies(BaseRecurringAction):
 
 MINPROXYLENGTH = 60 * 60 * 24
 QUERY_ATTRS = ['x509userproxyexpiration', 'CRAB_ReqName', 'ClusterId', 'ProcId', 'CRAB_UserDN', 'CRAB_UserVO', 'CRAB_UserGroup', 'CRAB_UserRole', 'JobStatus']
+## Number of schedds processed at the same time.
+SCHEDD_THREADS = 8
+## Number of users (proxies) processed at the same time in each schedd.
+USER_THREADS_PER_SCHEDD = 4
+## Minimum number of seconds between the start of two authenticated sessions in the same schedd.
+MIN_SESSION_INTERVAL = 0.2
+## Error sent back by the authenticated session when the renewal failed only for some tasks.
+FAILED_TASKS_RE = re.compile(r"Failed to renew the proxy for (\d+) tasks: .*")
+
+
+class ProxyCache(object):
+    """
+    The proxies retrieved from MyProxy during one renewal pass, keyed by
+    (DN, VO, group, role). A user with tasks in several schedds is retrieved only
+    once: the threads asking for the same key wait for the first one. Failures are
+    also remembered, so that we don't ask MyProxy again in the same pass.
+    """
+    def __init__(self, retrieve):
+        self.retrieve = retrieve
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.retrieved = 0
+        self.failed = 0
+
+    def get(self, key, ad):
+        """
+        Return the proxy file name for key, retrieving it with retrieve(ad) if needed.
+        Raise an exception if the proxy could not be retrieved.
+        """
+        with self.lock:
+            entry = self.entries.setdefault(key, {'lock': threading.Lock()})
+        with entry['lock']:
+            if 'proxy' not in entry and 'error' not in entry:
+                try:
+                    entry['proxy'] = self.retrieve(ad)
+                    self.retrieved += 1
+                except Exception as ex:
+                    entry['error'] = ex
+                    self.failed += 1
+                    raise
+        if 'error' in entry:
+            raise Exception("Proxy retrieval already failed in this pass: %s" % str(entry['error']))
+        return entry['proxy']
+
+
+class RateLimiter(object):
+    """
+    Make the callers of wait() proceed at most once every interval seconds.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
 
 class CRAB3ProxyRenewer(object):
 
@@ -92,27 +156,74 @@ class CRAB3ProxyRenewer(object):
             raise Exception("Failed to retrieve proxy.")
         return userproxy
 
-    def renew_proxy(self, schedd, ad, proxy):
+    def renew_proxies(self, schedd, ad_list, proxy):
+        """
+        Renew the proxy of all the tasks in ad_list (all belonging to the same user)
+        in one single authenticated session with the schedd. Return the number of
+        tasks whose proxy could not be renewed (the errors are logged); raise an
+        exception if the session itself failed.
+        """
         now = time.time()
-        self.logger.info("Renewing proxy for task %s." % ad['CRAB_ReqName'])
-        if not hasattr(schedd, 'refreshGSIProxy'):
-            raise NotImplementedError()
+        self.logger.info("Renewing proxy for tasks %s." % ", ".join(ad['CRAB_ReqName'] for ad in ad_list))
         with HTCondorUtils.AuthenticatedSubprocess(proxy) as (parent, rpipe):
             if not parent:
-                lifetime = schedd.refreshGSIProxy(ad['ClusterId'], ad['ProcID'], proxy, -1)
-                schedd.edit(['%s.%s' % (ad['ClusterId'], ad['ProcId'])], 'x509userproxyexpiration', str(int(now+lifetime)))
+                ## No logging here: we may have been forked while another thread was logging.
+                failures = []
+                for ad in ad_list:
+                    try:
+                        lifetime = schedd.refreshGSIProxy(ad['ClusterId'], ad['ProcID'], proxy, -1)
+                        schedd.edit(['%s.%s' % (ad['ClusterId'], ad['ProcId'])], 'x509userproxyexpiration', str(int(now+lifetime)))
+                    except Exception as ex:
+                        failures.append("%s (%s)" % (ad['CRAB_ReqName'], str(ex)))
+                if failures:
+                    raise Exception("Failed to renew the proxy for %d tasks: %s" % (len(failures), "; ".join(failures)))
         results = rpipe.read()
         if results != "OK":
-            raise Exception("Failure when renewing HTCondor task proxy: '%s'" % results)
+            m = FAILED_TASKS_RE.search(results)
+            if not m:
+                raise Exception("Failure when renewing HTCondor task proxy: '%s'" % results)
+            self.logger.error(m.group(0))
+            return int(m.group(1))
+        return 0
 
-    def execute_schedd(self, schedd_name, collector):
+    def execute_user(self, schedd, schedd_name, key, ad_list, proxies, limiter, metrics):
+        """
+        Retrieve the proxy of one user (if not already done for another schedd) and
+        renew it for all the user's tasks in the schedd.
+        """
+        self.logger.info("Retrieving proxy for %s" % str(key))
+        try:
+            proxyfile = proxies.get(key, ad_list[0])
+        except Exception:
+            self.logger.exception("Failed to retrieve proxy.  Skipping user")
+            with self.metrics_lock:
+                metrics['tasks_failed'] += len(ad_list)
+            return
+        limiter.wait()
+        try:
+            failed = self.renew_proxies(schedd, ad_list, proxyfile)
+            renewed = len(ad_list) - failed
+        except Exception:
+            self.logger.exception("Failed to renew proxy for tasks of %s in schedd %s due to exception." % (str(key), schedd_name))
+            renewed, failed = 0, len(ad_list)
+        with self.metrics_lock:
+            metrics['sessions'] += 1
+            metrics['tasks_renewed'] += renewed
+            metrics['tasks_failed'] += failed
+
+    def execute_schedd(self, schedd_name, collector, proxies):
         self.logger.info("Updating tasks in schedd %s" % schedd_name)
         self.logger.info("Trying to locate schedd.")
-        schedd_ad = collector.locate(htcondor.DaemonTypes.Schedd, schedd_name)
+        ## Hold the HTCondor lock while in the library, as other threads may be forking.
+        with HTCondorUtils.HTCondorLock:
+            schedd_ad = collector.locate(htcondor.DaemonTypes.Schedd, schedd_name)
         self.logger.info("Schedd found at %s" % schedd_ad['MyAddress'])
         schedd = htcondor.Schedd(schedd_ad)
+        if not hasattr(schedd, 'refreshGSIProxy'):
+            raise NotImplementedError()
         self.logger.info("Querying schedd for CRAB3 tasks.")
-        task_ads = list(schedd.xquery('JobStatus =!= 4 && TaskType =?= "ROOT" && CRAB_HC =!= "True"', QUERY_ATTRS))
+        with HTCondorUtils.HTCondorLock:
+            task_ads = list(schedd.xquery('JobStatus =!= 4 && TaskType =?= "ROOT" && CRAB_HC =!= "True"', QUERY_ATTRS))
         self.logger.info("There were %d tasks found." % len(task_ads))
         ads = {}
         now = time.time()
@@ -136,32 +247,60 @@ class CRAB3ProxyRenewer(object):
             ad_list = ads.setdefault(key, [])
             ad_list.append(ad)
 
-        for key, ad_list in ads.items():
-            self.logger.info("Retrieving proxy for %s" % str(key))
+        metrics = {'tasks': len(task_ads), 'users': len(ads), 'sessions': 0, 'tasks_renewed': 0, 'tasks_failed': 0}
+        limiter = RateLimiter(MIN_SESSION_INTERVAL)
+        if ads:
+            pool = ThreadPool(min(USER_THREADS_PER_SCHEDD, len(ads)))
             try:
-                proxyfile = self.get_proxy(ad_list[0])
-            except Exception:
-                self.logger.exception("Failed to retrieve proxy.  Skipping user")
-                continue
-            for ad in ad_list:
-                try:
-                    self.renew_proxy(schedd, ad, proxyfile)
-                except NotImplementedError:
-                    raise
-                except Exception:
-                    self.logger.exception("Failed to renew proxy for task %s due to exception." % ad['CRAB_ReqName'])
+                pool.map(lambda item: self.execute_user(schedd, schedd_name, item[0], item[1], proxies, limiter, metrics), ads.items())
+            finally:
+                pool.close()
+                pool.join()
+        return metrics
+
+    def execute_schedd_timed(self, schedd_name, collector, proxies):
+        """
+        Wrapper of execute_schedd() catching the errors and measuring the time.
+        """
+        start = time.time()
+        try:
+            metrics = self.execute_schedd(schedd_name, collector, proxies)
+            self.logger.info("Done updating proxies for schedd %s" % schedd_name)
+        except NotImplementedError:
+            raise
+        except Exception:
+            self.logger.exception("Unable to update all proxies for schedd %s" % schedd_name)
+            metrics = {'error': True}
+        metrics['time'] = time.time() - start
+        return schedd_name, metrics
 
     def execute(self):
+        """
+        Renew the proxies in all the schedds, SCHEDD_THREADS schedds at a time.
+        Return the metrics of the pass.
+        """
+        start = time.time()
         self.get_backendurls()
         collector = htcondor.Collector(self.pool)
-        for schedd_name in self.schedds:
-            try:
-                self.execute_schedd(schedd_name, collector)
-                self.logger.info("Done updating proxies for schedd %s" % schedd_name)
-            except NotImplementedError:
-                raise
-            except Exception:
-                self.logger.exception("Unable to update all proxies for schedd %s" % schedd_name)
+        proxies = ProxyCache(self.get_proxy)
+        self.metrics_lock = threading.Lock()
+        pool = ThreadPool(max(min(SCHEDD_THREADS, len(self.schedds)), 1))
+        try:
+            results = pool.map(lambda schedd_name: self.execute_schedd_timed(schedd_name, collector, proxies), self.schedds)
+        finally:
+            pool.close()
+            pool.join()
+        metrics = {'time': time.time() - start,
+                   'proxies_retrieved': proxies.retrieved,
+                   'proxies_failed': proxies.failed,
+                   'schedds': dict(results)}
+        for schedd_name, schedd_metrics in results:
+            self.logger.info("Schedd %s: %s" % (schedd_name, ", ".join("%s=%s" % (k, schedd_metrics[k]) for k in sorted(schedd_metrics))))
+        msg = "Proxy renewal pass done in %.1f seconds for %d schedds:" % (metrics['time'], len(self.schedds))
+        msg += " %d tasks renewed, %d failed;" % (sum(m.get('tasks_renewed', 0) for _, m in results), sum(m.get('tasks_failed', 0) for _, m in results))
+        msg += " %d proxies retrieved, %d failed." % (proxies.retrieved, proxies.failed)
+        self.logger.info(msg)
+        return metrics
 
 if __name__ == '__main__':
     """ Simple main to execute the action standalon. You just need to set the task worker environment.
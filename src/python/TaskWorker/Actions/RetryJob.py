@@ -7,6 +7,8 @@ import subprocess
 import classad
 from collections import namedtuple
 
+from TaskWorker.Actions.TaskStatistics import TaskStatistics
+
 
 JOB_RETURN_CODES = namedtuple('JobReturnCodes', 'OK RECOVERABLE_ERROR FATAL_ERROR')(0, 1, 2)
 
@@ -131,21 +133,14 @@ class RetryJob(object):
 
     def record_site(self, job_status):
         """
-        Need a doc string here.
+        Record the site where the job ran and the job status in the task statistics.
         """
         job_status_name = None
         for name, code in JOB_RETURN_CODES._asdict().iteritems():
             if code == job_status:
                 job_status_name = name
         try:
-            with os.fdopen(os.open("task_statistics.%s.%s" % (self.site, job_status_name), os.O_APPEND | os.O_CREAT | os.O_RDWR, 0o644), 'a') as fd:
-                fd.write("%d\n" % (self.job_id))
-        except Exception as ex:
-            self.logger.error(str(ex))
-            # Swallow the exception - record_site is advisory only
-        try:
-            with os.fdopen(os.open("task_statistics.%s" % (job_status_name), os.O_APPEND | os.O_CREAT | os.O_RDWR, 0o644), 'a') as fd:
-                fd.write("%d\n" % (self.job_id))
+            TaskStatistics().record(self.site, job_status_name, self.job_id)
         except Exception as ex:
             self.logger.error(str(ex))
             # Swallow the exception - record_site is advisory only
@@ -0,0 +1,116 @@
+"""
+PhEDEx node name (PNN) to processing site name (PSN) mapping used by the data
+discovery.
+
+Instead of asking SiteDB to translate each PNN of each task, we load the whole
+data-processing mapping from SiteDB once and keep it for SITE_MAPPING_TTL
+seconds. The mapping is also saved in the scratch directory of the TaskWorker,
+so that the other slaves (and the TaskWorker after a restart) can use it without
+contacting SiteDB; a lock file makes sure that only one slave at a time
+downloads it.
+"""
+import os
+import json
+import time
+import fcntl
+import threading
+
+from WMCore.Services.SiteDB.SiteDB import SiteDBJSON
+
+SITE_MAPPING_FILE_NAME = "pnn_psn_map.json"
+SITE_MAPPING_TTL = 6 * 3600
+## After a failure to download the mapping, wait this long before trying again.
+SITE_MAPPING_RETRY = 600
+
+
+def downloadSiteMapping(config):
+    """
+    Return a dictionary {PNN: [PSNs]} with the whole data-processing mapping from SiteDB.
+    """
+    sbj = SiteDBJSON({"key": config.TaskWorker.cmskey, "cert": config.TaskWorker.cmscert})
+    mapping = {}
+    for entry in sbj._dataProcessing():
+        mapping.setdefault(str(entry['phedex_name']), set()).add(str(entry['psn_name']))
+    return dict((pnn, sorted(psns)) for pnn, psns in mapping.iteritems())
+
+
+class SiteMappingCache(object):
+    """
+    The PNN to PSN mapping of this process, backed by the file in the scratch directory.
+    """
+    def __init__(self, ttl=SITE_MAPPING_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.mapping = None
+        self.expires = 0
+
+    def readFile(self, fileName):
+        """
+        Return (mapping, timestamp) from the file, or (None, 0) if it can not be read.
+        """
+        try:
+            with open(fileName) as fd:
+                content = json.load(fd)
+            mapping = dict((str(pnn), [str(psn) for psn in psns]) for pnn, psns in content['mapping'].iteritems())
+            return mapping, content['timestamp']
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            return None, 0
+
+    def writeFile(self, fileName, mapping, timestamp):
+        tmpName = "%s.%d.tmp" % (fileName, os.getpid())
+        with open(tmpName, 'w') as fd:
+            json.dump({'timestamp': timestamp, 'mapping': mapping}, fd)
+        os.rename(tmpName, fileName)
+
+    def getMapping(self, config, logger):
+        """
+        Return the dictionary {PNN: [PSNs]}, downloading it from SiteDB if the copy
+        in memory and the one in the scratch directory are older than the TTL. If
+        the download fails, the old mapping is used (or an empty one if there is
+        none); the caller can still translate the missing PNNs one by one.
+        """
+        with self.lock:
+            now = time.time()
+            if self.mapping is not None and now < self.expires:
+                return self.mapping
+            scratchDir = getattr(config.TaskWorker, 'scratchDir', None)
+            fileName = os.path.join(scratchDir, SITE_MAPPING_FILE_NAME) if scratchDir else None
+            mapping, timestamp = self.readFile(fileName) if fileName else (None, 0)
+            if mapping is None or now - timestamp >= self.ttl:
+                lockfd = open(fileName + ".lock", 'a') if fileName else None
+                try:
+                    if lockfd:
+                        fcntl.flock(lockfd, fcntl.LOCK_EX)
+                        ## Another slave may have downloaded it while we were waiting.
+                        mapping, timestamp = self.readFile(fileName)
+                    if mapping is None or now - timestamp >= self.ttl:
+                        mapping, timestamp = self.download(config, logger, fileName, mapping or self.mapping)
+                finally:
+                    if lockfd:
+                        lockfd.close()
+            self.mapping = mapping
+            self.expires = timestamp + self.ttl
+            return self.mapping
+
+    def download(self, config, logger, fileName, oldMapping):
+        """
+        Download the mapping and save it in fileName. Return (mapping, timestamp);
+        in case of failure return the old mapping with a timestamp such that the
+        download is retried after SITE_MAPPING_RETRY seconds.
+        """
+        now = time.time()
+        logger.info("Downloading the PNN to PSN mapping from SiteDB")
+        try:
+            mapping = downloadSiteMapping(config)
+        except Exception as ex:
+            logger.error("Failed to download the PNN to PSN mapping from SiteDB: %s" % str(ex))
+            return oldMapping or {}, now - self.ttl + SITE_MAPPING_RETRY
+        if fileName:
+            try:
+                self.writeFile(fileName, mapping, now)
+            except (IOError, OSError) as ex:
+                logger.warning("Failed to save the PNN to PSN mapping in %s: %s" % (fileName, str(ex)))
+        return mapping, now
+
+## Shared by all the data discovery actions of this process.
+SITE_MAPPING_CACHE = SiteMappingCache()
@@ -0,0 +1,88 @@
+"""
+Task statistics shared by the pre-jobs, post-jobs and retry-jobs of a task.
+
+RetryJob records, for each job execution, the site where the job ran and the job
+status (one of the JOB_RETURN_CODES names). PreJob and PostJob use these statistics
+to decide about automatic site blacklisting and about aborting the whole DAG.
+
+The statistics are kept in a small SQLite database in the spool directory, holding
+counters per status and per (site, status), plus the set of job ids per status.
+Recording an execution and answering a query are therefore O(1) operations that
+don't depend on the task history. SQLite takes care of the locking between the
+many pre/post scripts that DAGMan may be running at the same time.
+"""
+import sqlite3
+
+G_TASK_STATISTICS_DB_NAME = "task_statistics.db"
+
+## The site name used in the counters for the task totals.
+ALL_SITES = "*"
+
+
+class TaskStatistics(object):
+    """
+    Counters and job id sets of the job executions of a task.
+    """
+    def __init__(self, dbname=G_TASK_STATISTICS_DB_NAME, timeout=60):
+        self.dbname = dbname
+        self.timeout = timeout
+
+    def _connect(self):
+        """
+        Open a connection in autocommit mode (we start the transactions ourselves)
+        and create the tables if this is the first use of the database.
+        """
+        conn = sqlite3.connect(self.dbname, timeout=self.timeout, isolation_level=None)
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (site TEXT, status TEXT, njobs INTEGER, "
+                     "PRIMARY KEY (site, status))")
+        conn.execute("CREATE TABLE IF NOT EXISTS jobs (status TEXT, job_id INTEGER, "
+                     "PRIMARY KEY (status, job_id))")
+        return conn
+
+    def record(self, site, status, job_id):
+        """
+        Record one execution of job_id at site with the given status name. The
+        counters count executions (a job retried at the same site is counted again),
+        while the job id sets only contain each job id once.
+        """
+        conn = self._connect()
+        try:
+            ## Take the write lock immediately, to not deadlock with another writer.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for counter_site in [str(site), ALL_SITES]:
+                    conn.execute("INSERT OR IGNORE INTO counters VALUES (?, ?, 0)", (counter_site, status))
+                    conn.execute("UPDATE counters SET njobs = njobs + 1 WHERE site = ? AND status = ?", (counter_site, status))
+                conn.execute("INSERT OR IGNORE INTO jobs VALUES (?, ?)", (status, job_id))
+            except:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def get_statistics(self, site=ALL_SITES):
+        """
+        Return a dictionary with the number of job executions per status, either at
+        the given site or (by default) in the whole task. Statuses that were never
+        recorded are not in the dictionary.
+        """
+        results = {}
+        conn = self._connect()
+        try:
+            for status, njobs in conn.execute("SELECT status, njobs FROM counters WHERE site = ?", (str(site),)):
+                results[str(status)] = njobs
+        finally:
+            conn.close()
+        return results
+
+    def count_jobs(self, status):
+        """
+        Return the number of distinct job ids that had at least one execution with
+        the given status.
+        """
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)).fetchone()[0]
+        finally:
+            conn.close()
@@ -5,8 +5,10 @@ import os
 import time
 import urllib
 import signal
+import Queue
 import random
 import logging
+import threading
 import traceback
 from httplib import HTTPException
 from logging.handlers import TimedRotatingFileHandler
@@ -40,6 +42,11 @@ def handler(status):
         if st[0] == status:
             return st[1]
 
+## Initial and maximum time (in seconds) to wait before retrying a status update
+## that failed because the server was unavailable (503).
+STATE_UPDATE_BACKOFF = 30
+STATE_UPDATE_MAX_BACKOFF = 600
+
 MODEURL = {'cmsweb-dev': {'host': 'cmsweb-dev.cern.ch', 'instance':  'dev'},
            'cmsweb-preprod': {'host': 'cmsweb-testbed.cern.ch', 'instance': 'preprod'},
            'cmsweb-prod': {'host': 'cmsweb.cern.ch', 'instance':  'prod'},
@@ -147,6 +154,15 @@ class MasterWorker(object):
         self.slaves.begin()
         recurringActionsNames = getattr(self.config.TaskWorker, 'recurringActions', [])
         self.recurringActions = [self.getRecurringActionInst(name) for name in recurringActionsNames]
+        ## The status updates are sent to the server by a separate thread. The names of the
+        ## tasks whose update is not done yet are kept, since until then those tasks are
+        ## still returned by _getWork, and must not be injected again.
+        self.stateUpdates = Queue.Queue()
+        self.pendingUpdates = set()
+        self.pendingUpdatesLock = threading.Lock()
+        self.stateSender = threading.Thread(target=self._sendStateUpdates, name='StateSender')
+        self.stateSender.daemon = True
+        self.stateSender.start()
 
 
     def getRecurringActionInst(self, actionName):
@@ -212,33 +228,65 @@ class MasterWorker(object):
         self.STOP = True
 
 
-    def updateWork(self, taskname, status):
-        configreq = {'workflow': taskname, 'status': status, 'subresource': 'state'}
-        retry = True
-        while retry:
-            try:
-                self.server.post(self.restURInoAPI + '/workflowdb', data = urllib.urlencode(configreq))
-                retry = False
-            except HTTPException as hte:
-                #Using a msg variable and only one self.logger.error so that messages do not get shuffled
-                msg = "Task Worker could not update a task status (HTTPException): %s\nConfiguration parameters=%s\n" % (str(hte), configreq)
-                msg += "\tstatus: %s\n" %(hte.headers.get('X-Error-Http', 'unknown'))
-                msg += "\treason: %s\n" %(hte.headers.get('X-Error-Detail', 'unknown'))
-                msg += "\turl: %s\n" %(getattr(hte, 'url', 'unknown'))
-                msg += "\tresult: %s\n" %(getattr(hte, 'result', 'unknown'))
-                msg += "%s \n" %(str(traceback.format_exc()))
-                self.logger.error(msg)
-                retry = False
-                if int(hte.headers.get('X-Error-Http', '0')) == 503:
-                    #503 - Database/Service unavailable. Maybe Intervention of CMSWEB ongoing?
-                    retry = True
-                    time_sleep = 30 + random.randint(10, 30)
-                    self.logger.info("Sleeping %s seconds and will try to update again." % str(time_sleep))
-                    time.sleep(time_sleep)
-            except Exception as exc:
-                msg = "Task Worker could not update a task status: %s\nConfiguration parameters=%s\n" % (str(exc), configreq)
-                self.logger.error(msg + traceback.format_exc())
-                retry = False
+    def updateWorks(self, tasknames, status, getstatus=None):
+        """Queue the update of the status of the given tasks. The updates are sent by the
+           state sender thread, with one request per call, so that the master does not wait
+           for the server (e.g. when it is unavailable)."""
+        if tasknames:
+            with self.pendingUpdatesLock:
+                self.pendingUpdates.update(tasknames)
+            self.stateUpdates.put((tasknames, status, getstatus))
+
+
+    def _getNewWork(self, limit, getstatus):
+        """Same as _getWork, without the tasks whose status update is waiting in the state sender.
+           The pending updates are taken before fetching: an update done in between would let
+           the task through, while it was fetched before leaving `getstatus`."""
+        with self.pendingUpdatesLock:
+            pending = set(self.pendingUpdates)
+        return [task for task in self._getWork(limit=limit, getstatus=getstatus) if task['tm_taskname'] not in pending]
+
+
+    def _sendStateUpdates(self):
+        """Body of the state sender thread. Sends the status updates queued by updateWorks
+           in order, retrying with exponential backoff when the server answers 503."""
+        while True:
+            tasknames, status, getstatus = self.stateUpdates.get()
+            configreq = {'workflows': tasknames, 'status': status, 'subresource': 'bulkstate'}
+            if getstatus is not None:
+                configreq['getstatus'] = getstatus
+            backoff = STATE_UPDATE_BACKOFF
+            retry = True
+            while retry:
+                try:
+                    self.server.post(self.restURInoAPI + '/workflowdb', data = urllib.urlencode(configreq, doseq=True))
+                    retry = False
+                except HTTPException as hte:
+                    #Using a msg variable and only one self.logger.error so that messages do not get shuffled
+                    msg = "Task Worker could not update a task status (HTTPException): %s\nConfiguration parameters=%s\n" % (str(hte), configreq)
+                    msg += "\tstatus: %s\n" %(hte.headers.get('X-Error-Http', 'unknown'))
+                    msg += "\treason: %s\n" %(hte.headers.get('X-Error-Detail', 'unknown'))
+                    msg += "\turl: %s\n" %(getattr(hte, 'url', 'unknown'))
+                    msg += "\tresult: %s\n" %(getattr(hte, 'result', 'unknown'))
+                    msg += "%s \n" %(str(traceback.format_exc()))
+                    self.logger.error(msg)
+                    retry = False
+                    if int(hte.headers.get('X-Error-Http', '0')) == 503:
+                        #503 - Database/Service unavailable. Maybe Intervention of CMSWEB ongoing?
+                        retry = True
+                        time_sleep = backoff + random.randint(0, backoff/2)
+                        backoff = min(2*backoff, STATE_UPDATE_MAX_BACKOFF)
+                        self.logger.info("Sleeping %s seconds and will try to update again." % str(time_sleep))
+                        time.sleep(time_sleep)
+                except Exception as exc:
+                    msg = "Task Worker could not update a task status: %s\nConfiguration parameters=%s\n" % (str(exc), configreq)
+                    self.logger.error(msg + traceback.format_exc())
+                    retry = False
+            ## done, or given up as the synchronous update did: as before, a task still in HOLDING
+            ## is then fetched and injected again by the next iteration
+            with self.pendingUpdatesLock:
+                self.pendingUpdates.difference_update(tasknames)
+            self.stateUpdates.task_done()
 
 
     def algorithm(self):
@@ -254,12 +302,13 @@ class MasterWorker(object):
                 ## Warning: If we fail to retrieve tasks on HOLDING (e.g. because cmsweb is down)
                 ## we may end up executing the wrong worktype later on. A solution would be to
                 ## save the previous task state in a new column of the TaskDB.
-                pendingwork = self._getWork(limit=limit, getstatus='HOLDING')
+                ## The tasks injected by the previous iterations are still in HOLDING until the state
+                ## sender updates them to QUEUED, which can take long if the server is unavailable.
+                pendingwork = self._getNewWork(limit=limit, getstatus='HOLDING')
                 self.logger.info("Retrieved a total of %d %s works" %(len(pendingwork), worktype))
                 self.logger.debug("Retrieved the following works: \n%s" %(str(pendingwork)))
                 self.slaves.injectWorks([(worktype, task, failstatus, None) for task in pendingwork])
-                for task in pendingwork:
-                    self.updateWork(task['tm_taskname'], 'QUEUED')
+                self.updateWorks([task['tm_taskname'] for task in pendingwork], 'QUEUED', getstatus='HOLDING')
 
             for action in self.recurringActions:
                 if action.isTimeToGo():
@@ -1,36 +1,125 @@
+"""
+Entry point of the commands run on the schedd for a task: the pre-jobs and
+post-jobs of each node of the DAG (PREJOB, POSTJOB), the final step (FINAL)
+and the data discovery and splitting (DBS, SPLIT) of the tasks submitted
+without the TaskWorker.
+
+The pre-jobs and post-jobs are run many times per task, so each command only
+imports the modules it needs (see COMMAND_MODULES). Set CRAB_IMPORT_PROFILE=1
+in the environment to print the time spent importing each module, or set it to
+a file name to append the report to that file.
+"""
 from __future__ import print_function
 
 import os
 import sys
 import json
+import time
 import errno
 import types
 import pickle
 import pprint
+import __builtin__
+
+## Modules imported by each command, as (name in this module, module name).
+COMMAND_MODULES = {
+    'PREJOB': [('PreJob', 'TaskWorker.Actions.PreJob')],
+    'POSTJOB': [('PostJob', 'TaskWorker.Actions.PostJob')],
+    'FINAL': [('Final', 'TaskWorker.Actions.Final')],
+    'DBS': [('classad', 'classad'),
+            ('HTCondorUtils', 'HTCondorUtils'),
+            ('Configuration', 'WMCore.Configuration'),
+            ('DBSDataDiscovery', 'TaskWorker.Actions.DBSDataDiscovery')],
+    'SPLIT': [('classad', 'classad'),
+              ('HTCondorUtils', 'HTCondorUtils'),
+              ('Configuration', 'WMCore.Configuration'),
+              ('Splitter', 'TaskWorker.Actions.Splitter'),
+              ('DagmanCreator', 'TaskWorker.Actions.DagmanCreator')],
+}
+
+## Set by importCommand().
+classad = HTCondorUtils = Configuration = None
+DBSDataDiscovery = Splitter = DagmanCreator = PostJob = PreJob = Final = None
+
+
+class ImportProfiler(object):
+    """
+    Measure the time spent in each import statement that loads new modules.
+    The cumulative time includes the modules imported by the module; the self
+    time does not.
+    """
+    def __init__(self):
+        self.stats = {}
+        self.stack = []
+        self.origImport = None
+
+    def install(self):
+        self.origImport = __builtin__.__import__
+        __builtin__.__import__ = self.profiledImport
 
-import classad
+    def uninstall(self):
+        __builtin__.__import__ = self.origImport
 
-import TaskWorker.Actions.DBSDataDiscovery as DBSDataDiscovery
-import TaskWorker.Actions.Splitter as Splitter
-import TaskWorker.Actions.DagmanCreator as DagmanCreator
-import TaskWorker.Actions.PostJob as PostJob
-import TaskWorker.Actions.PreJob as PreJob
-import TaskWorker.Actions.Final as Final
-import HTCondorUtils
+    def profiledImport(self, name, *args, **kwargs):
+        numModules = len(sys.modules)
+        self.stack.append(0.0)
+        start = time.time()
+        try:
+            return self.origImport(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            if len(sys.modules) > numModules:
+                cumulative, own = self.stats.get(name, (0.0, 0.0))
+                self.stats[name] = (cumulative + elapsed, own + elapsed - children)
+
+    def report(self, command, fd):
+        total = sum(own for _, own in self.stats.values())
+        fd.write("Imports of %s (pid %d): %.1f ms\n" % (command, os.getpid(), 1000 * total))
+        fd.write("%10s %10s  %s\n" % ("cumul. ms", "self ms", "module"))
+        for name, (cumulative, own) in sorted(self.stats.items(), key=lambda item: -item[1][0]):
+            fd.write("%10.1f %10.1f  %s\n" % (1000 * cumulative, 1000 * own, name))
+
+
+def importCommand(command):
+    """
+    Import the modules needed by the command, profiling the imports if
+    CRAB_IMPORT_PROFILE is set.
+    """
+    if command not in COMMAND_MODULES:
+        raise ValueError("Unknown command %s" % (command))
+    profile = os.environ.get('CRAB_IMPORT_PROFILE')
+    profiler = None
+    if profile:
+        profiler = ImportProfiler()
+        profiler.install()
+    try:
+        for alias, name in COMMAND_MODULES[command]:
+            __import__(name)
+            globals()[alias] = sys.modules[name]
+    finally:
+        if profiler:
+            profiler.uninstall()
+    if profiler:
+        if profile == '1':
+            profiler.report(command, sys.stdout)
+        else:
+            with open(profile, 'a') as fd:
+                profiler.report(command, fd)
 
-import WMCore.Configuration as Configuration
 
 def bootstrap():
     print("Entering TaskManagerBootstrap with args: %s" % sys.argv)
     command = sys.argv[1]
+    importCommand(command)
     if command == "POSTJOB":
         return PostJob.PostJob().execute(*sys.argv[2:])
     elif command == "PREJOB":
         return PreJob.PreJob().execute(*sys.argv[2:])
     elif command == "FINAL":
         return Final.Final().execute(*sys.argv[2:])
-    elif command == "ASO":
-        return ASO.async_stageout(*sys.argv[2:])
 
     infile, outfile = sys.argv[2:]
 
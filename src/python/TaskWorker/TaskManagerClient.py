@@ -0,0 +1,141 @@
+"""
+Client of the TaskManagerDaemon, run by dag_bootstrap.sh for the pre-jobs and
+post-jobs of a DAG instead of TaskManagerBootstrap.
+
+It only imports modules of the standard library, so that it starts quickly. It
+sends the arguments, the environment and the working directory to the daemon
+listening on SOCKET_NAME in the spool directory, copies the output of the
+command to its stdout and exits with the exit code of the command. If there is
+no daemon, it starts one for the next calls. If the daemon can not be reached,
+or if it dies before the command reports its exit code, the command is run by
+TaskManagerBootstrap in this process, as before.
+
+Set CRAB_TASKMANAGER_DAEMON=0 in the environment to never use the daemon.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import errno
+import socket
+import signal
+import subprocess
+
+## Name of the Unix socket (in the spool directory of the DAG) of the daemon.
+SOCKET_NAME = "taskmanager.sock"
+## Log file of the daemon.
+DAEMON_LOG_NAME = "taskmanager_daemon.txt"
+## Commands run by the daemon; the other ones (run once per task) always run in-process.
+DAEMON_COMMANDS = ['PREJOB', 'POSTJOB']
+## Signals forwarded to the process running the command (e.g. when DAGMan removes the node).
+FORWARDED_SIGNALS = [signal.SIGHUP, signal.SIGINT, signal.SIGTERM]
+## Seconds to wait for the daemon to accept the request.
+CONNECT_TIMEOUT = 10
+
+READ_SIZE = 64 * 1024
+
+
+def startDaemon():
+    """ Start the daemon in the background, in its own session. If another client
+        starts one at the same time, only one of them will keep running.
+    """
+    with open(DAEMON_LOG_NAME, 'a') as fd:
+        subprocess.Popen([sys.executable, '-m', 'TaskWorker.TaskManagerDaemon'], stdin=open(os.devnull), \
+                         stdout=fd, stderr=subprocess.STDOUT, close_fds=True, preexec_fn=os.setsid)
+
+
+def readLine(sock, data):
+    """ Read from the socket until there is a new line in data. Return (line, rest of data). """
+    while '\n' not in data:
+        chunk = sock.recv(READ_SIZE)
+        if not chunk:
+            raise EOFError("connection closed by the daemon")
+        data += chunk
+    return data.split('\n', 1)
+
+
+def runInDaemon(argv):
+    """ Run the command in the daemon. Return its exit code, or None if the daemon
+        did not run it (or died before the command finished).
+    """
+    token = os.urandom(16).encode('hex')
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(CONNECT_TIMEOUT)
+    try:
+        sock.connect(SOCKET_NAME)
+    except socket.error as ex:
+        if ex.args and ex.args[0] in [errno.ENOENT, errno.ECONNREFUSED]:
+            startDaemon()
+        sock.close()
+        return None
+    request = {'argv': argv, 'env': dict(os.environ), 'cwd': os.getcwd(), 'token': token}
+    signals = []
+    try:
+        sock.sendall(json.dumps(request))
+        sock.shutdown(socket.SHUT_WR)
+        ## The process running the command starts by sending its pid.
+        header, data = readLine(sock, '')
+        if not header.startswith("%s PID " % (token)):
+            raise ValueError("unexpected answer from the daemon")
+        pid = int(header.split()[2])
+    except (socket.error, EOFError, ValueError):
+        sock.close()
+        return None
+    def forward(signum, frame):
+        signals.append(signum)
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+    for signum in FORWARDED_SIGNALS:
+        signal.signal(signum, forward)
+    sock.settimeout(None)
+    ## Copy the output to stdout, keeping back what could be the beginning of the
+    ## exit code line, which is the last thing sent.
+    marker = "\n%s EXIT " % (token)
+    retval = None
+    while True:
+        if marker in data:
+            output, status = data.split(marker, 1)
+            sys.stdout.write(output)
+            try:
+                status, data = readLine(sock, status)
+                retval = int(status)
+            except (socket.error, EOFError, ValueError):
+                data = ''
+            break
+        sys.stdout.write(data[:-len(marker)])
+        data = data[-len(marker):]
+        try:
+            chunk = sock.recv(READ_SIZE)
+        except socket.error as ex:
+            if ex.args and ex.args[0] == errno.EINTR:
+                continue
+            break
+        if not chunk:
+            break
+        data += chunk
+    sys.stdout.write(data)
+    sys.stdout.flush()
+    sock.close()
+    if retval is None and signals:
+        ## The command was killed on our request; don't run it again.
+        signal.signal(signals[0], signal.SIG_DFL)
+        os.kill(os.getpid(), signals[0])
+    return retval
+
+
+def main():
+    argv = sys.argv[1:]
+    if argv and argv[0] in DAEMON_COMMANDS and os.environ.get('CRAB_TASKMANAGER_DAEMON', '1') != '0':
+        retval = runInDaemon(argv)
+        if retval is not None:
+            return retval
+        print("Running %s without the task manager daemon." % (argv[0]))
+    sys.stdout.flush()
+    os.execv(sys.executable, [sys.executable, '-m', 'TaskWorker.TaskManagerBootstrap'] + argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Long-lived process that runs the pre-jobs and post-jobs of a DAG.
+
+Starting a Python interpreter and importing the pre-job and post-job modules
+(and WMCore, classad, htcondor, ...) for each node script takes much longer than
+the actual work of most scripts. The daemon imports them once, listens on a Unix
+socket in the spool directory and, for each request sent by a TaskManagerClient,
+forks a process that runs TaskManagerBootstrap with the arguments, environment
+and working directory of the client. The forked process sends its output and
+the exit code back to the client. The daemon exits after IDLE_TIMEOUT seconds
+without requests.
+
+The daemon is started by the first client that does not find it; a lock file
+makes sure there is only one per spool directory.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import random
+import select
+import signal
+import socket
+import traceback
+
+from TaskWorker.TaskManagerClient import SOCKET_NAME, FORWARDED_SIGNALS
+import TaskWorker.TaskManagerBootstrap as TaskManagerBootstrap
+## Not used here, but imported once for all the forked processes.
+import TaskWorker.Actions.PreJob
+import TaskWorker.Actions.PostJob
+
+## Seconds without requests (and without commands running) after which the daemon exits.
+IDLE_TIMEOUT = 30 * 60
+## Seconds to wait for a client to send its request.
+REQUEST_TIMEOUT = 10
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+
+def printLog(msg):
+    print("%s: %s" % (time.strftime("%Y-%m-%d %H:%M:%S"), msg))
+    sys.stdout.flush()
+
+
+def readRequest(conn):
+    """ Read the JSON request sent by the client, which then closes its side of the connection. """
+    conn.settimeout(REQUEST_TIMEOUT)
+    chunks, size = [], 0
+    while True:
+        chunk = conn.recv(64 * 1024)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > MAX_REQUEST_SIZE:
+            raise ValueError("request larger than %d bytes" % (MAX_REQUEST_SIZE))
+    conn.settimeout(None)
+    request = json.loads(''.join(chunks))
+    for key in ['argv', 'env', 'cwd', 'token']:
+        if key not in request:
+            raise ValueError("request without %s" % (key))
+    return request
+
+
+def runBootstrap():
+    """ Same as running TaskManagerBootstrap as a script. """
+    try:
+        retval = TaskManagerBootstrap.bootstrap()
+        print("Ended TaskManagerBootstrap with code %s" % retval)
+    except SystemExit:
+        raise
+    except Exception as e:
+        print("Got a fatal exception: %s" % e)
+        raise
+    return retval
+
+
+def runRequest(conn, request, handler, signalHandlers):
+    """ In the forked process: run the handler in the environment of the client, with
+        stdout and stderr going to the client, and send it the exit code. Never returns.
+    """
+    token = str(request['token'])
+    conn.sendall("%s PID %d\n" % (token, os.getpid()))
+    for signum, signalHandler in signalHandlers.items():
+        signal.signal(signum, signalHandler)
+    random.seed()
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(dict((str(key), str(value)) for key, value in request['env'].items()))
+    sys.argv = [sys.argv[0]] + [str(arg) for arg in request['argv']]
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    statusfd = os.dup(conn.fileno())
+    os.dup2(conn.fileno(), 1)
+    os.dup2(conn.fileno(), 2)
+    conn.close()
+    retval = 1
+    try:
+        retval = handler()
+    except SystemExit as ex:
+        retval = ex.code
+    except Exception:
+        traceback.print_exc()
+        retval = 1
+    if retval is None:
+        retval = 0
+    elif not isinstance(retval, (int, long)):
+        print(retval, file=sys.stderr)
+        retval = 1
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.write(statusfd, "\n%s EXIT %d\n" % (token, retval))
+    finally:
+        os._exit(0)
+
+
+def serve(handler, socketName=SOCKET_NAME, idleTimeout=IDLE_TIMEOUT):
+    """ Accept requests on the socket and run the handler for each of them in a
+        forked process, until idleTimeout seconds pass without requests and without
+        running processes. Return immediately if another daemon uses the socket.
+    """
+    lockfd = open(socketName + ".lock", 'a')
+    try:
+        fcntl.flock(lockfd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except IOError:
+        printLog("Another daemon is listening on %s; exiting." % (socketName))
+        lockfd.close()
+        return 0
+    ## The actions install signal handlers at import time (e.g. the post-job cancels
+    ## the ASO transfers on SIGTERM); they are for the forked processes, not for us.
+    signalHandlers = dict((signum, signal.getsignal(signum)) for signum in FORWARDED_SIGNALS)
+    def stop(signum, frame):
+        raise SystemExit("Got signal %d." % (signum))
+    for signum in FORWARDED_SIGNALS:
+        signal.signal(signum, stop)
+    if os.path.exists(socketName):
+        os.unlink(socketName)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socketName)
+    server.listen(128)
+    printLog("Listening on %s (pid %d)." % (socketName, os.getpid()))
+    children = set()
+    lastRequest = time.time()
+    numRequests = 0
+    try:
+        while True:
+            for pid in list(children):
+                try:
+                    if os.waitpid(pid, os.WNOHANG)[0]:
+                        children.discard(pid)
+                except OSError:
+                    children.discard(pid)
+            if not children and time.time() - lastRequest > idleTimeout:
+                printLog("No requests in the last %d seconds; exiting." % (idleTimeout))
+                break
+            try:
+                ready = select.select([server], [], [], 5)[0]
+            except select.error as ex:
+                if ex.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                continue
+            conn = server.accept()[0]
+            lastRequest = time.time()
+            try:
+                request = readRequest(conn)
+            except (socket.error, ValueError) as ex:
+                printLog("Ignoring invalid request: %s" % (ex))
+                conn.close()
+                continue
+            numRequests += 1
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    server.close()
+                    lockfd.close()
+                    runRequest(conn, request, handler, signalHandlers)
+                finally:
+                    os._exit(1)
+            children.add(pid)
+            conn.close()
+    finally:
+        server.close()
+        os.unlink(socketName)
+        lockfd.close()
+        printLog("Served %d requests." % (numRequests))
+    return 0
+
+
+def main():
+    printLog("Starting the task manager daemon in %s." % (os.getcwd()))
+    return serve(runBootstrap)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
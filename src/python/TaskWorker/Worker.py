@@ -1,9 +1,11 @@
 from __future__ import print_function
 import os
+import json
 import time
 import signal
 import urllib
 import logging
+import threading
 import traceback
 import multiprocessing
 from Queue import Empty
@@ -18,6 +20,16 @@ from TaskWorker.WorkerExceptions import WorkerHandlerException
 ## Creating configuration globals to avoid passing these around at every request
 global WORKER_CONFIG
 
+## Seconds between two heartbeats of a slave, and seconds without heartbeats after
+## which a busy slave is considered stuck.
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 6*HEARTBEAT_INTERVAL
+## Default wall-clock limit (seconds) of a work, if not given in the configuration
+## (TaskWorker.actionTimeout, or TaskWorker.actionTimeouts per action name).
+DEFAULT_ACTION_TIMEOUT = 2*60*60
+## Upper edges (seconds) of the bins of the work latency histograms.
+LATENCY_BINS = [10, 30, 60, 300, 900, 3600]
+
 
 def truncateError(msg):
     """Truncate the error message to the first 7400 chars if needed, and add a message if we truncate it.
@@ -31,16 +43,51 @@ def truncateError(msg):
     else:
         return msg
 
-def processWorker(inputs, results, resthost, resturi, procnum):
+def uploadFailure(logger, resthost, resturi, taskname, failstatus, msg):
+    """Set the task status to failstatus and upload the failure message to the REST."""
+    try:
+        logger.info("Uploading error message to REST: %s" % msg)
+        server = HTTPRequests(resthost, WORKER_CONFIG.TaskWorker.cmscert, WORKER_CONFIG.TaskWorker.cmskey, retry = 2)
+        truncMsg = truncateError(msg)
+        configreq = {'workflow': taskname,
+                     'status': failstatus,
+                     'subresource': 'failure',
+                     #limit the message to 7500 chars, which means no more than 10000 once encoded. That's the limit in the REST
+                     'failure': b64encode(truncMsg)}
+        server.post(resturi, data = urllib.urlencode(configreq))
+        logger.info("Error message successfully uploaded to the REST")
+    except HTTPException as hte:
+        logger.warning("Cannot upload failure message to the REST for workflow %s. HTTP headers follows:" % taskname)
+        logger.error(hte.headers)
+    except Exception as exc:
+        logger.warning("Cannot upload failure message to the REST for workflow %s.\nReason: %s" % (taskname, exc))
+        logger.exception('Traceback follows:')
+
+
+def sendHeartbeats(heartbeats, slot):
+    """Body of the heartbeat thread of a slave: write the current time in the slot of
+       the slave in the shared heartbeats array, every HEARTBEAT_INTERVAL seconds."""
+    while True:
+        heartbeats[slot] = time.time()
+        time.sleep(HEARTBEAT_INTERVAL)
+
+
+def processWorker(inputs, results, resthost, resturi, procnum, slaveState):
     """Wait for an reference to appear in the input queue, call the referenced object
        and write the output in the output queue.
 
        :arg Queue inputs: the queue where the inputs are shared by the master
        :arg Queue results: the queue where this method writes the output
+       :arg SlaveState slaveState: the shared memory where the slave tells the master
+                                   what it is doing (slot procnum-1)
        :return: default returning zero, but not really needed."""
     logger = setProcessLogger(str(procnum))
     logger.info("Process %s is starting. PID %s", procnum, os.getpid())
     procName = "Process-%s" % procnum
+    slot = procnum - 1
+    heartbeat = threading.Thread(target=sendHeartbeats, args=(slaveState.heartbeats, slot))
+    heartbeat.daemon = True
+    heartbeat.start()
     while True:
         try:
             ## Get (and remove) an item from the input queue. If the queue is empty, wait
@@ -56,6 +103,8 @@ def processWorker(inputs, results, resthost, resturi, procnum):
 
         outputs = None
         t0 = time.time()
+        slaveState.started[slot] = t0
+        slaveState.current[slot] = workid
         logger.debug("%s: Starting %s on %s" %(procName, str(work), task['tm_taskname']))
         try:
             msg = None
@@ -71,29 +120,16 @@ def processWorker(inputs, results, resthost, resturi, procnum):
             msg += "\n" + str(traceback.format_exc())
         finally:
             if msg:
-                try:
-                    logger.info("Uploading error message to REST: %s" % msg)
-                    server = HTTPRequests(resthost, WORKER_CONFIG.TaskWorker.cmscert, WORKER_CONFIG.TaskWorker.cmskey, retry = 2)
-                    truncMsg = truncateError(msg)
-                    configreq = {'workflow': task['tm_taskname'],
-                                 'status': failstatus,
-                                 'subresource': 'failure',
-                                 #limit the message to 7500 chars, which means no more than 10000 once encoded. That's the limit in the REST
-                                 'failure': b64encode(truncMsg)}
-                    server.post(resturi, data = urllib.urlencode(configreq))
-                    logger.info("Error message successfully uploaded to the REST")
-                except HTTPException as hte:
-                    logger.warning("Cannot upload failure message to the REST for workflow %s. HTTP headers follows:" % task['tm_taskname'])
-                    logger.error(hte.headers)
-                except Exception as exc:
-                    logger.warning("Cannot upload failure message to the REST for workflow %s.\nReason: %s" % (task['tm_taskname'], exc))
-                    logger.exception('Traceback follows:')
+                uploadFailure(logger, resthost, resturi, task['tm_taskname'], failstatus, msg)
         t1 = time.time()
         logger.debug("%s: ...work on %s completed in %d seconds: %s" % (procName, task['tm_taskname'], t1-t0, outputs))
 
+        ## From now on the watchdog must not kill this slave because of this work.
+        slaveState.current[slot] = -1
         results.put({
                      'workid': workid,
-                     'out' : outputs
+                     'out' : outputs,
+                     'duration': t1-t0,
                     })
     logger.debug("Slave %s exiting." % procnum)
     return 0
@@ -112,6 +148,21 @@ def setProcessLogger(name):
     return logger
 
 
+class SlaveState(object):
+    """Shared memory where each slave writes, in its own slot, the id of the work it is
+       processing (-1 if idle), when it started it and its last heartbeat."""
+
+    def __init__(self, nslaves):
+        self.current = multiprocessing.Array('i', [-1]*nslaves)
+        self.started = multiprocessing.Array('d', nslaves)
+        self.heartbeats = multiprocessing.Array('d', nslaves)
+
+    def reset(self, slot):
+        self.current[slot] = -1
+        self.started[slot] = 0
+        self.heartbeats[slot] = time.time()
+
+
 class Worker(object):
     """Worker class providing all the functionalities to manage all the slaves
        and distribute the work"""
@@ -139,6 +190,11 @@ class Worker(object):
         self.working = {}
         self.resthost = resthost
         self.resturi = resturi
+        self.slaveState = SlaveState(self.nworkers)
+        self.actionTimeout = getattr(WORKER_CONFIG.TaskWorker, 'actionTimeout', DEFAULT_ACTION_TIMEOUT)
+        self.actionTimeouts = getattr(WORKER_CONFIG.TaskWorker, 'actionTimeouts', {})
+        self.statsFile = getattr(WORKER_CONFIG.TaskWorker, 'statsFile', 'logs/workerstats.json')
+        self.stats = {'latency': {}, 'timeouts': 0, 'respawns': 0}
 
     def __del__(self):
         """When deleted shutting down all slaves"""
@@ -150,11 +206,16 @@ class Worker(object):
             # Starting things up
             for x in xrange(1, self.nworkers + 1):
                 self.logger.debug("Starting process %i" % x)
-                p = multiprocessing.Process(target = processWorker, args = (self.inputs, self.results, self.resthost, self.resturi, x))
-                p.start()
-                self.pool.append(p)
+                self.pool.append(self.startSlave(x))
         self.logger.info("Started %d slaves"% len(self.pool))
 
+    def startSlave(self, procnum):
+        """Start the slave procnum and return its process"""
+        self.slaveState.reset(procnum - 1)
+        p = multiprocessing.Process(target = processWorker, args = (self.inputs, self.results, self.resthost, self.resturi, procnum, self.slaveState))
+        p.start()
+        return p
+
     def end(self):
         """Stopping all the slaves"""
         self.logger.debug("Ready to close all %i started processes " % len(self.pool))
@@ -183,34 +244,109 @@ class Worker(object):
         for work in items:
             worktype, task, failstatus, arguments = work
             self.inputs.put((workid, worktype, task, failstatus, arguments))
-            self.working[workid] = {'workflow': task['tm_taskname'], 'injected': time.time()}
+            self.working[workid] = {'workflow': task['tm_taskname'], 'injected': time.time(),
+                                    'action': getattr(worktype, '__name__', str(worktype)), 'failstatus': failstatus}
             self.logger.info('Injecting work %d: %s' % (workid, task['tm_taskname']))
             workid += 1
         self.logger.debug("Injection completed.")
 
     def checkFinished(self):
-        """Verifies if there are any finished jobs in the output queue
+        """Verifies if there are any finished jobs in the output queue.
+           Also checks that the slaves are alive and within their time limits,
+           and writes the statistics file.
 
            :return Result: the output of the work completed."""
+        self.checkSlaves()
         if len(self.working.keys()) == 0:
+            self.writeStats()
             return []
         allout = []
         self.logger.info("%d work on going, checking if some has finished" % len(self.working.keys()))
-        for _ in xrange(len(self.working.keys())):
-            out = None
+        while True:
             try:
                 out = self.results.get_nowait()
             except Empty:
-                pass
-            if out is not None:
-                self.logger.debug('Retrieved work %s'% str(out))
-                if isinstance(out['out'], list):
-                    allout.extend(out['out'])
-                else:
-                    allout.append(out['out'])
-                del self.working[out['workid']]
+                break
+            self.logger.debug('Retrieved work %s'% str(out))
+            if isinstance(out['out'], list):
+                allout.extend(out['out'])
+            else:
+                allout.append(out['out'])
+            ## The work is not there if the watchdog gave up on it.
+            work = self.working.pop(out['workid'], None)
+            if work is not None:
+                self.recordLatency(work['action'], out.get('duration', time.time() - work['injected']))
+        self.writeStats()
         return allout
 
+    def checkSlaves(self):
+        """The watchdog: kill and respawn the slaves that died, that stopped sending
+           heartbeats or that are working on the same work for longer than the time
+           limit of its action. The task of that work is marked as failed."""
+        now = time.time()
+        for slot, proc in enumerate(self.pool):
+            workid = self.slaveState.current[slot]
+            work = self.working.get(workid) if workid >= 0 else None
+            reason = None
+            if not proc.is_alive():
+                reason = "the slave process died (exit code %s)" % proc.exitcode
+            elif work is not None:
+                timeout = self.actionTimeouts.get(work['action'], self.actionTimeout)
+                if timeout and now - self.slaveState.started[slot] > timeout:
+                    reason = "the %s action did not finish within %d seconds" % (work['action'], timeout)
+                    self.stats['timeouts'] += 1
+                elif now - self.slaveState.heartbeats[slot] > HEARTBEAT_TIMEOUT:
+                    reason = "the slave did not send heartbeats for %d seconds" % (now - self.slaveState.heartbeats[slot])
+            if reason is None:
+                continue
+            self.logger.error("Respawning slave %d (PID %s): %s" % (slot + 1, proc.pid, reason))
+            elapsed = now - self.slaveState.started[slot]
+            if proc.is_alive():
+                ## The slaves ignore SIGTERM (see __init__).
+                os.kill(proc.pid, signal.SIGKILL)
+            proc.join()
+            self.pool[slot] = self.startSlave(slot + 1)
+            self.stats['respawns'] += 1
+            if work is not None:
+                del self.working[workid]
+                self.recordLatency(work['action'], elapsed)
+                msg = "The CRAB server backend gave up processing the task, because %s." % reason
+                msg += " This could be a temporary problem of an external service (e.g. DBS, PhEDEx or the schedd):"
+                msg += " please try again and contact the experts if the error persists."
+                uploadFailure(self.logger, self.resthost, self.resturi, work['workflow'], work['failstatus'], msg)
+
+    def recordLatency(self, action, duration):
+        """Add the duration of a work to the latency histogram of its action"""
+        histogram = self.stats['latency'].setdefault(action, [0]*(len(LATENCY_BINS) + 1))
+        for binnum, upperedge in enumerate(LATENCY_BINS):
+            if duration <= upperedge:
+                histogram[binnum] += 1
+                break
+        else:
+            histogram[-1] += 1
+
+    def writeStats(self):
+        """Write the status of the slaves and the latency histograms to the statistics file,
+           replacing it atomically"""
+        busy = len([slot for slot in xrange(len(self.pool)) if self.slaveState.current[slot] >= 0])
+        stats = {'time': time.time(),
+                 'slaves': len(self.pool),
+                 'busy_slaves': busy,
+                 'idle_slaves': len(self.pool) - busy,
+                 'queued_works': self.pendingTasks(),
+                 'acquired_works': self.queuedTasks(),
+                 'timeouts': self.stats['timeouts'],
+                 'respawns': self.stats['respawns'],
+                 'latency_bins': LATENCY_BINS + ['inf'],
+                 'latency': self.stats['latency'],
+                }
+        try:
+            with open(self.statsFile + '.tmp', 'w') as fd:
+                json.dump(stats, fd)
+            os.rename(self.statsFile + '.tmp', self.statsFile)
+        except (IOError, OSError) as ex:
+            self.logger.warning("Cannot write the worker statistics to %s: %s" % (self.statsFile, ex))
+
     def freeSlaves(self):
         """Count how many unemployed slaves are there
 
@@ -0,0 +1,199 @@
+"""
+Content addressed store of the sandboxes, shared by all the users, and the
+garbage collector of the cache.
+
+Each sandbox is kept once in cachedir/.blobs/hh/digest, where digest is the
+sha256 of its raw content, and hardlinked in the directory of every user who
+uploads the same bytes, so that a second upload of the same sandbox costs no
+disk space, while it still counts in the quota of the user. The hashkey of the
+sandboxes is not used to name the blobs, since it does not cover all their
+content. The number of links of a blob tells how many users have it: a blob
+with a single link is not used anymore.
+
+Since the links share the inode, touching the file of any user when it is
+accessed updates the time of all of them. collect_garbage() uses those times to
+remove the files (of all the users) not accessed for longer than a maximum age,
+and then the least recently used ones until the cache fits in a maximum size.
+It is meant to be run periodically, e.g.:
+
+    python -m UserFileCache.BlobStore --cachedir=/data/state/crabcache/files --max-age=30
+"""
+
+# CRABServer dependecies here
+from UserFileCache.QuotaLedger import QuotaLedger, is_hidden
+
+# external dependecies here
+import os
+import sys
+import time
+import errno
+
+BLOBS_DIR = '.blobs'
+# unused blobs and leftover temporary files are kept for 1 hour
+ORPHAN_GRACE = 3600
+
+def blob_path(cachedir, digest):
+    """The path of the blob with the sha256 hexdigest `digest` of its content"""
+    return os.path.join(cachedir, BLOBS_DIR, digest[0:2], digest)
+
+def link_blob(blobname, filename):
+    """Hardlink the blob to `filename`. Return False if the blob does not exist
+       (anymore) or can not be linked, e.g. because it reached the maximum number
+       of links."""
+    try:
+        os.makedirs(os.path.dirname(filename))
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+    try:
+        os.link(blobname, filename)
+    except OSError as ex:
+        if ex.errno in [errno.ENOENT, errno.EMLINK, errno.EXDEV, errno.EPERM]:
+            return False
+        raise
+    return True
+
+def replace_with_blob(blobname, filename):
+    """Atomically replace `filename` with a hardlink to the blob, which must have the same
+       content. Return False, leaving `filename` as it is, if the blob can not be linked."""
+    tmpname = os.path.join(os.path.dirname(filename), '.%s.%d.tmp' % (os.path.basename(filename), os.getpid()))
+    _remove(tmpname)
+    if not link_blob(blobname, tmpname):
+        return False
+    os.rename(tmpname, filename)
+    return True
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError as ex:
+        if ex.errno != errno.ENOENT:
+            raise
+
+def _scan_files(topdir, now, inodes, userpath=None, dryrun=False):
+    """Add the files under `topdir` to `inodes` {(device, inode): entry}, where the entry has the
+       time of the last access, the size and the files linked to the inode. Remove the leftover
+       temporary files. Return the number of those."""
+    removed = 0
+    for dirpath, dirnames, filenames in os.walk(topdir):
+        for f in filenames:
+            filename = os.path.join(dirpath, f)
+            try:
+                stat = os.lstat(filename)
+            except OSError:
+                continue
+            if is_hidden(f):
+                if f.endswith('.tmp') and now - stat.st_mtime > ORPHAN_GRACE:
+                    if not dryrun:
+                        _remove(filename)
+                    removed += 1
+                continue
+            entry = inodes.setdefault((stat.st_dev, stat.st_ino), {'atime': stat.st_mtime, 'size': stat.st_size,
+                                                                   'nlink': stat.st_nlink, 'files': [], 'blob': None})
+            if userpath:
+                entry['files'].append((userpath, f, filename))
+            else:
+                entry['blob'] = filename
+    return removed
+
+def collect_garbage(cachedir, maxage, maxsize=None, dryrun=False):
+    """Remove from the cache the files not accessed in the last `maxage` seconds, then the
+       least recently used ones while the cache takes more than `maxsize` bytes, and the blobs
+       not linked by any user. The quota ledgers of the users are updated.
+
+       :arg str cachedir: the base directory of the cache
+       :arg int maxage: maximum time in seconds since the last access to a file
+       :arg int maxsize: maximum total size in bytes of the cache, or None
+       :arg bool dryrun: only return what would be removed
+       :return: dictionary with the number of files and bytes removed."""
+    now = time.time()
+    inodes = {}
+    result = {'files': 0, 'bytes': 0, 'blobs': 0, 'temporary': 0}
+    #file are stored in directories like u/username
+    for name in os.listdir(cachedir):
+        if is_hidden(name) or not os.path.isdir(os.path.join(cachedir, name)):
+            continue
+        for username in os.listdir(os.path.join(cachedir, name)):
+            userpath = os.path.join(cachedir, name, username)
+            if os.path.isdir(userpath):
+                result['temporary'] += _scan_files(userpath, now, inodes, userpath, dryrun)
+    blobsdir = os.path.join(cachedir, BLOBS_DIR)
+    if os.path.isdir(blobsdir):
+        result['temporary'] += _scan_files(blobsdir, now, inodes, dryrun=dryrun)
+
+    expired = []
+    kept = []
+    for entry in inodes.values():
+        if not entry['files']:
+            # a blob without users: removed after the grace period, so that it is not removed
+            # while the file of the user who uploaded it is being linked
+            if entry['nlink'] == 1 and now - entry['atime'] > ORPHAN_GRACE:
+                expired.append(entry)
+        elif now - entry['atime'] > maxage:
+            expired.append(entry)
+        else:
+            kept.append(entry)
+    if maxsize is not None:
+        totalsize = sum(entry['size'] for entry in kept)
+        for entry in sorted(kept, key=lambda entry: entry['atime']):
+            if totalsize <= maxsize:
+                break
+            expired.append(entry)
+            totalsize -= entry['size']
+
+    removedfiles = {}
+    for entry in expired:
+        for userpath, name, filename in entry['files']:
+            if not dryrun:
+                _remove(filename)
+            removedfiles.setdefault(userpath, []).append(name)
+            result['files'] += 1
+        if entry['blob']:
+            if not dryrun:
+                _remove(entry['blob'])
+            result['blobs'] += 1
+        result['bytes'] += entry['size']
+    if not dryrun:
+        for userpath, names in removedfiles.items():
+            QuotaLedger(userpath).remove(*names)
+    return result
+
+def main():
+    from optparse import OptionParser
+
+    usage  = "usage: %prog [options]"
+    parser = OptionParser(usage=usage)
+
+    parser.add_option( "--cachedir",
+                       dest = "cachedir",
+                       default = None,
+                       help = "base directory of the cache" )
+    parser.add_option( "--max-age",
+                       dest = "maxage",
+                       type = "float",
+                       default = 30,
+                       help = "remove the files not accessed in this number of days [default: %default]" )
+    parser.add_option( "--max-size",
+                       dest = "maxsize",
+                       type = "float",
+                       default = None,
+                       help = "then remove the least recently used files while the cache is larger than this number of GB" )
+    parser.add_option( "--dry-run",
+                       action = "store_true",
+                       dest = "dryrun",
+                       default = False,
+                       help = "only print what would be removed" )
+
+    (options, args) = parser.parse_args()
+
+    if not options.cachedir or not os.path.isdir(options.cachedir):
+        parser.error("--cachedir must be an existing directory")
+
+    maxsize = int(options.maxsize * 1024 * 1024 * 1024) if options.maxsize is not None else None
+    result = collect_garbage(options.cachedir, options.maxage * 24 * 3600, maxsize, options.dryrun)
+    print("%s %d user files (%d bytes), %d blobs and %d temporary files" % \
+          ("Would remove" if options.dryrun else "Removed", result['files'], result['bytes'], result['blobs'], result['temporary']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Per user index of the files in the cache, used for the quota checks and the
+user information without walking the user directory at each request.
+
+The index is a small JSON file in the user directory, rewritten atomically
+(temporary file and rename) under a lock at each upload and removal. Since the
+files can also be removed by other means (e.g. the cleanup cron jobs), or the
+server can die between writing a file and updating the index, the index is
+rebuilt from the filesystem when it is missing, unreadable or older than
+RECONCILE_INTERVAL seconds.
+"""
+
+# external dependecies here
+import os
+import json
+import time
+import errno
+import fcntl
+from contextlib import contextmanager
+
+LEDGER_NAME = '.quota.json'
+LOCK_NAME = '.quota.lock'
+# 6 hours - overwritten in RESTBaseAPI if quota_reconcile_interval is set in the config
+RECONCILE_INTERVAL = 6*3600
+
+def is_hidden(filename):
+    """The ledger, its lock and the uploads being spooled are not cached files"""
+    return filename.startswith('.')
+
+class QuotaLedger(object):
+    """The index of the files of the user directory `userpath`: their sizes and modification
+       times, and the total space they take."""
+
+    def __init__(self, userpath):
+        self.userpath = userpath
+        self.ledgerfile = os.path.join(userpath, LEDGER_NAME)
+
+    @contextmanager
+    def locked(self):
+        try:
+            os.makedirs(self.userpath)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        with open(os.path.join(self.userpath, LOCK_NAME), 'a') as lockfd:
+            fcntl.flock(lockfd, fcntl.LOCK_EX)
+            yield
+
+    def scan(self):
+        """Build the ledger from the files in the user directory"""
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.userpath):
+            for f in filenames:
+                if is_hidden(f):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(dirpath, f))
+                except OSError:
+                    # removed while scanning
+                    continue
+                files[f] = [stat.st_size, stat.st_mtime]
+        return {'reconciled': time.time(), 'used': sum(size for size, _ in files.values()), 'files': files}
+
+    def read(self):
+        """Return the ledger saved in the user directory, or None if there is no valid one"""
+        try:
+            with open(self.ledgerfile) as fd:
+                ledger = json.load(fd)
+            ledger['files'] = dict((str(name), entry) for name, entry in ledger['files'].iteritems())
+            if ledger['used'] != sum(size for size, _ in ledger['files'].values()):
+                return None
+            return ledger
+        except (IOError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def write(self, ledger):
+        tmpfile = "%s.%d.tmp" % (self.ledgerfile, os.getpid())
+        with open(tmpfile, 'w') as fd:
+            json.dump(ledger, fd)
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.rename(tmpfile, self.ledgerfile)
+
+    def _load(self):
+        """Same as load, to be called with the lock held"""
+        ledger = self.read()
+        if ledger is None or time.time() - ledger['reconciled'] > RECONCILE_INTERVAL:
+            ledger = self.scan()
+            self.write(ledger)
+        return ledger
+
+    def load(self):
+        """Return the ledger {'reconciled': time of the last scan, 'used': bytes,
+           'files': {filename: [size, mtime]}}, rebuilding it if needed"""
+        if not os.path.isdir(self.userpath):
+            # nothing uploaded yet, no need to create the directory
+            return {'reconciled': time.time(), 'used': 0, 'files': {}}
+        with self.locked():
+            return self._load()
+
+    def used(self):
+        """Bytes taken by the files of the user"""
+        return self.load()['used']
+
+    def update(self, filename, size, mtime=None):
+        """Record that the file `filename` was written (or overwritten) with `size` bytes"""
+        with self.locked():
+            ledger = self._load()
+            oldsize = ledger['files'].get(filename, [0, 0])[0]
+            ledger['files'][filename] = [size, mtime if mtime is not None else time.time()]
+            ledger['used'] += size - oldsize
+            self.write(ledger)
+
+    def remove(self, *filenames):
+        """Record that the files `filenames` were removed"""
+        with self.locked():
+            ledger = self._load()
+            changed = False
+            for filename in filenames:
+                if filename in ledger['files']:
+                    ledger['used'] -= ledger['files'].pop(filename)[0]
+                    changed = True
+            if changed:
+                self.write(ledger)
@@ -5,6 +5,7 @@ from WMCore.REST.Format import JSONFormat
 # CRABServer dependecies here
 from UserFileCache.RESTFile import RESTFile, RESTLogFile, RESTInfo
 import UserFileCache.RESTExtensions
+import UserFileCache.QuotaLedger
 
 # external dependecies here
 import os
@@ -25,6 +26,8 @@ class RESTBaseAPI(RESTApi):
             UserFileCache.RESTExtensions.POWER_USERS_LIST = config.powerusers
         if hasattr(config, 'quota_user_limit'):
             UserFileCache.RESTExtensions.QUOTA_USER_LIMIT = config.quota_user_limit * 1024 * 1024
+        if hasattr(config, 'quota_reconcile_interval'):
+            UserFileCache.QuotaLedger.RECONCILE_INTERVAL = config.quota_reconcile_interval
         self._add( {'logfile': RESTLogFile(app, self, config, mount),
                     'file': RESTFile(app, self, config, mount),
                     'info': RESTInfo(app, self, config, mount)} )
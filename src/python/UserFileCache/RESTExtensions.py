@@ -5,6 +5,7 @@ Collecting all here since aren't supposed to be many.
 """
 
 from ServerUtilities import USER_SANDBOX_EXCLUSIONS
+from UserFileCache.QuotaLedger import QuotaLedger, is_hidden
 
 # WMCore dependecies here
 from WMCore.REST.Validation import _validate_one
@@ -12,10 +13,15 @@ from WMCore.REST.Error import RESTError, InvalidParameter
 from WMCore.Services.UserFileCache.UserFileCache import calculateChecksum
 
 # external dependecies here
+import os
+import errno
 import tarfile
 import hashlib
+import tempfile
 import cStringIO
+import threading
 import cherrypy
+from contextlib import contextmanager
 from os import fstat, walk, path, listdir
 
 # 100MB is the maximum allowed size of a single file
@@ -26,6 +32,15 @@ FILE_MEMORY_LIMIT = 512*1024
 QUOTA_USER_LIMIT = 1024*1024*600
 #these users have 10* basic user quota - overwritten in RESTBaseAPI if powerusers is set in the config
 POWER_USERS_LIST = []
+# size of the chunks read from the uploaded files
+READ_CHUNK_SIZE = 1024*1024
+# uploads are spooled to hidden files named .<name>.<random>.tmp next to their final path
+SPOOL_PREFIX = '.'
+SPOOL_SUFFIX = '.tmp'
+
+# the locks of the files being uploaded, with the number of requests using each of them
+_FILE_LOCKS = {}
+_FILE_LOCKS_GUARD = threading.Lock()
 
 ###### authz_login_valid is currently duplicatint CRABInterface.RESTExtension . A better solution
 ###### should be found for authz_*
@@ -58,14 +73,15 @@ def file_size(argfile):
 def list_users(cachedir):
     #file are stored in directories like u/username
     for name in listdir(cachedir): #iterate over u ...
-        if path.isdir(path.join(cachedir, name)):
+        if not is_hidden(name) and path.isdir(path.join(cachedir, name)): #skip the blob store
             for username in listdir(path.join(cachedir, name)): #list all the users under u
                 yield username
 
 def list_files(quotapath):
     for dirpath, dirnames, filenames in walk(quotapath):
         for f in filenames:
-            yield f
+            if not f.startswith(SPOOL_PREFIX):
+                yield f
 
 def get_size(quotapath):
     """Check the quotapath directory size; it doesn't include the 4096 bytes taken by each directory
@@ -86,7 +102,7 @@ def quota_user_free(quotadir, infile):
     :arg file|cStringIO.StringIO infile: file object handler or cStringIO.StringIO
     :return: Nothing"""
     filesize, realfile = file_size(infile.file)
-    quota = get_size(quotadir)
+    quota = QuotaLedger(quotadir).used()
     quotaLimit = QUOTA_USER_LIMIT*10 if cherrypy.request.user['login'] in POWER_USERS_LIST else QUOTA_USER_LIMIT
     if filesize + quota > quotaLimit:
          excquota = ValueError("User %s has reached quota of %dB: additional file of %dB cannot be uploaded." \
@@ -115,35 +131,131 @@ def _check_file(argname, val):
     return val
 
 
-def _check_tarfile(argname, val, hashkey, newchecksum):
-    """Check that `argname` `val` is a tar file and that provided 'hashkey`
-       matches with the hashkey calculated on the `val`.
+@contextmanager
+def file_lock(filename):
+    """Serialize the requests writing the same file, so that concurrent uploads of the same
+       hashkey are done only once: the following ones find the file already there.
 
-       :arg str argname: name of the argument
-       :arg file val: the file object
-       :arg str hashkey: the sha256 hexdigest of the file, calculated over the tuple
-                         (name, size, mtime, uname) of all the tarball members
-       :return: the val if the validation passes."""
-    # checking that is a valid file or an input string
-    # note: the input string is generated on client side just when the input file is empty
-    _check_file(argname, val)
+       :arg str filename: the final path of the file"""
+    with _FILE_LOCKS_GUARD:
+        entry = _FILE_LOCKS.setdefault(filename, [threading.Lock(), 0])
+        entry[1] += 1
+    entry[0].acquire()
+    try:
+        yield
+    finally:
+        entry[0].release()
+        with _FILE_LOCKS_GUARD:
+            entry[1] -= 1
+            if not entry[1]:
+                del _FILE_LOCKS[filename]
+
+class _TeeReader(object):
+    """File-like object which writes to `outfile` everything read from `infile`"""
+    def __init__(self, infile, outfile):
+        self.infile = infile
+        self.outfile = outfile
+
+    def read(self, size=READ_CHUNK_SIZE):
+        data = self.infile.read(size)
+        self.outfile.write(data)
+        return data
+
+def _spool_tarfile(infile, outfile):
+    """Copy `infile` to `outfile` reading it as a tar stream, and return the sha256 hexdigest
+       of the tuple (name, size, mtime, uname) of all the tarball members.
+       Raise tarfile.TarError if it is not a valid tarball."""
+    tee = _TeeReader(infile, outfile)
+    tar = tarfile.open(fileobj=tee, mode='r|*')
+    # same as hashlib.sha256(str(lsl)) where lsl is the list of tuples, without keeping the list
+    hasher = hashlib.sha256('[')
+    separator = ''
+    for member in tar:
+        hasher.update(separator + repr((member.name, int(member.size), int(member.mtime), member.uname)))
+        separator = ', '
+    hasher.update(']')
+    tar.close()
+    # what follows the end of the archive (padding, compression trailer)
+    while tee.read(READ_CHUNK_SIZE):
+        pass
+    return hasher.hexdigest()
+
+def _spool_file(infile, outfile):
+    """Copy `infile` to `outfile`"""
+    while True:
+        data = infile.read(READ_CHUNK_SIZE)
+        if not data:
+            break
+        outfile.write(data)
+
+class _HashingWriter(object):
+    """File-like object which writes to `outfile` and calculates the sha256 of what is written"""
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.hasher = hashlib.sha256()
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.outfile.write(data)
+
+def store_file(infile, outfilename, hashkey=None, newchecksum=0):
+    """Write the uploaded file to `outfilename` atomically: it is spooled to a temporary file in
+       the same directory, flushed to disk and renamed, so that a partially written file is never
+       served. If `hashkey` is provided the file must be a tarball matching it; the checksum over
+       the members is calculated while spooling, the one over the content (`newchecksum`) from the
+       spooled file, which is then read only once as a tarball.
 
-    digest = None
+       :arg file|cStringIO.StringIO infile: file object handler or cStringIO.StringIO
+       :arg str outfilename: the final path of the file
+       :arg str hashkey: the sha256 hexdigest of the file, calculated over the tuple
+                         (name, size, mtime, uname) of all the tarball members, or over their
+                         names and content if newchecksum is set
+       :return: the size of the file and the sha256 hexdigest of its raw content."""
+    outfilepath = path.dirname(outfilename)
     try:
-        #This newchecksum param and the "else" branch is there for backward compatibility.
-        #We can remove the whole commit at some point in the future
-        if newchecksum:
-            digest = calculateChecksum(val.file, exclude=USER_SANDBOX_EXCLUSIONS)
-        else:
-            tar = tarfile.open(fileobj=val.file, mode='r')
-            lsl = [(x.name, int(x.size), int(x.mtime), x.uname) for x in tar.getmembers()]
-            hasher = hashlib.sha256(str(lsl))
-            digest = hasher.hexdigest()
-    except tarfile.ReadError:
-        raise InvalidParameter('File is not a .tgz file.')
-    if not digest or hashkey != digest:
-        raise ChecksumFailed("Checksums do not match")
-    return val
+        os.makedirs(outfilepath)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+    fd, tmpfilename = tempfile.mkstemp(prefix=SPOOL_PREFIX + path.basename(outfilename) + '.', suffix=SPOOL_SUFFIX, dir=outfilepath)
+    try:
+        os.fchmod(fd, 0644)
+        with os.fdopen(fd, 'wb') as outfile:
+            writer = _HashingWriter(outfile)
+            infile.seek(0)
+            if hashkey and not newchecksum:
+                try:
+                    digest = _spool_tarfile(infile, writer)
+                except tarfile.TarError:
+                    raise InvalidParameter('File is not a .tgz file.')
+            else:
+                _spool_file(infile, writer)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        if hashkey and newchecksum:
+            #This newchecksum param and the other branch are there for backward compatibility.
+            #We can remove the member checksum at some point in the future
+            #calculateChecksum also checks that the spooled file is a tarball
+            try:
+                digest = calculateChecksum(tmpfilename, exclude=USER_SANDBOX_EXCLUSIONS)
+            except (tarfile.TarError, IOError, EOFError):
+                # a truncated compressed stream is only noticed by the gzip/bz2 readers
+                raise InvalidParameter('File is not a .tgz file.')
+        if hashkey and hashkey != digest:
+            raise ChecksumFailed("Checksums do not match")
+        filesize = path.getsize(tmpfilename)
+        os.rename(tmpfilename, outfilename)
+    except:
+        if path.exists(tmpfilename):
+            os.remove(tmpfilename)
+        raise
+    # make the rename durable too
+    dirfd = os.open(outfilepath, os.O_RDONLY)
+    try:
+        os.fsync(dirfd)
+    finally:
+        os.close(dirfd)
+    return filesize, writer.hasher.hexdigest()
 
 class ChecksumFailed(RESTError):
     "Checksum calculation failed, file transfer problem."
@@ -151,19 +263,6 @@ class ChecksumFailed(RESTError):
     app_code = 302
     message = "Input file hashkey mismatch"
 
-def validate_tarfile(argname, param, safe, hashkey, optional=False):
-    """Validates that an argument is a file and matches the hashkey.
-
-    Checks that an argument named `argname` exists in `param.kwargs`
-    and it is a tar file which matches the provided hashkey. If
-    successful the string is copied into `safe.kwargs` and the value
-    is removed from `param.kwargs`.
-
-    If `optional` is True, the argument is not required to exist in
-    `param.kwargs`; None is then inserted into `safe.kwargs`. Otherwise
-    a missing value raises an exception."""
-    _validate_one(argname, param, safe, _check_tarfile, optional, safe.kwargs[hashkey], safe.kwargs['newchecksum'])
-
 def validate_file(argname, param, safe, hashkey, optional=False):
     """Validates that an argument is a file and matches the hashkey.
 
@@ -6,13 +6,14 @@ from WMCore.REST.Error import RESTError, InvalidParameter, MissingObject, Execut
 
 # CRABServer dependecies here
 from UserFileCache.__init__ import __version__
-from UserFileCache.RESTExtensions import ChecksumFailed, validate_file, validate_tarfile, authz_login_valid, authz_operator,\
-                                                         quota_user_free, get_size, list_files, list_users
+from UserFileCache.RESTExtensions import ChecksumFailed, validate_file, authz_login_valid, authz_operator,\
+                                                         quota_user_free, list_users, file_lock, store_file
+from UserFileCache.QuotaLedger import QuotaLedger
+from UserFileCache.BlobStore import blob_path, link_blob, replace_with_blob
 
 # external dependecies here
 import re
 import os
-import shutil
 import tarfile
 import hashlib
 import cherrypy
@@ -46,6 +47,7 @@ class RESTFile(RESTEntity):
         self.config = config
         self.cachedir = config.cachedir
         self.overwriteFile = False
+        self.checkTarfile = True
 
     def validate(self, apiobj, method, api, param, safe):
         """Validating all the input parameter as enforced by the WMCore.REST module"""
@@ -54,7 +56,8 @@ class RESTFile(RESTEntity):
         if method in ['PUT']:
             validate_str("hashkey", param, safe, RX_HASH, optional=False)
             validate_num("newchecksum", param, safe, optional=True)
-            validate_tarfile("inputfile", param, safe, 'hashkey', optional=False)
+            # the tarball and its hashkey are checked in put, while the file is written
+            validate_file("inputfile", param, safe, 'hashkey', optional=False)
         if method in ['GET']:
             validate_str("hashkey", param, safe, RX_HASH, optional=False)
             validate_str("username", param, safe, RX_USERNAME, optional=True)
@@ -80,23 +83,47 @@ class RESTFile(RESTEntity):
         outfilepath = os.path.join(outfilepath, hashkey[0:2])
         outfilename = os.path.join(outfilepath, hashkey)
 
-        if os.path.isfile(outfilename) and not self.overwriteFile:
-            # we do not want to upload again a file that already exists
-           touch(outfilename)
-           result['size'] = os.path.getsize(outfilename)
-        else:
-            # check that the user quota is still below limit
-            quota_user_free(filepath(self.cachedir), inputfile)
-
-            if not os.path.isdir(outfilepath):
-                os.makedirs(outfilepath)
-            handlefile = open(outfilename, 'wb')
-            inputfile.file.seek(0)
-            shutil.copyfileobj(inputfile.file, handlefile)
-            handlefile.close()
-            result['size'] = os.path.getsize(outfilename)
+        # concurrent uploads of the same file wait for the first one, and then find the file
+        with file_lock(outfilename):
+            if os.path.isfile(outfilename) and not self.overwriteFile:
+                # we do not want to upload again a file that already exists
+                touch(outfilename)
+                result['size'] = os.path.getsize(outfilename)
+            else:
+                # check that the user quota is still below limit
+                quota_user_free(filepath(self.cachedir), inputfile)
+
+                if self.checkTarfile:
+                    result['size'] = self.store_sandbox(inputfile.file, outfilename, hashkey, newchecksum)
+                else:
+                    result['size'], _ = store_file(inputfile.file, outfilename)
+                QuotaLedger(filepath(self.cachedir)).update(hashkey, result['size'])
         return [result]
 
+    def store_sandbox(self, infile, outfilename, hashkey, newchecksum):
+        """Write the sandbox to `outfilename`, then share it through the blob store with the
+           other users who uploaded the very same bytes: the blobs are named after the sha256
+           of their raw content, and the file of the user is replaced by a link to the blob
+           with the same name. The hashkey can not be used for that, since it does not cover
+           the whole content (e.g. newchecksum excludes USER_SANDBOX_EXCLUSIONS): a sandbox
+           with the same hashkey can differ in the files of the user. The sandboxes with a
+           legacy hashkey (newchecksum not set) are not deduplicated.
+
+           :return: the size of the file."""
+        filesize, rawdigest = store_file(infile, outfilename, hashkey, newchecksum)
+        if not newchecksum:
+            return filesize
+        blobname = blob_path(self.cachedir, rawdigest)
+        with file_lock(blobname):
+            if os.path.isfile(blobname):
+                replace_with_blob(blobname, outfilename)
+            else:
+                # the file of the user becomes the blob
+                link_blob(outfilename, blobname)
+        # the links share the access time used by the garbage collector
+        touch(outfilename)
+        return filesize
+
     @restcall(formats = [('application/octet-stream', RawFormat())])
     def get(self, hashkey, username):
         """Retrieve a file previously uploaded to the local filesystem.
@@ -123,6 +150,7 @@ class RESTLogFile(RESTFile):
     def __init__(self, app, api, config, mount):
         RESTFile.__init__(self, app, api, config, mount)
         self.overwriteFile = True
+        self.checkTarfile = False
 
     def validate(self, apiobj, method, api, param, safe):
         """Validating all the input parameter as enforced by the WMCore.REST module"""
@@ -226,10 +254,13 @@ class RESTInfo(RESTEntity):
             os.remove(filename)
         except Exception as ex:
             raise ExecutionError("Impossible to remove the file: %s" % str(ex))
+        QuotaLedger(infilepath).remove(hashkey)
 
     @restcall
     def userinfo(self, **kwargs):
-        """Retrieve the user summary information.
+        """Retrieve the user summary information from the quota ledger of the user.
+           The times of the files are the ones of the upload, or of the last reconciliation
+           of the ledger with the filesystem.
 
            :arg str username: username for which the informations are retrieved
 
@@ -238,14 +269,15 @@ class RESTInfo(RESTEntity):
         userpath = filepath(self.cachedir, username)
 
         res = {}
-        files = list_files(userpath)
+        ledger = QuotaLedger(userpath).load()
         if kwargs['verbose']:
             files_dict = {}
-            for file_ in files:
-                files_dict[file_] = self.fileinfo(hashkey=file_, username=username)
+            for file_, (size, mtime) in ledger['files'].iteritems():
+                files_dict[file_] = [{'hashkey': file_, 'exists': True, 'size': size,
+                                      'accessed': mtime, 'changed': mtime, 'modified': mtime}]
 
-        res["file_list"] = files_dict if kwargs['verbose'] else list(files)
-        res["used_space"] = [get_size(userpath)]
+        res["file_list"] = files_dict if kwargs['verbose'] else ledger['files'].keys()
+        res["used_space"] = [ledger['used']]
 
         yield res
 
@@ -255,7 +287,7 @@ class RESTInfo(RESTEntity):
         """Retrieves only the used space of the user"""
         username = kwargs["username"]
         userpath = filepath(self.cachedir, username)
-        yield get_size(userpath)
+        yield QuotaLedger(userpath).used()
 
     @restcall
     def listusers(self, **kwargs):
@@ -0,0 +1,146 @@
+""" Microbenchmark of the adjustment of RunJobs.dag.nodes.log and RunJobs.dag done by AdjustSites at resubmission.
+    Just run (on a schedd, where the htcondor and classad modules are available):
+         "python AdjustSitesBench.py [nevents ...]"
+    (by default 100000 and 500000 POST script events). For each number of events it compares the previous
+    implementation (whole file read in memory, output built by string concatenation and written twice) with
+    adjustPostScriptExitStatus() and adjustMaxRetries(), and checks that both give the same files.
+    Everything is done in a temporary directory.
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+
+## AdjustSites exits at import time if there is no job ad, and redirects stdout unless told not to.
+os.environ.setdefault('_CONDOR_JOB_AD', os.devnull)
+os.environ['TEST_DONT_REDIRECT_STDOUT'] = 'True'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+
+import AdjustSites
+AdjustSites.printLog = lambda msg: None
+
+EVENT = """001 (%(cluster)d.000.000) 01/01 00:00:00 Job executing on host: <127.0.0.1:9618>
+...
+005 (%(cluster)d.000.000) 01/01 00:10:00 Job terminated.
+	(1) Normal termination (return value 0)
+...
+016 (%(cluster)d.000.000) 01/01 00:10:05 POST Script terminated.
+	(1) Normal termination (return value %(retval)d)
+    DAG Node: Job%(jobid)d
+...
+"""
+
+
+def makeFiles(nevents):
+    with open("RunJobs.dag.nodes.log", "w") as fd:
+        for i in range(nevents):
+            fd.write(EVENT % {'cluster': 1000 + i, 'retval': (0, 1, 2)[i % 3], 'jobid': i % (nevents / 2) + 1})
+    with open("RunJobs.dag", "w") as fd:
+        for jobid in range(1, nevents / 2 + 1):
+            fd.write("JOB Job%d Job.submit\n" % jobid)
+            fd.write("RETRY Job%d %d UNLESS-EXIT 2\n" % (jobid, 8 if jobid % 2 else 2))
+
+
+def oldAdjustPostScriptExitStatus(resubmitJobIds):
+    resubmitAllFailed = (resubmitJobIds == True)
+    terminator_re = re.compile(r"^\.\.\.$")
+    event_re = re.compile(r"016 \(-?\d+\.\d+\.\d+\) \d+/\d+ \d+:\d+:\d+ POST Script terminated.")
+    if resubmitAllFailed:
+        retvalue_re = re.compile(r"Normal termination \(return value 2\)")
+    else:
+        retvalue_re = re.compile(r"Normal termination \(return value [0|2]\)")
+    node_re = re.compile(r"DAG Node: Job(\d+)")
+    ra_buffer = []
+    alt = None
+    output = ''
+    adjustedJobIds = []
+    for line in open("RunJobs.dag.nodes.log").readlines():
+        if len(ra_buffer) == 0:
+            if terminator_re.search(line):
+                ra_buffer.append(line)
+            else:
+                output += line
+        elif len(ra_buffer) == 1:
+            if event_re.search(line):
+                ra_buffer.append(line)
+            else:
+                output += ''.join(ra_buffer) + line
+                ra_buffer = []
+        elif len(ra_buffer) == 2:
+            if retvalue_re.search(line):
+                ra_buffer.append("\t(1) Normal termination (return value 1)\n")
+                alt = line
+            else:
+                output += ''.join(ra_buffer) + line
+                ra_buffer = []
+        elif len(ra_buffer) == 3:
+            m = node_re.search(line)
+            if m and (resubmitAllFailed or (m.groups()[0] in resubmitJobIds)):
+                adjustedJobIds.append(m.groups()[0])
+                output += ''.join(ra_buffer)
+            else:
+                output += ''.join(ra_buffer[:-1]) + alt
+            output += line
+            ra_buffer = []
+    output += ''.join(ra_buffer)
+    for name in ["RunJobs.dag.nodes.log.tmp", "RunJobs.dag.nodes.log"]:
+        with open(name, "w") as fd:
+            fd.write(output)
+    os.unlink("RunJobs.dag.nodes.log.tmp")
+    return adjustedJobIds
+
+
+def oldAdjustMaxRetries(adjustJobIds, numAutomJobRetries=2):
+    retry_re = re.compile(r'RETRY Job([0-9]+) ([0-9]+) ')
+    output = ""
+    adjustAll = (adjustJobIds == True)
+    with open("RunJobs.dag", 'r') as fd:
+        for line in fd.readlines():
+            match_retry_re = retry_re.search(line)
+            if match_retry_re:
+                jobId = match_retry_re.groups()[0]
+                if adjustAll or (jobId in adjustJobIds):
+                    maxRetries = int(match_retry_re.groups()[1]) + (1 + numAutomJobRetries)
+                    line = retry_re.sub(r'RETRY Job%s %d ' % (jobId, maxRetries), line)
+            output += line
+    with open("RunJobs.dag", 'w') as fd:
+        fd.write(output)
+
+
+def readFiles():
+    with open("RunJobs.dag.nodes.log") as fd:
+        nodesLog = fd.read()
+    with open("RunJobs.dag") as fd:
+        dag = fd.read()
+    return nodesLog, dag
+
+
+def main():
+    eventCounts = [int(arg) for arg in sys.argv[1:]] or [100000, 500000]
+    origdir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='adjustsites_bench_')
+    try:
+        os.chdir(workdir)
+        for nevents in eventCounts:
+            results = {}
+            for name, adjustExitStatus, adjustRetries in [('old', oldAdjustPostScriptExitStatus, oldAdjustMaxRetries), \
+                                                          ('new', AdjustSites.adjustPostScriptExitStatus, \
+                                                           lambda ids: AdjustSites.adjustMaxRetries(ids, {}))]:
+                makeFiles(nevents)
+                start = time.time()
+                adjustedJobIds = adjustExitStatus(True)
+                adjustRetries(adjustedJobIds)
+                print("%7d events, %s implementation: %.2f seconds" % (nevents, name, time.time() - start))
+                results[name] = (adjustedJobIds, readFiles())
+            if results['old'] != results['new']:
+                print("ERROR: the old and new implementations give different results.")
+    finally:
+        os.chdir(origdir)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
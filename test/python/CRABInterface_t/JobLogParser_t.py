@@ -0,0 +1,313 @@
+"""
+Unit tests of the incremental parsing of the DAG job log (CRABInterface.JobLogParser),
+on a synthetic log of a few nodes. They need the HTCondor python bindings, and the
+tests of HTCondorDataWorkflow.getJobLog also need WMCore and pycurl.
+"""
+import os
+import time
+import shutil
+import logging
+import StringIO
+import tempfile
+import unittest
+
+try:
+    from CRABInterface import JobLogParser as JobLogParserModule
+    from CRABInterface.JobLogParser import JobLogParser, JobLogState, JobLogCheckpoints, completeEventsLength, eventTimeToEpoch
+    IMPORT_ERROR = None
+except ImportError as ex:
+    IMPORT_ERROR = str(ex)
+
+try:
+    import pycurl
+    from CRABInterface.HTCondorDataWorkflow import HTCondorDataWorkflow
+    WORKFLOW_IMPORT_ERROR = IMPORT_ERROR
+except ImportError as ex:
+    WORKFLOW_IMPORT_ERROR = str(ex)
+
+DAGMAN_CLUSTER = 100
+
+SUBMIT = "Job submitted from host: <192.168.0.1:9618>\n    DAG Node: Job%s"
+EXECUTE = "Job executing on host: <192.168.0.2:9618>"
+AD_INFORMATION = "Job ad information event triggered.\nJOBGLIDEIN_CMSSite = \"%s\""
+IMAGE_SIZE = "Image size of job updated: 2000\n\t100  -  MemoryUsage of job (MB)\n\t%d  -  ResidentSetSize of job (KB)"
+USAGE = "\t\tUsr 0 00:%02d:00, Sys 0 00:00:05  -  Run Remote Usage\n\t\tUsr 0 00:00:00, Sys 0 00:00:00  -  Run Local Usage\n"
+TOTAL_USAGE = "\t\tUsr 0 00:%02d:00, Sys 0 00:00:05  -  Total Remote Usage\n\t\tUsr 0 00:00:00, Sys 0 00:00:00  -  Total Local Usage\n"
+BYTES = "\t0  -  Run Bytes Sent By Job\n\t0  -  Run Bytes Received By Job"
+TERMINATED = "Job terminated.\n\t(1) Normal termination (return value %d)\n" + USAGE + TOTAL_USAGE + BYTES + \
+             "\n\t0  -  Total Bytes Sent By Job\n\t0  -  Total Bytes Received By Job"
+EVICTED = "Job was evicted.\n\t(0) Job was not checkpointed.\n" + USAGE + BYTES
+POST_TERMINATED = "POST Script terminated.\n\t(1) Normal termination (return value %d)\n    DAG Node: Job%s"
+HELD = "Job was held.\n\tOver the memory limit\n\tCode 26 Subcode 0"
+RELEASED = "Job was released.\n\tvia condor_release (by user cms)"
+ABORTED = "Job was aborted by the user.\n\tvia condor_rm (by user cms)"
+DISCONNECTED = "Job disconnected, attempting to reconnect\n    Socket between submit and execute hosts closed unexpectedly\n" \
+               "    Trying to reconnect to slot1 <192.168.0.2:9618>"
+GENERIC = "Not a job event"
+
+
+def event(code, cluster, minutes, text):
+    """ An event of the job log in the classic format, minutes after 10:00. """
+    return "%03d (%03d.000.000) 2017-03-01T%02d:%02d:00 %s\n...\n" % (code, cluster, 10 + minutes / 60, minutes % 60, text)
+
+## Node 1 succeeds, node 2 is evicted, held and finally fails, node 3 is killed and node 4 is still running.
+EVENTS = [event(0, 101, 0, SUBMIT % 1),
+          event(0, 102, 0, SUBMIT % 2),
+          event(0, 103, 0, SUBMIT % 3),
+          event(1, 101, 1, EXECUTE),
+          event(1, 102, 1, EXECUTE),
+          event(28, 101, 2, AD_INFORMATION % "T2_XX_Site"),
+          event(28, 102, 2, AD_INFORMATION % "T2_YY_Site"),
+          event(9, 103, 5, ABORTED),
+          event(8, DAGMAN_CLUSTER, 10, GENERIC),
+          event(4, 102, 20, EVICTED % 19),
+          event(6, 101, 30, IMAGE_SIZE % 102400),
+          event(1, 102, 31, EXECUTE),
+          event(28, 102, 32, AD_INFORMATION % "T2_ZZ_Site"),
+          event(12, 102, 40, HELD),
+          event(13, 102, 45, RELEASED),
+          event(0, 104, 50, SUBMIT % 4),
+          event(5, 101, 60, TERMINATED % (0, 59, 59)),
+          event(16, DAGMAN_CLUSTER, 61, POST_TERMINATED % (0, 1)),
+          event(1, 102, 62, EXECUTE),
+          event(22, 102, 63, DISCONNECTED),
+          event(6, 102, 70, IMAGE_SIZE % 204800),
+          event(5, 102, 80, TERMINATED % (1, 18, 18)),
+          event(16, DAGMAN_CLUSTER, 81, POST_TERMINATED % (2, 2)),
+          event(1, 104, 85, EXECUTE),
+         ]
+JOB_LOG = "".join(EVENTS)
+
+
+def makeFile(content):
+    ## htcondor.read_events needs a real file
+    fp = tempfile.TemporaryFile()
+    fp.write(content)
+    fp.seek(0)
+    return fp
+
+
+def stateTuple(state):
+    return state.offset, state.count, state.nodeMap, state.nodes
+
+
+@unittest.skipIf(IMPORT_ERROR, "HTCondor bindings not available: %s" % IMPORT_ERROR)
+class JobLogParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = JobLogParser(logging.getLogger(__name__))
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def fullParse(self, content=JOB_LOG):
+        state = JobLogState()
+        self.parser.parse(makeFile(content), state)
+        state.offset = len(content)
+        return state
+
+    def parseNew(self, checkpoints, url, content):
+        """ What getJobLog does with the bytes appended to the log since the last checkpoint. """
+        state = checkpoints.get(url)
+        fp = makeFile(content[state.offset:])
+        complete = completeEventsLength(fp)
+        fp.truncate(complete)
+        fp.seek(0)
+        if complete:
+            self.parser.parse(fp, state)
+            state.offset += complete
+            checkpoints.save(url, state)
+
+    def testNodeStates(self):
+        state = self.fullParse()
+        self.assertEqual(state.count, len(EVENTS))
+        self.assertEqual(dict((node, info['State']) for node, info in state.nodes.items()),
+                         {'1': 'finished', '2': 'failed', '3': 'killed', '4': 'running'})
+        self.assertEqual(state.nodes['1']['SiteHistory'], ['T2_XX_Site'])
+        self.assertEqual(state.nodes['1']['ResidentSetSize'], [102400])
+        self.assertEqual(state.nodes['1']['TotalUserCpuTimeHistory'], [59*60])
+        self.assertEqual(state.nodes['1']['WallDurations'], [59*60])
+        ## evicted, then held
+        self.assertEqual(state.nodes['2']['Restarts'], 2)
+        self.assertEqual(state.nodes['2']['SiteHistory'], ['T2_YY_Site', 'T2_ZZ_Site'])
+        self.assertEqual(state.nodes['2']['JobIds'], ['102.0'] * 3)
+        self.assertEqual(state.nodes['3']['SiteHistory'], ['Unknown'])
+        self.assertEqual(state.nodeMap[104, 0], '4')
+
+    def testHandlers(self):
+        for eventtype, handler in self.parser.handlers.items():
+            if handler is not None:
+                self.assertTrue(handler.im_self is self.parser, eventtype)
+        ## the generic event has no handler: it is counted, and skipped with a warning
+        self.assertFalse('GenericEvent' in self.parser.handlers)
+        state = JobLogState()
+        self.assertEqual(self.parser.parse(makeFile(EVENTS[0] + EVENTS[8]), state), 2)
+        self.assertEqual(state.nodes.keys(), ['1'])
+
+    def testEventTimeToEpoch(self):
+        savedtz = os.environ.get('TZ')
+        mktime = time.mktime
+        calls = []
+        def countingMktime(t):
+            calls.append(t)
+            return mktime(t)
+        ## the cached hour starts are in local time
+        os.environ['TZ'] = 'Europe/Zurich'
+        time.tzset()
+        JobLogParserModule._hourCache.clear()
+        time.mktime = countingMktime
+        try:
+            ## including the daylight saving time changes
+            eventtimes = ['2017-03-01T10:%02d:%02d' % (m, s) for m in range(0, 60, 7) for s in range(0, 60, 13)] + \
+                         ['2017-03-26T01:59:59', '2017-03-26T03:00:00', '2017-10-29T01:59:59', '2017-10-29T03:00:00',
+                          '2017-12-31T23:59:59', '2018-01-01T00:00:00']
+            for eventtime in eventtimes:
+                self.assertEqual(eventTimeToEpoch(eventtime), mktime(time.strptime(eventtime, "%Y-%m-%dT%H:%M:%S")), eventtime)
+            ## one conversion per hour
+            self.assertEqual(len(calls), 7)
+        finally:
+            time.mktime = mktime
+            if savedtz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = savedtz
+            time.tzset()
+            JobLogParserModule._hourCache.clear()
+
+    def testIncrementalParse(self):
+        full = stateTuple(self.fullParse())
+        boundaries = [len("".join(EVENTS[:i])) for i in range(1, len(EVENTS))]
+        ## at an event boundary, in the middle of an event and in the middle of its terminator
+        cuts = sorted(set(boundaries + [b + 30 for b in boundaries] + [b - 2 for b in boundaries]))
+        for cut in cuts:
+            url = 'https://schedd.example.com/%d/jobs_log.txt' % cut
+            self.parseNew(JobLogCheckpoints(cachedir=self.cachedir), url, JOB_LOG[:cut])
+            ## the checkpoint is read back from the cache directory by another process
+            self.parseNew(JobLogCheckpoints(cachedir=self.cachedir), url, JOB_LOG)
+            self.assertEqual(stateTuple(JobLogCheckpoints(cachedir=self.cachedir).get(url)), full, cut)
+        ## the log parsed a little more at every request
+        checkpoints = JobLogCheckpoints(maxinmemory=1)
+        for cut in cuts + [len(JOB_LOG)]:
+            self.parseNew(checkpoints, 'jobs_log.txt', JOB_LOG[:cut])
+        self.assertEqual(stateTuple(checkpoints.get('jobs_log.txt')), full)
+
+    def testCheckpointCopies(self):
+        checkpoints = JobLogCheckpoints(maxinmemory=2)
+        self.assertEqual(stateTuple(checkpoints.get('a')), stateTuple(JobLogState()))
+        state = self.fullParse()
+        checkpoints.save('a', state)
+        copy = checkpoints.get('a')
+        self.assertFalse(copy is state)
+        copy.nodes['1']['State'] = 'changed'
+        self.assertEqual(checkpoints.get('a').nodes['1']['State'], 'finished')
+        ## only the most recently used ones are kept in memory
+        checkpoints.save('b', JobLogState())
+        checkpoints.get('a')
+        checkpoints.save('c', JobLogState())
+        self.assertEqual(checkpoints.checkpoints.keys(), ['a', 'c'])
+
+    def testTruncatedLastEvent(self):
+        truncated = JOB_LOG + EVENTS[1][:40]
+        ## from the smallest chunk that can hold a terminator
+        for chunksize in range(len(JobLogParserModule.EVENT_TERMINATOR), 50) + [65536]:
+            self.assertEqual(completeEventsLength(makeFile(truncated), chunksize), len(JOB_LOG), chunksize)
+            ## the terminator of the last event is incomplete
+            self.assertEqual(completeEventsLength(makeFile(JOB_LOG[:-1]), chunksize), len(JOB_LOG) - len(EVENTS[-1]), chunksize)
+        self.assertEqual(completeEventsLength(makeFile(EVENTS[0][:-5])), 0)
+        self.assertEqual(completeEventsLength(makeFile("")), 0)
+        ## the truncated event is not parsed, but at the next request
+        checkpoints = JobLogCheckpoints()
+        self.parseNew(checkpoints, 'jobs_log.txt', truncated)
+        self.assertEqual(stateTuple(checkpoints.get('jobs_log.txt')), stateTuple(self.fullParse()))
+        self.parseNew(checkpoints, 'jobs_log.txt', truncated + EVENTS[1][40:])
+        self.assertEqual(stateTuple(checkpoints.get('jobs_log.txt')), stateTuple(self.fullParse(truncated + EVENTS[1][40:])))
+
+
+class FakeScheddCurl(object):
+    """ Stands for the curl handle downloading the job log from the schedd web server. """
+    def __init__(self, content):
+        self.content = content
+        self.ignoreRange = False
+        self.options = {}
+        self.ranges = []
+
+    def setopt(self, option, value):
+        self.options[option] = value
+
+    def unsetopt(self, option):
+        del self.options[option]
+
+    def perform(self):
+        requested = self.options.get(pycurl.RANGE)
+        self.ranges.append(requested)
+        size = len(self.content)
+        if requested is None or self.ignoreRange:
+            status, headers, body = "200 OK", [], self.content
+        elif int(requested.rstrip('-')) < size:
+            start = int(requested.rstrip('-'))
+            status, headers, body = "206 Partial Content", ["Content-Range: bytes %d-%d/%d" % (start, size - 1, size)], self.content[start:]
+        else:
+            status, headers, body = "416 Requested Range Not Satisfiable", ["Content-Range: bytes */%d" % size], ""
+        self.options[pycurl.HEADERFUNCTION]("\r\n".join(["HTTP/1.1 " + status] + headers) + "\r\n\r\n")
+        self.options[pycurl.WRITEFUNCTION](body)
+
+
+@unittest.skipIf(WORKFLOW_IMPORT_ERROR, "HTCondorDataWorkflow can not be imported: %s" % WORKFLOW_IMPORT_ERROR)
+class GetJobLogTest(unittest.TestCase):
+
+    URL = 'https://schedd.example.com/user/task/jobs_log.txt'
+
+    def setUp(self):
+        self.workflow = HTCondorDataWorkflow.__new__(HTCondorDataWorkflow)
+        self.workflow.logger = logging.getLogger(__name__)
+        self.workflow.jobLogParser = JobLogParser(self.workflow.logger)
+        self.workflow.jobLogCheckpoints = JobLogCheckpoints()
+
+    def getJobLog(self, curl):
+        fp = tempfile.TemporaryFile()
+        hbuf = StringIO.StringIO()
+        curl.setopt(pycurl.WRITEFUNCTION, fp.write)
+        curl.setopt(pycurl.HEADERFUNCTION, hbuf.write)
+        nodes = {}
+        self.workflow.getJobLog(curl, fp, hbuf, self.URL, nodes)
+        self.assertFalse(pycurl.RANGE in curl.options)
+        return nodes
+
+    def assertParsed(self, content):
+        expected = JobLogState()
+        self.workflow.jobLogParser.parse(makeFile(content), expected)
+        expected.offset = len(content)
+        self.assertEqual(stateTuple(self.workflow.jobLogCheckpoints.get(self.URL)), stateTuple(expected))
+
+    def testRanges(self):
+        half = len("".join(EVENTS[:12]))
+        curl = FakeScheddCurl(JOB_LOG[:half + 30])
+        nodes = self.getJobLog(curl)
+        self.assertEqual(sorted(nodes), ['1', '2', '3'])
+        self.assertParsed(JOB_LOG[:half])
+        ## 206: only the rest of the log is downloaded
+        curl.content = JOB_LOG
+        nodes = self.getJobLog(curl)
+        self.assertEqual(sorted(nodes), ['1', '2', '3', '4'])
+        self.assertEqual(nodes['2']['State'], 'failed')
+        self.assertParsed(JOB_LOG)
+        ## 416: nothing new
+        self.assertEqual(sorted(self.getJobLog(curl)), ['1', '2', '3', '4'])
+        self.assertParsed(JOB_LOG)
+        self.assertEqual(curl.ranges, [None, "%d-" % half, "%d-" % len(JOB_LOG)])
+        ## 200: the server does not support ranges, the log is parsed from scratch
+        curl.ignoreRange = True
+        self.getJobLog(curl)
+        self.assertParsed(JOB_LOG)
+        ## 416 for another size: the log is not the one of the checkpoint anymore
+        curl.ignoreRange = False
+        curl.content = "".join(EVENTS[:3])
+        curl.ranges = []
+        self.assertEqual(sorted(self.getJobLog(curl)), ['1', '2', '3'])
+        self.assertParsed(curl.content)
+        self.assertEqual(curl.ranges, ["%d-" % len(JOB_LOG), None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+""" Microbenchmark of the matching of the files of a secondary dataset in DBSDataDiscovery. Just run:
+         "python DBSDataDiscoveryBench.py [nfiles ...]"
+    (by default 1000 and 10000 files in both the primary and the secondary dataset). For each number of files
+    it compares the previous implementation (intersection of the LumiList of every primary file with the LumiList
+    of every secondary file) with matchSecondaryFiles(), and checks that both find the same parents. The previous
+    implementation grows as N*M, so it is only run for up to OLD_MAX_FILES files; above, its time is extrapolated
+    as N*M from the largest number of files it was run with.
+"""
+
+import sys
+import time
+
+from WMCore.DataStructs.LumiList import LumiList
+from TaskWorker.Actions.DBSDataDiscovery import matchSecondaryFiles
+
+OLD_MAX_FILES = 2000
+LUMIS_PER_FILE = 20
+
+
+def makeFileDetails(nfiles, prefix, lumisPerFile):
+    """ Files of consecutive lumis in runs of 1000 lumis each. """
+    filedetails = {}
+    for i in range(nfiles):
+        first = i * lumisPerFile
+        lumis = {}
+        for lumi in range(first, first + lumisPerFile):
+            lumis.setdefault(str(100000 + lumi / 1000), []).append(lumi % 1000 + 1)
+        filedetails['/store/%s/file%d.root' % (prefix, i)] = {'Lumis': lumis}
+    return filedetails
+
+
+def oldMatchSecondaryFiles(filedetails, moredetails):
+    for secinfos in moredetails.values():
+        secinfos['lumiobj'] = LumiList(runsAndLumis=secinfos['Lumis'])
+    for infos in filedetails.values():
+        infos['Parents'] = []
+        lumis = LumiList(runsAndLumis=infos['Lumis'])
+        for secfilename, secinfos in moredetails.items():
+            if len(lumis & secinfos['lumiobj']) > 0:
+                infos['Parents'].append(secfilename)
+
+
+def timeOldMatchSecondaryFiles(nfiles):
+    """ Time of the old implementation with nfiles in both datasets. """
+    filedetails = makeFileDetails(nfiles, 'primary', LUMIS_PER_FILE)
+    moredetails = makeFileDetails(nfiles, 'secondary', LUMIS_PER_FILE / 2)
+    start = time.time()
+    oldMatchSecondaryFiles(filedetails, moredetails)
+    return time.time() - start
+
+
+def main():
+    fileCounts = sorted(int(arg) for arg in sys.argv[1:]) or [1000, 10000]
+    ## (number of files, seconds) of the largest run of the old implementation
+    oldReference = None
+    for nfiles in fileCounts:
+        ## The secondary files have half the lumis, so each primary file has two or three parents.
+        filedetails = makeFileDetails(nfiles, 'primary', LUMIS_PER_FILE)
+        moredetails = makeFileDetails(nfiles, 'secondary', LUMIS_PER_FILE / 2)
+        start = time.time()
+        matchSecondaryFiles(filedetails, moredetails)
+        print("%6d x %6d files, new implementation: %.2f seconds" % (nfiles, nfiles, time.time() - start))
+        newParents = dict((name, set(infos['Parents'])) for name, infos in filedetails.items())
+        if nfiles > OLD_MAX_FILES:
+            if oldReference is None:
+                oldReference = (OLD_MAX_FILES, timeOldMatchSecondaryFiles(OLD_MAX_FILES))
+            refFiles, refSeconds = oldReference
+            estimate = refSeconds * (float(nfiles) * nfiles) / (refFiles * refFiles)
+            print("%6d x %6d files, old implementation: ~%.2f seconds (extrapolated as N*M from %d x %d files)" % \
+                  (nfiles, nfiles, estimate, refFiles, refFiles))
+            continue
+        start = time.time()
+        oldMatchSecondaryFiles(filedetails, moredetails)
+        oldReference = (nfiles, time.time() - start)
+        print("%6d x %6d files, old implementation: %.2f seconds" % (nfiles, nfiles, oldReference[1]))
+        oldParents = dict((name, set(infos['Parents'])) for name, infos in filedetails.items())
+        if oldParents != newParents:
+            print("ERROR: the old and new implementations find different parents.")
+
+
+if __name__ == '__main__':
+    main()
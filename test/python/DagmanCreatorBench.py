@@ -0,0 +1,98 @@
+""" Microbenchmark of the writing of the DAG and of the per-job tarballs in DagmanCreator. Just run:
+         "python DagmanCreatorBench.py [njobs ...]"
+    (by default 1000, 10000 and 50000 synthetic jobs). For each number of jobs it compares the
+    previous implementation (one temporary file per job and per tarball, DAG built by string
+    concatenation) with createJobTarballs() and writeDag(). Everything is done in a temporary directory.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tarfile
+import tempfile
+
+from TaskWorker.Actions.DagmanCreator import DAG_HEADER, DAG_FRAGMENT, createJobTarballs, writeDag
+
+
+def makeDagSpecs(njobs):
+    dagSpecs = []
+    for i in range(1, njobs+1):
+        lfns = ['/store/data/Run2015D/SingleMuon/MINIAOD/PromptReco-v4/000/258/159/00000/%08X-%04d.root' % (i, j) for j in range(5)]
+        dagSpecs.append({'count': i,
+                         'maxretries': 2,
+                         'taskname': '160101_000000:user_crab_bench',
+                         'backend': 'bench',
+                         'tempDest': '/store/temp/user/bench/%04d' % (i / 1000),
+                         'outputDest': '/store/user/bench/%04d' % (i / 1000),
+                         'remoteOutputFiles': 'output_%d.root' % i,
+                         'runAndLumiMask': json.dumps({'258159': [[i, i+10], [i+20, i+30]]}),
+                         'inputFiles': json.dumps(lfns),
+                         'localOutputFiles': 'output.root=output_%d.root' % i,
+                         'asyncDest': 'T2_CH_CERN',
+                         'firstEvent': 'None',
+                         'lastEvent': 'None',
+                         'firstLumi': 'None',
+                         'firstRun': 'None',
+                         'seeding': 'AutomaticSeeding',
+                         'lheInputFiles': False,
+                         'eventsPerLumi': None,
+                         'sw': 'CMSSW_7_4_7',
+                         'block': '/SingleMuon/Run2015D-PromptReco-v4/MINIAOD#bench',
+                         'destination': 'srm://bench/output_%d.root' % i,
+                         'scriptExe': None,
+                         'scriptArgs': '[]',
+                        })
+    return dagSpecs
+
+
+def oldImplementation(dagHeader, dagSpecs):
+    dag = dagHeader
+    for dagSpec in dagSpecs:
+        dag += DAG_FRAGMENT % dagSpec
+    run_and_lumis_tar = tarfile.open("run_and_lumis.tar.gz", "w:gz")
+    input_files_tar = tarfile.open("input_files.tar.gz", "w:gz")
+    for dagSpec in dagSpecs:
+        job_lumis_file = 'job_lumis_'+ str(dagSpec['count']) +'.json'
+        job_input_file_list = 'job_input_file_list_' + str(dagSpec['count']) + '.txt'
+        with open(job_lumis_file, "w") as fd:
+            fd.write(str(dagSpec['runAndLumiMask']))
+        with open(job_input_file_list, "w") as fd:
+            fd.write(str(dagSpec['inputFiles']))
+        run_and_lumis_tar.add(job_lumis_file)
+        input_files_tar.add(job_input_file_list)
+        os.remove(job_lumis_file)
+        os.remove(job_input_file_list)
+    run_and_lumis_tar.close()
+    input_files_tar.close()
+    with open("RunJobs.dag", "w") as fd:
+        fd.write(dag)
+
+
+def newImplementation(dagHeader, dagSpecs):
+    createJobTarballs(dagSpecs)
+    with open("RunJobs.dag", "w") as fd:
+        writeDag(fd, dagHeader, dagSpecs)
+
+
+def main():
+    jobCounts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    dagHeader = DAG_HEADER % {'resthost': 'bench', 'resturiwfdb': '/crabserver/bench/workflowdb'}
+    origdir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='dagmancreator_bench_')
+    try:
+        os.chdir(workdir)
+        for njobs in jobCounts:
+            dagSpecs = makeDagSpecs(njobs)
+            for name, implementation in [('old', oldImplementation), ('new', newImplementation)]:
+                start = time.time()
+                implementation(dagHeader, dagSpecs)
+                print("%6d jobs, %s implementation: %.2f seconds" % (njobs, name, time.time() - start))
+    finally:
+        os.chdir(origdir)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Unit tests of the LFN to PFN resolution of PFNResolver, with a fake PhEDEx
+service counting the requests.
+"""
+import unittest
+
+import PFNResolver as PFNResolverModule
+from PFNResolver import PFNResolver, PFNRuleCache, getLFNPrefix, PHEDEX_CHUNK_SIZE
+
+NODE = 'T2_XX_Site'
+
+
+class FakePhEDEx(object):
+    """ Stands for WMCore.Services.PhEDEx: maps the LFNs with the trivial file catalog `tfc`. """
+    def __init__(self, tfc):
+        self.tfc = tfc
+        self.requests = []
+
+    def getPFN(self, nodes, lfns, protocol):
+        self.requests.append(list(lfns))
+        result = {}
+        for node in nodes:
+            for lfn in lfns:
+                pfn = self.tfc(lfn)
+                if pfn:
+                    result[node, lfn] = pfn
+        return result
+
+
+def simpleTFC(lfn):
+    return 'srm://se.example.com:8443/srm/managerv2?SFN=/pnfs/example.com/data/cms' + lfn
+
+def rewritingTFC(lfn):
+    """ A PFN that is not a prefix plus the LFN: the rule can not be derived. """
+    return 'srm://se.example.com/' + lfn.replace('/store/', '/cms/store_')
+
+def userLFNs(username, number):
+    return ['/store/user/%s/dataset/output_%d.root' % (username, i) for i in range(number)]
+
+
+class PFNResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PFNRuleCache()
+
+    def testOneRequestPerPrefix(self):
+        phedex = FakePhEDEx(simpleTFC)
+        lfns = userLFNs('alice', 1000) + userLFNs('bob', 1000) + userLFNs('carol', 1000)
+        pfns = PFNResolver(phedex, cache=self.cache).getPFNs(NODE, lfns)
+        self.assertEqual(pfns, dict((lfn, simpleTFC(lfn)) for lfn in lfns))
+        ## instead of 3000 single file requests, one request with a sample LFN per prefix
+        self.assertEqual(len(phedex.requests), 1)
+        self.assertEqual(sorted(getLFNPrefix(lfn) for lfn in phedex.requests[0]), \
+                         ['/store/user/alice', '/store/user/bob', '/store/user/carol'])
+        ## the rules are cached
+        more = userLFNs('alice', 1500)
+        self.assertEqual(PFNResolver(phedex, cache=self.cache).getPFNs(NODE, more), dict((lfn, simpleTFC(lfn)) for lfn in more))
+        self.assertEqual(len(phedex.requests), 1)
+
+    def testNoRule(self):
+        phedex = FakePhEDEx(rewritingTFC)
+        lfns = userLFNs('alice', 2*PHEDEX_CHUNK_SIZE + 10)
+        pfns = PFNResolver(phedex, cache=self.cache).getPFNs(NODE, lfns)
+        self.assertEqual(pfns, dict((lfn, rewritingTFC(lfn)) for lfn in lfns))
+        ## the sample, then the others in bounded chunks
+        self.assertEqual([len(request) for request in phedex.requests], [1, PHEDEX_CHUNK_SIZE, PHEDEX_CHUNK_SIZE, 9])
+        ## the prefix is known to have no rule: no sample request anymore
+        phedex.requests = []
+        PFNResolver(phedex, cache=self.cache).getPFNs(NODE, lfns[:10])
+        self.assertEqual([len(request) for request in phedex.requests], [10])
+
+    def testUnmappedLFNs(self):
+        phedex = FakePhEDEx(lambda lfn: simpleTFC(lfn) if 'alice' in lfn else None)
+        lfns = userLFNs('alice', 5) + userLFNs('bob', 5)
+        pfns = PFNResolver(phedex, cache=self.cache).getPFNs(NODE, lfns)
+        self.assertEqual(sorted(pfns), sorted(userLFNs('alice', 5)))
+        ## the sample of bob, then the other LFNs of bob
+        self.assertEqual([len(request) for request in phedex.requests], [2, 4])
+        self.assertEqual(PFNResolver(phedex, cache=self.cache).getPFN(NODE, userLFNs('bob', 1)[0]), None)
+
+    def testExpiredRules(self):
+        phedex = FakePhEDEx(simpleTFC)
+        cache = PFNRuleCache(ttl=-1)
+        PFNResolver(phedex, cache=cache).getPFNs(NODE, userLFNs('alice', 10))
+        PFNResolver(phedex, cache=cache).getPFNs(NODE, userLFNs('alice', 10))
+        self.assertEqual(len(phedex.requests), 2)
+
+    def testSharedCache(self):
+        phedex = FakePhEDEx(simpleTFC)
+        self.assertTrue(PFNResolver(phedex).cache is PFNResolverModule.RULE_CACHE)
+
+
+if __name__ == '__main__':
+    unittest.main()
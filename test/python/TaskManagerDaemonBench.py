@@ -0,0 +1,93 @@
+""" Microbenchmark of the node scripts run through the task manager daemon. Just run (on a schedd, where the
+    htcondor and classad modules are available and CRAB3.zip is in the PYTHONPATH):
+         "python TaskManagerDaemonBench.py [ncalls]"
+    (by default 1000 calls). It compares the time and the CPU used by ncalls simulated post-job calls run as
+    before (a new interpreter importing TaskManagerBootstrap and the post-job for each call) with ncalls
+    calls of TaskManagerClient to a daemon whose handler does the same (no) work. The daemon runs as a child
+    of this script, so that the CPU used by the processes it forks is accounted for. Everything is done in a
+    temporary directory.
+"""
+
+import os
+import sys
+import time
+import signal
+import shutil
+import resource
+import tempfile
+import subprocess
+
+from TaskWorker import TaskManagerDaemon
+from TaskWorker.TaskManagerClient import SOCKET_NAME
+
+
+def simulatedPostJob():
+    """ The handler of the daemon: the post-job work is not part of the benchmark. """
+    return 0
+
+
+def childrenCPU():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def timeCalls(name, ncalls, command):
+    start, startCPU = time.time(), childrenCPU()
+    for _ in range(ncalls):
+        if subprocess.call(command) != 0:
+            print("ERROR: %s call failed." % (name))
+            return
+    return time.time() - start, childrenCPU() - startCPU
+
+
+def report(name, ncalls, wallTime, cpuTime):
+    print("%6d calls, %s: %.2f seconds (%.1f ms per call), %.1f ms of CPU per call" % \
+          (ncalls, name, wallTime, 1000. * wallTime / ncalls, 1000. * cpuTime / ncalls))
+
+
+def main():
+    ncalls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    origdir = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix='taskmanager_bench_')
+    daemon = None
+    try:
+        os.chdir(workdir)
+        oldCommand = [sys.executable, '-c', 'import TaskWorker.TaskManagerBootstrap, TaskWorker.Actions.PostJob']
+        result = timeCalls('old', ncalls, oldCommand)
+        if not result:
+            return
+        wallTime, cpuTime = result
+        report('in-process bootstrap', ncalls, wallTime, cpuTime)
+
+        start, startCPU = time.time(), childrenCPU()
+        daemon = os.fork()
+        if daemon == 0:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, 1)
+            try:
+                TaskManagerDaemon.serve(simulatedPostJob)
+            finally:
+                os._exit(0)
+        while not os.path.exists(SOCKET_NAME):
+            time.sleep(0.01)
+        with open(os.devnull, 'w') as devnull:
+            newCommand = [sys.executable, '-m', 'TaskWorker.TaskManagerClient', 'POSTJOB']
+            for _ in range(ncalls):
+                if subprocess.call(newCommand, stdout=devnull) != 0:
+                    print("ERROR: daemon call failed.")
+                    return
+        wallTime = time.time() - start
+        os.kill(daemon, signal.SIGTERM)
+        os.waitpid(daemon, 0)
+        daemon = None
+        report('task manager daemon', ncalls, wallTime, childrenCPU() - startCPU)
+    finally:
+        if daemon:
+            os.kill(daemon, signal.SIGTERM)
+            os.waitpid(daemon, 0)
+        os.chdir(origdir)
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Unit tests of the proxy renewal pass of RenewRemoteProxies, with fake MyProxy
+and schedd classes. They need the HTCondor python bindings and WMCore.
+"""
+import time
+import logging
+import threading
+import unittest
+
+try:
+    import classad
+    from WMCore.Configuration import Configuration
+    import TaskWorker.Actions.Recurring.RenewRemoteProxies as RenewRemoteProxies
+    IMPORT_ERROR = None
+except ImportError as ex:
+    IMPORT_ERROR = str(ex)
+
+USER = ('/DC=ch/CN=user', 'cms', '', '')
+
+
+class FakeProxy(object):
+    """ Stands for WMCore.Credential.Proxy: counts the proxies retrieved from MyProxy. """
+    instances = []
+    timeleft = 3600
+
+    def __init__(self, args):
+        self.args = args
+        FakeProxy.instances.append(self)
+
+    def getProxyFilename(self, serverRenewer=False):
+        return '/tmp/fake_proxy_%d' % len(FakeProxy.instances)
+
+    def logonRenewMyProxy(self):
+        ## give the other threads the time to ask for the same proxy
+        time.sleep(0.1)
+
+    def getTimeLeft(self, proxy):
+        return FakeProxy.timeleft
+
+
+class FakeSchedd(object):
+    """ Stands for htcondor.Schedd. It runs in the authenticated subprocess. """
+    def __init__(self, failing=None):
+        self.failing = failing or []
+
+    def refreshGSIProxy(self, cluster, proc, proxy, lifetime):
+        if cluster in self.failing:
+            raise RuntimeError("refresh of %s failed" % cluster)
+        return 3600
+
+    def edit(self, jobids, attr, value):
+        pass
+
+
+def makeConfig():
+    config = Configuration()
+    config.section_('TaskWorker')
+    config.TaskWorker.resturl = 'crabserver.example.com'
+    config.section_('Services')
+    config.Services.MyProxy = 'myproxy.example.com'
+    config.section_('MyProxy')
+    config.MyProxy.serverhostkey = '/tmp/hostkey.pem'
+    config.MyProxy.serverhostcert = '/tmp/hostcert.pem'
+    config.MyProxy.serverdn = '/DC=ch/CN=server'
+    config.MyProxy.credpath = '/tmp'
+    return config
+
+
+def makeAd(cluster):
+    ad = classad.ClassAd()
+    ad['CRAB_ReqName'] = 'task_%d' % cluster
+    ad['ClusterId'] = cluster
+    ad['ProcId'] = 0
+    ad['CRAB_UserDN'] = USER[0]
+    ad['CRAB_UserVO'] = USER[1]
+    return ad
+
+
+@unittest.skipIf(IMPORT_ERROR, "HTCondor bindings or WMCore not available: %s" % IMPORT_ERROR)
+class RenewRemoteProxiesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.proxyClass = RenewRemoteProxies.Proxy
+        RenewRemoteProxies.Proxy = FakeProxy
+        FakeProxy.instances = []
+        FakeProxy.timeleft = 3600
+        self.renewer = RenewRemoteProxies.CRAB3ProxyRenewer(makeConfig(), 'crabserver.example.com', '/crabserver/dev/info',
+                                                            logging.getLogger(__name__))
+        self.renewer.metrics_lock = threading.Lock()
+
+    def tearDown(self):
+        RenewRemoteProxies.Proxy = self.proxyClass
+
+    def testProxyCacheRetrievesOnce(self):
+        proxies = RenewRemoteProxies.ProxyCache(self.renewer.get_proxy)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(proxies.get(USER, makeAd(1)))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(FakeProxy.instances), 1)
+        self.assertEqual(results, ['/tmp/fake_proxy_1'] * 5)
+        self.assertEqual((proxies.retrieved, proxies.failed), (1, 0))
+        ## another user
+        proxies.get(('/DC=ch/CN=other', 'cms', '', ''), makeAd(2))
+        self.assertEqual(len(FakeProxy.instances), 2)
+
+    def testProxyCacheRemembersFailures(self):
+        FakeProxy.timeleft = 0
+        proxies = RenewRemoteProxies.ProxyCache(self.renewer.get_proxy)
+        self.assertRaises(Exception, proxies.get, USER, makeAd(1))
+        self.assertRaises(Exception, proxies.get, USER, makeAd(2))
+        self.assertEqual(len(FakeProxy.instances), 1)
+        self.assertEqual((proxies.retrieved, proxies.failed), (0, 1))
+
+    def testRenewProxies(self):
+        ads = [makeAd(cluster) for cluster in [1, 2, 3]]
+        self.assertEqual(self.renewer.renew_proxies(FakeSchedd(), ads, '/tmp/fake_proxy'), 0)
+        ## the number of failed tasks comes back from the subprocess in the error message
+        self.assertEqual(self.renewer.renew_proxies(FakeSchedd(failing=[1, 3]), ads, '/tmp/fake_proxy'), 2)
+
+    def testExecuteUserMetrics(self):
+        ads = [makeAd(cluster) for cluster in [1, 2, 3]]
+        metrics = {'sessions': 0, 'tasks_renewed': 0, 'tasks_failed': 0}
+        limiter = RenewRemoteProxies.RateLimiter(0)
+        proxies = RenewRemoteProxies.ProxyCache(self.renewer.get_proxy)
+        self.renewer.execute_user(FakeSchedd(failing=[2]), 'schedd', USER, ads, proxies, limiter, metrics)
+        self.assertEqual(metrics, {'sessions': 1, 'tasks_renewed': 2, 'tasks_failed': 1})
+        ## the proxy of this user can not be retrieved: no session, all the tasks failed
+        FakeProxy.timeleft = 0
+        user = ('/DC=ch/CN=other', 'cms', '', '')
+        self.renewer.execute_user(FakeSchedd(), 'schedd', user, ads, proxies, limiter, metrics)
+        self.assertEqual(metrics, {'sessions': 1, 'tasks_renewed': 2, 'tasks_failed': 4})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Unit tests of the command-scoped imports of TaskManagerBootstrap.
+
+The pre-job runs for every node of every DAG, so its start-up time matters: if a
+change makes PREJOB import more modules (of this project, of WMCore or other
+third party packages) than the ones in PREJOB_BASELINE, this test fails. Update
+the baseline only if the new module is really needed by the pre-job.
+
+The import tests need the HTCondor python bindings and the modules of the pre-job
+runtime (see bin/htcondor_make_runtime.sh) in the PYTHONPATH, as set by
+dag_bootstrap.sh. They are skipped if those are not importable, e.g. in a source
+checkout with only src/python in the PYTHONPATH.
+"""
+import sys
+import json
+import unittest
+import subprocess
+
+## Modules outside the standard library that PREJOB is allowed to import.
+PREJOB_BASELINE = set([
+    'TaskWorker',
+    'TaskWorker.TaskManagerBootstrap',
+    'TaskWorker.Actions',
+    'TaskWorker.Actions.PreJob',
+    'TaskWorker.Actions.RetryJob',
+    'TaskWorker.Actions.TaskStatistics',
+    'ApmonIf',
+    'DashboardAPI',
+    'apmon',
+    'Logger',
+    'ProcInfo',
+    'ServerUtilities',
+    'CMSGroupMapper',
+])
+## Binary modules of HTCondor, which may come with submodules.
+PREJOB_BASELINE_PACKAGES = set(['classad', 'htcondor'])
+
+## Print the modules outside the standard library loaded by the command.
+LIST_MODULES = """
+import sys, json
+from distutils import sysconfig
+import TaskWorker.TaskManagerBootstrap as TaskManagerBootstrap
+TaskManagerBootstrap.importCommand(sys.argv[1])
+stdlib = sysconfig.get_python_lib(standard_lib=True)
+external = []
+for name, module in sys.modules.items():
+    fileName = getattr(module, '__file__', None)
+    if fileName and (not fileName.startswith(stdlib) or 'site-packages' in fileName or 'dist-packages' in fileName):
+        external.append(name)
+print(json.dumps(sorted(external)))
+"""
+
+
+## Imported by PREJOB, and not importable from a source checkout: the HTCondor bindings, and
+## ApmonIf, whose relative import of DashboardAPI fails with src/python as a top-level path.
+RUNTIME_MODULES = ['classad', 'htcondor', 'ApmonIf']
+
+def checkRuntime():
+    """Skip the test if the modules of the runtime can not be imported."""
+    proc = subprocess.Popen([sys.executable, '-c', 'import %s' % ', '.join(RUNTIME_MODULES)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = proc.communicate()
+    if proc.returncode:
+        lines = stderr.strip().splitlines()
+        raise unittest.SkipTest("The pre-job runtime is not importable: %s" % (lines[-1] if lines else 'unknown error'))
+
+
+def importedModules(command):
+    proc = subprocess.Popen([sys.executable, '-c', LIST_MODULES, command], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate()
+    if proc.returncode:
+        raise RuntimeError("Failed to import the modules of %s:\n%s" % (command, stderr))
+    return set(json.loads(stdout.splitlines()[-1]))
+
+
+class TaskManagerBootstrapTest(unittest.TestCase):
+
+    def testPreJobImports(self):
+        checkRuntime()
+        modules = importedModules('PREJOB')
+        unexpected = sorted(name for name in modules - PREJOB_BASELINE \
+                            if name.split('.')[0] not in PREJOB_BASELINE_PACKAGES)
+        self.assertEqual(unexpected, [], "PREJOB imports modules outside its baseline: %s" % (', '.join(unexpected)))
+
+    def testPreJobDoesNotImportOtherCommands(self):
+        checkRuntime()
+        modules = importedModules('PREJOB')
+        for name in ['TaskWorker.Actions.PostJob', 'TaskWorker.Actions.DagmanCreator', \
+                     'TaskWorker.Actions.DBSDataDiscovery', 'TaskWorker.Actions.Splitter', 'TaskWorker.Actions.Final']:
+            self.assertFalse(name in modules, "PREJOB imports %s" % (name))
+
+    def testUnknownCommand(self):
+        import TaskWorker.TaskManagerBootstrap as TaskManagerBootstrap
+        self.assertRaises(ValueError, TaskManagerBootstrap.importCommand, 'UNKNOWN')
+
+
+if __name__ == '__main__':
+    unittest.main()
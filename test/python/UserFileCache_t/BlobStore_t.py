@@ -0,0 +1,113 @@
+"""
+Unit tests of the blob store and of the garbage collector of the UserFileCache.
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from UserFileCache.QuotaLedger import QuotaLedger
+from UserFileCache.BlobStore import blob_path, link_blob, replace_with_blob, collect_garbage, ORPHAN_GRACE
+
+DAY = 24 * 3600
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def userFile(self, username, name):
+        return os.path.join(self.cachedir, username[0], username, name[0:2], name)
+
+    def storeBlob(self, hashkey, size, age=0):
+        blobname = blob_path(self.cachedir, hashkey)
+        if not os.path.isdir(os.path.dirname(blobname)):
+            os.makedirs(os.path.dirname(blobname))
+        with open(blobname, 'w') as fd:
+            fd.write('x' * size)
+        self.setAge(blobname, age)
+        return blobname
+
+    def upload(self, username, hashkey):
+        """ What RESTFile.put does for a sandbox already in the blob store. """
+        filename = self.userFile(username, hashkey)
+        self.assertTrue(link_blob(blob_path(self.cachedir, hashkey), filename))
+        QuotaLedger(os.path.dirname(os.path.dirname(filename))).update(hashkey, os.path.getsize(filename))
+        return filename
+
+    def setAge(self, filename, age):
+        accessed = time.time() - age
+        os.utime(filename, (accessed, accessed))
+
+    def testLinks(self):
+        blobname = self.storeBlob('aa11', 100)
+        first = self.upload('alice', 'aa11')
+        second = self.upload('bob', 'aa11')
+        self.assertEqual(os.stat(blobname).st_nlink, 3)
+        self.assertEqual(os.stat(first).st_ino, os.stat(second).st_ino)
+        ## each user pays for the sandbox
+        self.assertEqual(QuotaLedger(os.path.join(self.cachedir, 'a', 'alice')).used(), 100)
+        self.assertEqual(QuotaLedger(os.path.join(self.cachedir, 'b', 'bob')).used(), 100)
+        self.assertFalse(link_blob(blob_path(self.cachedir, 'bb22'), self.userFile('alice', 'bb22')))
+
+    def testReplaceWithBlob(self):
+        """ What RESTFile.store_sandbox does with the copy of a user, when the blob of its content exists. """
+        blobname = self.storeBlob('aa11', 100)
+        filename = self.userFile('alice', 'cc33')
+        os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as fd:
+            fd.write('x' * 100)
+        self.assertTrue(replace_with_blob(blobname, filename))
+        self.assertEqual(os.stat(filename).st_ino, os.stat(blobname).st_ino)
+        self.assertEqual(os.listdir(os.path.dirname(filename)), ['cc33'])
+        ## no blob: the user keeps the copy
+        self.assertFalse(replace_with_blob(blob_path(self.cachedir, 'bb22'), filename))
+        self.assertEqual(os.stat(filename).st_nlink, 2)
+
+    def testExpiry(self):
+        blobname = self.storeBlob('aa11', 100)
+        old = self.upload('alice', 'aa11')
+        self.upload('bob', 'aa11')
+        self.setAge(old, 40 * DAY)
+        self.storeBlob('bb22', 10)
+        recent = self.upload('alice', 'bb22')
+        result = collect_garbage(self.cachedir, 30 * DAY)
+        self.assertEqual((result['files'], result['blobs'], result['bytes']), (2, 1, 100))
+        self.assertFalse(os.path.exists(old))
+        self.assertFalse(os.path.exists(blobname))
+        self.assertTrue(os.path.exists(recent))
+        self.assertEqual(QuotaLedger(os.path.join(self.cachedir, 'a', 'alice')).used(), 10)
+        self.assertEqual(QuotaLedger(os.path.join(self.cachedir, 'b', 'bob')).used(), 0)
+
+    def testLeastRecentlyUsed(self):
+        for i, age in enumerate([3, 1, 2]):
+            self.storeBlob('aa1%d' % i, 100)
+            self.setAge(self.upload('alice', 'aa1%d' % i), age * DAY)
+        result = collect_garbage(self.cachedir, 30 * DAY, maxsize=150)
+        self.assertEqual(result['files'], 2)
+        self.assertTrue(os.path.exists(self.userFile('alice', 'aa11')))
+        self.assertEqual(QuotaLedger(os.path.join(self.cachedir, 'a', 'alice')).used(), 100)
+
+    def testOrphans(self):
+        ## removed by its user a while ago, and just uploaded
+        unused = self.storeBlob('aa11', 100, age=2 * ORPHAN_GRACE)
+        new = self.storeBlob('bb22', 100)
+        spooled = os.path.join(os.path.dirname(unused), '.aa11.x.tmp')
+        open(spooled, 'w').close()
+        self.setAge(spooled, 2 * ORPHAN_GRACE)
+        result = collect_garbage(self.cachedir, 30 * DAY, dryrun=True)
+        self.assertEqual((result['blobs'], result['temporary']), (1, 1))
+        self.assertTrue(os.path.exists(unused))
+        collect_garbage(self.cachedir, 30 * DAY)
+        self.assertFalse(os.path.exists(unused))
+        self.assertFalse(os.path.exists(spooled))
+        self.assertTrue(os.path.exists(new))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Unit tests of the per user quota ledger of the UserFileCache.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import UserFileCache.QuotaLedger as QuotaLedgerModule
+from UserFileCache.QuotaLedger import QuotaLedger, LEDGER_NAME
+
+
+class QuotaLedgerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+        self.userpath = os.path.join(self.cachedir, 'u', 'user')
+        self.interval = QuotaLedgerModule.RECONCILE_INTERVAL
+
+    def tearDown(self):
+        QuotaLedgerModule.RECONCILE_INTERVAL = self.interval
+        shutil.rmtree(self.cachedir)
+
+    def writeFile(self, name, size):
+        dirname = os.path.join(self.userpath, name[0:2])
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, name), 'w') as fd:
+            fd.write('x' * size)
+
+    def testNoUserDirectory(self):
+        self.assertEqual(QuotaLedger(self.userpath).used(), 0)
+        self.assertFalse(os.path.exists(self.userpath))
+
+    def testScan(self):
+        self.writeFile('aa1', 100)
+        self.writeFile('bb2', 50)
+        ledger = QuotaLedger(self.userpath).load()
+        self.assertEqual(ledger['used'], 150)
+        self.assertEqual(sorted(ledger['files']), ['aa1', 'bb2'])
+        self.assertTrue(os.path.isfile(os.path.join(self.userpath, LEDGER_NAME)))
+
+    def testUpdateAndRemove(self):
+        ledger = QuotaLedger(self.userpath)
+        self.writeFile('aa1', 100)
+        ledger.update('aa1', 100)
+        self.assertEqual(ledger.used(), 100)
+        ## overwritten
+        self.writeFile('aa1', 30)
+        ledger.update('aa1', 30)
+        self.assertEqual(ledger.used(), 30)
+        self.writeFile('bb2', 50)
+        ledger.update('bb2', 50)
+        os.remove(os.path.join(self.userpath, 'aa', 'aa1'))
+        ledger.remove('aa1')
+        self.assertEqual(ledger.used(), 50)
+        self.assertEqual(sorted(ledger.load()['files']), ['bb2'])
+
+    def testReconciliation(self):
+        ledger = QuotaLedger(self.userpath)
+        self.writeFile('aa1', 100)
+        ledger.update('aa1', 100)
+        ## removed behind the back of the ledger
+        os.remove(os.path.join(self.userpath, 'aa', 'aa1'))
+        self.assertEqual(ledger.used(), 100)
+        QuotaLedgerModule.RECONCILE_INTERVAL = -1
+        self.assertEqual(ledger.used(), 0)
+
+    def testCorruptedLedger(self):
+        ledger = QuotaLedger(self.userpath)
+        self.writeFile('aa1', 100)
+        ledger.update('aa1', 100)
+        with open(os.path.join(self.userpath, LEDGER_NAME), 'w') as fd:
+            fd.write('{"used": 5, "files": {')
+        self.assertEqual(ledger.used(), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+"""
+Unit tests of the concurrent stageout of cmscp.py, with a stub transfer function
+copying synthetic files to a local directory (like the cp plugin with file://
+destinations). cmscp.py needs WMCore, and scripts/ in the PYTHONPATH.
+"""
+import os
+import sys
+import time
+import errno
+import shutil
+import signal
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+
+## cmscp writes a sentry file in the current directory when imported.
+CWD = os.getcwd()
+IMPORT_DIR = tempfile.mkdtemp()
+os.chdir(IMPORT_DIR)
+try:
+    import cmscp
+    IMPORT_ERROR = None
+except ImportError as ex:
+    IMPORT_ERROR = str(ex)
+finally:
+    os.chdir(CWD)
+    shutil.rmtree(IMPORT_DIR)
+
+
+def stub_transfer(direct_stageout_impl, direct_stageout_command, direct_stageout_protocol, source_file, dest_pfn, is_log):
+    """ Stands for transfer_direct. What it does depends on the first line of the source file. """
+    with open(source_file) as fd:
+        action = fd.readline().split()
+    if action[0] == 'sleep':
+        time.sleep(float(action[1]))
+    elif action[0] == 'fail':
+        return 60311, "Stageout of %s failed." % (source_file), None
+    elif action[0] == 'hang':
+        ## a command of the stageout plugin that never ends
+        sleeper = subprocess.Popen(['sleep', '600'])
+        with open(action[1], 'w') as fd:
+            fd.write(str(sleeper.pid))
+        time.sleep(600)
+    elif action[0] == 'die':
+        os._exit(3)
+    print("Copying %s to %s" % (source_file, dest_pfn))
+    shutil.copy(source_file, dest_pfn)
+    return 0, None, None
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as ex:
+        return ex.errno != errno.ESRCH
+    ## a zombie is not running anymore
+    with open('/proc/%d/stat' % pid) as fd:
+        return fd.read().split(')')[-1].split()[0] != 'Z'
+
+
+@unittest.skipIf(IMPORT_ERROR, "cmscp.py can not be imported: %s" % IMPORT_ERROR)
+class ConcurrentStageoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.saved = (cmscp.transfer_direct, cmscp.finish_direct_stageout, cmscp.G_STAGEOUT_WORKERS, cmscp.G_TRANSFERS_TIMEOUT)
+        self.finished = []
+        cmscp.transfer_direct = stub_transfer
+        cmscp.finish_direct_stageout = lambda dest_pfn, dest_site, is_log: self.finished.append(os.path.basename(dest_pfn))
+        del cmscp.G_DIRECT_STAGEOUTS[:]
+
+    def tearDown(self):
+        cmscp.transfer_direct, cmscp.finish_direct_stageout, cmscp.G_STAGEOUT_WORKERS, cmscp.G_TRANSFERS_TIMEOUT = self.saved
+        del cmscp.G_DIRECT_STAGEOUTS[:]
+        shutil.rmtree(self.workdir)
+
+    def makeTransfers(self, actions):
+        transfers = []
+        for i, action in enumerate(actions):
+            source_file = os.path.join(self.workdir, 'output_%d.root' % i)
+            with open(source_file, 'w') as fd:
+                fd.write(action + '\n' + 'x' * 1000)
+            transfers.append({'source_file': source_file, 'dest_temp_lfn': None, 'dest_lfn': None,
+                              'dest_pfn': os.path.join(self.workdir, 'dest_%d.root' % i),
+                              'dest_site': 'T2_XX_Site', 'is_log': False})
+        return transfers
+
+    def stageout(self, transfers):
+        return cmscp.perform_concurrent_stageouts(None, None, 'cp', 'file', 'remote', transfers, 'T2_XX_Site', False)
+
+    def started(self):
+        return [os.path.basename(info['dest_pfn']) for info in cmscp.G_DIRECT_STAGEOUTS]
+
+    def testSubmissionOrder(self):
+        cmscp.G_STAGEOUT_WORKERS = 3
+        ## the last one finishes first
+        transfers = self.makeTransfers(['sleep 1', 'sleep 0.5', 'sleep 0'])
+        results = self.stageout(transfers)
+        self.assertEqual(results, [(0, None)] * 3)
+        self.assertEqual(self.finished, ['dest_0.root', 'dest_1.root', 'dest_2.root'])
+        for transfer in transfers:
+            self.assertEqual(open(transfer['dest_pfn']).read(), open(transfer['source_file']).read())
+
+    def testNoTransferAfterFailure(self):
+        cmscp.G_STAGEOUT_WORKERS = 2
+        transfers = self.makeTransfers(['fail', 'sleep 0.5', 'sleep 0', 'sleep 0'])
+        results = self.stageout(transfers)
+        self.assertEqual(results[0][0], 60311)
+        ## already running when the first one failed
+        self.assertEqual(results[1], (0, None))
+        self.assertEqual(results[2:], [None, None])
+        self.assertEqual(self.started(), ['dest_0.root', 'dest_1.root'])
+        self.assertEqual(self.finished, ['dest_1.root'])
+
+    def testTimeout(self):
+        cmscp.G_STAGEOUT_WORKERS = 2
+        cmscp.G_TRANSFERS_TIMEOUT = 2
+        pidfile = os.path.join(self.workdir, 'sleeper.pid')
+        start = time.time()
+        results = self.stageout(self.makeTransfers(['hang %s' % pidfile, 'sleep 0']))
+        self.assertTrue(time.time() - start < 10)
+        self.assertEqual(results[0][0], 60403)
+        self.assertEqual(results[1], (0, None))
+        ## the whole process group of the transfer was killed
+        sleeper = int(open(pidfile).read())
+        for _ in range(50):
+            if not is_running(sleeper):
+                break
+            time.sleep(0.1)
+        else:
+            os.kill(sleeper, signal.SIGKILL)
+            self.fail("The command started by the transfer is still running")
+
+    def testDeadTransferProcess(self):
+        cmscp.G_STAGEOUT_WORKERS = 2
+        results = self.stageout(self.makeTransfers(['die', 'sleep 0']))
+        self.assertEqual(results[0][0], 60318)
+        self.assertTrue('without reporting its result' in results[0][1])
+        self.assertEqual(self.finished, ['dest_1.root'])
+
+
+if __name__ == '__main__':
+    unittest.main()